@@ -1,30 +1,145 @@
 from motor.motor_asyncio import AsyncIOMotorClient
+import contextvars
 import os
+import time
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+from .services.tracing import mongo_event_listeners  # noqa: E402 - reads tracing settings from .env
+
 # MongoDB connection
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
+# Connections per process; backend.serve divides MONGO_POOL_TOTAL across its workers
+client = AsyncIOMotorClient(
+    mongo_url,
+    maxPoolSize=int(os.environ.get('MONGO_MAX_POOL_SIZE', '100')),
+    event_listeners=mongo_event_listeners()
+)
 db = client[os.environ.get('DB_NAME', 'anvl_db')]
 
+# Read preference for the current request, set by services.read_preference.
+# None means primary, which is also what background jobs and scripts get.
+read_preference_var = contextvars.ContextVar("read_preference", default=None)
+
+# Only these follow read_preference_var; writes and find_one_and_* always hit the primary
+ROUTED_READS = frozenset({
+    "find", "find_one", "aggregate", "count_documents", "distinct", "estimated_document_count",
+})
+
+class RoutedCollection:
+    """Motor collection whose plain reads honour the request's read preference"""
+    def __init__(self, collection):
+        self._primary = collection
+        self._variants = {}
+    
+    def _routed(self, preference):
+        key = repr(preference)
+        if key not in self._variants:
+            self._variants[key] = self._primary.with_options(read_preference=preference)
+        return self._variants[key]
+    
+    def __getattr__(self, name):
+        if name in ROUTED_READS:
+            preference = read_preference_var.get()
+            if preference is not None:
+                return getattr(self._routed(preference), name)
+        return getattr(self._primary, name)
+
 # Collections
-dealers_collection = db.dealers
-loans_collection = db.loans
-vehicles_collection = db.vehicles
-audits_collection = db.audits
-transactions_collection = db.transactions
-notifications_collection = db.notifications
+dealers_collection = RoutedCollection(db.dealers)
+loans_collection = RoutedCollection(db.loans)
+vehicles_collection = RoutedCollection(db.vehicles)
+audits_collection = RoutedCollection(db.audits)
+transactions_collection = RoutedCollection(db.transactions)
+notifications_collection = RoutedCollection(db.notifications)
+portfolio_rollups_collection = RoutedCollection(db.portfolio_rollups)
+presale_events_collection = RoutedCollection(db.presale_events)
+indexer_checkpoints_collection = RoutedCollection(db.indexer_checkpoints)
+reward_epochs_collection = RoutedCollection(db.reward_epochs)
+reward_proofs_collection = RoutedCollection(db.reward_proofs)
+sync_counters_collection = RoutedCollection(db.sync_counters)
+sync_tombstones_collection = RoutedCollection(db.sync_tombstones)
+risk_findings_collection = RoutedCollection(db.risk_findings)
+rate_limit_buckets_collection = RoutedCollection(db.rate_limit_buckets)
+jobs_collection = RoutedCollection(db.jobs)
+loan_ledger_collection = RoutedCollection(db.loan_ledger)
+loan_balance_snapshots_collection = RoutedCollection(db.loan_balance_snapshots)
 
 async def get_database():
     return db
 
+# Until `id_migration --drop-legacy-id` has run, documents may still have an ObjectId `_id`
+# with the business id in `id`, and instances on older code look documents up by `id`.
+# While this is on, writes keep `id` and lookups fall back from `_id` to `id`.
+LEGACY_ID_COMPAT = os.environ.get('LEGACY_ID_COMPAT', 'true').lower() == 'true'
+
+# Aggregation expression for a document's business id in either layout
+BUSINESS_ID = {"$ifNull": ["$id", "$_id"]} if LEGACY_ID_COMPAT else "$_id"
+
+def id_filter(business_id):
+    """Filter for one document by business id"""
+    if LEGACY_ID_COMPAT:
+        return {"$or": [{"_id": business_id}, {"id": business_id}]}
+    return {"_id": business_id}
+
+def ids_filter(business_ids):
+    """Filter for the documents with any of the business ids"""
+    business_ids = list(business_ids)
+    if LEGACY_ID_COMPAT:
+        return {"$or": [{"_id": {"$in": business_ids}}, {"id": {"$in": business_ids}}]}
+    return {"_id": {"$in": business_ids}}
+
+def lookup_by_id(from_collection, local_field, as_field):
+    """`$lookup` stages joining `local_field` to another collection's business id"""
+    stages = [{"$lookup": {"from": from_collection.name, "localField": local_field, "foreignField": "_id", "as": as_field}}]
+    if LEGACY_ID_COMPAT:
+        legacy = f"{as_field}_legacy"
+        stages += [
+            {"$lookup": {"from": from_collection.name, "localField": local_field, "foreignField": "id", "as": legacy}},
+            {"$addFields": {as_field: {"$cond": [{"$gt": [{"$size": f"${as_field}"}, 0]}, f"${as_field}", f"${legacy}"]}}},
+            {"$project": {legacy: 0}},
+        ]
+    return stages
+
+# Per-request query budget, set by services.query_budget for the request's task
+class QueryBudget:
+    def __init__(self, budget_ms, tag=None):
+        self.deadline = time.monotonic() + budget_ms / 1000
+        self.tag = tag
+    
+    def remaining_ms(self):
+        return max(1, int((self.deadline - time.monotonic()) * 1000))
+
+query_budget_var = contextvars.ContextVar("query_budget", default=None)
+
+def find_options():
+    """maxTimeMS and request tag for find/find_one, or nothing outside a request"""
+    budget = query_budget_var.get()
+    if budget is None:
+        return {}
+    return {"max_time_ms": budget.remaining_ms(), "comment": budget.tag}
+
+def command_options():
+    """maxTimeMS and request tag for aggregate/count_documents, or nothing outside a request"""
+    budget = query_budget_var.get()
+    if budget is None:
+        return {}
+    return {"maxTimeMS": budget.remaining_ms(), "comment": budget.tag}
+
 # Helper functions for database operations
 async def create_indexes():
     """Create database indexes for better performance"""
     try:
+        # Legacy business id indexes, used by lookups until the id field is dropped
+        if LEGACY_ID_COMPAT:
+            for collection in (
+                dealers_collection, loans_collection, vehicles_collection,
+                audits_collection, transactions_collection, notifications_collection
+            ):
+                await collection.create_index("id", sparse=True)
+        
         # Dealers indexes
         await dealers_collection.create_index("wallet_address", unique=True)
         await dealers_collection.create_index("email", unique=True)
@@ -32,12 +147,29 @@ async def create_indexes():
         # Loans indexes
         await loans_collection.create_index("dealer_id")
         await loans_collection.create_index("status")
+        await loans_collection.create_index([("dealer_id", 1), ("created_at", -1)])
         
         # Vehicles indexes
         await vehicles_collection.create_index("dealer_id")
         await vehicles_collection.create_index("vin", unique=True)
-        await vehicles_collection.create_index("loan_id")
+        await vehicles_collection.create_index([("loan_id", 1), ("created_at", -1)])
         await vehicles_collection.create_index("status")
+        await vehicles_collection.create_index(
+            [("make", "text"), ("model", "text"), ("vin", "text"), ("color", "text")],
+            weights={"vin": 10, "make": 5, "model": 5, "color": 1},
+            name="vehicle_text_search"
+        )
+        await vehicles_collection.create_index([("dealer_id", 1), ("status", 1), ("price", 1)])
+        await vehicles_collection.create_index([("dealer_id", 1), ("make", 1), ("year", -1)])
+        await vehicles_collection.create_index([("dealer_id", 1), ("year", -1), ("mileage", 1)])
+        await vehicles_collection.create_index([("dealer_id", 1), ("created_at", -1)])
+        await vehicles_collection.create_index("vin_normalized")
+        await vehicles_collection.create_index([("vin_last8", 1), ("dealer_id", 1)])
+        await vehicles_collection.create_index("vin_reversed")
+        await vehicles_collection.create_index("nfc_tag_id", sparse=True)
+        await vehicles_collection.create_index([("dealer_id", 1), ("sync_seq", 1)])
+        await vehicles_collection.create_index([("status", 1), ("sold_date", 1)])
+        await vehicles_collection.create_index([("status", 1), ("last_audit", 1), ("created_at", 1)])
         
         # Audits indexes
         await audits_collection.create_index("dealer_id")
@@ -46,12 +178,64 @@ async def create_indexes():
         
         # Transactions indexes
         await transactions_collection.create_index("dealer_id")
-        await transactions_collection.create_index("loan_id")
+        await transactions_collection.create_index([("loan_id", 1), ("timestamp", -1)])
         await transactions_collection.create_index("timestamp")
+        await transactions_collection.create_index([("type", 1), ("status", 1), ("reward_epoch", 1)])
+        await transactions_collection.create_index([("reward_epoch", 1), ("dealer_id", 1)], sparse=True)
+        await transactions_collection.create_index("ach_trace", sparse=True)
         
         # Notifications indexes
         await notifications_collection.create_index("dealer_id")
         await notifications_collection.create_index("timestamp")
+        await notifications_collection.create_index([("dealer_id", 1), ("timestamp", -1)])
+        await notifications_collection.create_index(
+            "coalesce_key", unique=True, partialFilterExpression={"coalesce_key": {"$exists": True}}
+        )
+        await notifications_collection.create_index(
+            "last_seen", partialFilterExpression={"digest_pending": True}, name="digest_pending_last_seen"
+        )
+        
+        # Portfolio rollups indexes
+        await portfolio_rollups_collection.create_index(
+            [("granularity", 1), ("period_start", -1), ("dealer_id", 1)]
+        )
+        await portfolio_rollups_collection.create_index(
+            [("dealer_id", 1), ("granularity", 1), ("period_start", -1)]
+        )
+        
+        # Presale events indexes
+        await presale_events_collection.create_index([("buyer", 1), ("event", 1), ("block_number", 1)])
+        await presale_events_collection.create_index([("event", 1), ("block_number", -1)])
+        await presale_events_collection.create_index([("contract", 1), ("block_number", 1)])
+        
+        # Reward proofs indexes
+        await reward_proofs_collection.create_index([("dealer_id", 1), ("epoch", -1)])
+        await reward_proofs_collection.create_index([("wallet_address", 1), ("epoch", -1)])
+        
+        # Risk findings indexes
+        await risk_findings_collection.create_index([("rule", 1), ("status", 1)])
+        await risk_findings_collection.create_index([("dealer_id", 1), ("status", 1), ("detected_at", -1)])
+        
+        # Sync tombstones indexes
+        await sync_tombstones_collection.create_index([("dealer_id", 1), ("sync_seq", 1)])
+        
+        # Loan ledger indexes
+        await loan_ledger_collection.create_index([("loan_id", 1), ("effective_at", 1)])
+        await loan_ledger_collection.create_index("recorded_at")
+        await loan_balance_snapshots_collection.create_index([("loan_id", 1), ("as_of", -1)])
+        
+        # Jobs indexes
+        await jobs_collection.create_index([("status", 1), ("run_at", 1)])
+        await jobs_collection.create_index([("status", 1), ("lease_expires_at", 1)])
+        await jobs_collection.create_index(
+            "dedupe_key", unique=True, partialFilterExpression={"dedupe_key": {"$exists": True}}
+        )
+        await jobs_collection.create_index(
+            "finished_at", expireAfterSeconds=7 * 24 * 60 * 60, partialFilterExpression={"status": "done"}
+        )
+        
+        # Rate limit buckets indexes (idle buckets are full again, so they can expire)
+        await rate_limit_buckets_collection.create_index("updated_at", expireAfterSeconds=3600)
         
         print("Database indexes created successfully")
     except Exception as e:
@@ -64,14 +248,36 @@ def convert_objectid_to_str(document):
         document["_id"] = str(document["_id"])
     return document
 
-async def find_one_and_convert(collection, filter_dict):
-    """Find one document and convert ObjectId to string"""
-    document = await collection.find_one(filter_dict)
-    return convert_objectid_to_str(document) if document else None
+def to_document(data):
+    """Storage layout for a model dict: the business id is stored as `_id`
+    
+    The `id` field is kept as well while LEGACY_ID_COMPAT is on, so instances
+    still on the old code can find new documents.
+    """
+    document = dict(data)
+    if "id" in document:
+        document["_id"] = document["id"] if LEGACY_ID_COMPAT else document.pop("id")
+    return document
+
+def from_document(document):
+    """API layout for a stored document: `_id` is exposed as `id`
+    
+    Documents still carrying the legacy `id` field keep it, and an ObjectId
+    `_id` from before `services.id_migration` is dropped.
+    """
+    if document and "_id" in document:
+        primary_key = document.pop("_id")
+        document.setdefault("id", primary_key)
+    return document
+
+async def find_one_and_convert(collection, filter_dict, projection=None):
+    """Find one document in API layout"""
+    document = await collection.find_one(filter_dict, projection, **find_options())
+    return from_document(document) if document else None
 
 async def find_many_and_convert(collection, filter_dict, limit=None, sort=None):
-    """Find multiple documents and convert ObjectId to string"""
-    cursor = collection.find(filter_dict)
+    """Find multiple documents in API layout"""
+    cursor = collection.find(filter_dict, **find_options())
     
     if sort:
         cursor = cursor.sort(sort)
@@ -79,4 +285,4 @@ async def find_many_and_convert(collection, filter_dict, limit=None, sort=None):
         cursor = cursor.limit(limit)
     
     documents = await cursor.to_list(length=limit)
-    return [convert_objectid_to_str(doc) for doc in documents]
\ No newline at end of file
+    return [from_document(doc) for doc in documents]
@@ -28,6 +28,7 @@ class AuditStatus(str, Enum):
 class TransactionType(str, Enum):
     loan_disbursement = "loan_disbursement"
     payment = "payment"
+    payment_return = "payment_return"
     anvl_reward = "anvl_reward"
     fee = "fee"
 
@@ -89,6 +90,9 @@ class LoanUpdate(BaseModel):
     next_payment_due: Optional[datetime] = None
     next_payment_amount: Optional[float] = None
 
+class LoanBatchApproval(BaseModel):
+    loan_ids: List[str]
+
 class Loan(LoanBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     dealer_id: str
@@ -122,6 +126,11 @@ class VehicleUpdate(BaseModel):
     status: Optional[VehicleStatus] = None
     sold_date: Optional[datetime] = None
 
+class VinLookupRequest(BaseModel):
+    vins: List[str]
+    mode: str = "auto"  # auto, exact, prefix, suffix, last8
+    dealer_id: Optional[str] = None
+
 class Vehicle(VehicleBase):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     dealer_id: str
@@ -177,6 +186,9 @@ class Transaction(TransactionBase):
     method: Optional[str] = None
     tx_hash: Optional[str] = None
     status: str = "pending"
+    reward_epoch: Optional[int] = None
+    ach_trace: Optional[str] = None  # ACH trace number of a settled or returned entry
+    return_reason: Optional[str] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -195,6 +207,10 @@ class Notification(NotificationBase):
     dealer_id: str
     severity: NotificationSeverity
     read: bool = False
+    subject_id: Optional[str] = None  # e.g. the vehicle a coalesced alert is about
+    occurrences: int = 1
+    first_seen: Optional[datetime] = None
+    last_seen: Optional[datetime] = None
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from datetime import datetime
+import asyncio
+import logging
+import os
+
+from ..services.admin_auth import require_admin
+from ..services.profiling import (
+    MAX_PROFILE_SECONDS, SAMPLE_INTERVAL_MS, TOP_FUNCTIONS,
+    profile_process, memory_tracing, take_memory_baseline, memory_diff, stop_memory_tracing
+)
+
+router = APIRouter(prefix="/admin", tags=["admin"], dependencies=[require_admin()])
+logger = logging.getLogger(__name__)
+
+# One process profile at a time per worker; overlapping samplers skew each other
+_profile_lock = asyncio.Lock()
+
+@router.get("/profile", response_class=PlainTextResponse)
+async def profile_worker(seconds: float = 10, interval_ms: float = SAMPLE_INTERVAL_MS):
+    """Sample this worker's threads and return flamegraph-compatible collapsed stacks"""
+    try:
+        if _profile_lock.locked():
+            raise HTTPException(status_code=409, detail="A profile is already running on this worker")
+        
+        async with _profile_lock:
+            profiler = await profile_process(
+                max(0.1, min(seconds, MAX_PROFILE_SECONDS)),
+                max(1.0, interval_ms)
+            )
+        
+        filename = f"profile-{os.getpid()}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.collapsed"
+        return PlainTextResponse(
+            profiler.collapsed(),
+            headers={
+                "Content-Disposition": f'attachment; filename="{filename}"',
+                "X-Profile-Samples": str(profiler.samples),
+            }
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error profiling worker: {e}")
+        raise HTTPException(status_code=500, detail="Failed to profile worker")
+
+@router.get("/memory")
+async def get_memory_tracing():
+    """Get tracemalloc status for this worker"""
+    return {"success": True, "data": memory_tracing()}
+
+@router.post("/memory/snapshot")
+async def snapshot_memory():
+    """Start tracemalloc if needed and take the baseline snapshot to diff against"""
+    try:
+        data = await take_memory_baseline()
+        return {"success": True, "data": data, "message": "Memory baseline taken"}
+
+    except Exception as e:
+        logger.error(f"Error taking memory snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Failed to take memory snapshot")
+
+@router.get("/memory/diff")
+async def diff_memory(group_by: str = "lineno", limit: int = TOP_FUNCTIONS):
+    """Get the allocation sites that grew most since the baseline snapshot"""
+    try:
+        stats = await memory_diff(group_by, max(1, min(limit, 500)))
+        return {"success": True, "data": {"tracing": memory_tracing(), "stats": stats}}
+
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error diffing memory snapshots: {e}")
+        raise HTTPException(status_code=500, detail="Failed to diff memory snapshots")
+
+@router.delete("/memory")
+async def stop_memory():
+    """Stop tracemalloc and drop the baseline, removing its overhead"""
+    return {"success": True, "data": stop_memory_tracing(), "message": "Memory tracing stopped"}
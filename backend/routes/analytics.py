@@ -0,0 +1,140 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+from datetime import datetime, timedelta
+import logging
+
+from pymongo.errors import ExecutionTimeout
+
+from ..services.portfolio_rollups import (
+    GRANULARITIES, read_rollups, compute_window, refresh_rollups, period_start
+)
+from ..services.out_of_trust import RULES, list_findings, run_detection
+from ..services.query_budget import query_budget, budget_exceeded, REPORT_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads
+
+router = APIRouter(
+    prefix="/analytics",
+    tags=["analytics"],
+    dependencies=[query_budget(REPORT_QUERY_BUDGET_MS), route_reads("analytics")]
+)
+logger = logging.getLogger(__name__)
+
+MAX_WINDOW_DAYS = 366
+
+@router.get("/portfolio")
+async def get_portfolio_rollups(
+    granularity: str = "daily",
+    dealer_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None
+):
+    """Get precomputed portfolio exposure rollups for a window"""
+    try:
+        if granularity not in GRANULARITIES:
+            raise HTTPException(status_code=400, detail=f"Unsupported granularity: {granularity}")
+        
+        end = end or datetime.utcnow() + GRANULARITIES[granularity]
+        start = start or end - timedelta(days=30 if granularity == "daily" else 2)
+        if end <= start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        
+        periods = await read_rollups(granularity, start, end, dealer_id=dealer_id)
+        return {
+            "success": True,
+            "data": {
+                "granularity": granularity,
+                "start": start,
+                "end": end,
+                "periods": periods
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error getting portfolio rollups: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve portfolio analytics")
+
+@router.get("/portfolio/latest")
+async def get_latest_portfolio(dealer_id: Optional[str] = None):
+    """Get the most recent hourly portfolio snapshot"""
+    try:
+        now = datetime.utcnow()
+        start = period_start(now, "hourly") - timedelta(hours=1)
+        periods = await read_rollups("hourly", start, now + timedelta(hours=1), dealer_id=dealer_id)
+        
+        return {"success": True, "data": periods[-1] if periods else None}
+        
+    except Exception as e:
+        logger.error(f"Error getting latest portfolio snapshot: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve portfolio analytics")
+
+@router.post("/portfolio/recompute")
+async def recompute_portfolio(
+    start: datetime,
+    end: Optional[datetime] = None,
+    dealer_id: Optional[str] = None
+):
+    """Compute exposure and cash flows for an arbitrary window on demand"""
+    try:
+        end = end or datetime.utcnow()
+        if end <= start:
+            raise HTTPException(status_code=400, detail="end must be after start")
+        if end - start > timedelta(days=MAX_WINDOW_DAYS):
+            raise HTTPException(status_code=400, detail=f"Window cannot exceed {MAX_WINDOW_DAYS} days")
+        
+        data = await compute_window(start, end, dealer_id=dealer_id)
+        return {"success": True, "data": data}
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error recomputing portfolio analytics: {e}")
+        raise HTTPException(status_code=500, detail="Failed to compute portfolio analytics")
+
+@router.post("/portfolio/refresh")
+async def refresh_portfolio_rollups():
+    """Refresh the current hourly and daily rollups immediately"""
+    try:
+        await refresh_rollups()
+        return {"success": True, "message": "Portfolio rollups refreshed"}
+        
+    except Exception as e:
+        logger.error(f"Error refreshing portfolio rollups: {e}")
+        raise HTTPException(status_code=500, detail="Failed to refresh portfolio rollups")
+
+@router.get("/out-of-trust")
+async def get_out_of_trust_findings(
+    dealer_id: Optional[str] = None,
+    rule: Optional[str] = None,
+    status: Optional[str] = "open",
+    limit: int = 100
+):
+    """Get sold-out-of-trust and audit-stale findings"""
+    try:
+        if rule and rule not in RULES:
+            raise HTTPException(status_code=400, detail=f"Unsupported rule: {rule}")
+        
+        findings = await list_findings(dealer_id, rule, status, limit=max(1, min(limit, 1000)))
+        return {"success": True, "data": findings}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting out-of-trust findings: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve findings")
+
+@router.post("/out-of-trust/run")
+async def run_out_of_trust_detection():
+    """Run out-of-trust detection immediately"""
+    try:
+        summary = await run_detection()
+        return {"success": True, "data": summary, "message": "Out-of-trust detection completed"}
+        
+    except Exception as e:
+        logger.error(f"Error running out-of-trust detection: {e}")
+        raise HTTPException(status_code=500, detail="Failed to run out-of-trust detection")
@@ -3,63 +3,83 @@ from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 
+from pymongo.errors import ExecutionTimeout
+
 from ..models import (
     Audit, AuditCreate, AuditsResponse,
-    AuditStatus, Notification, NotificationCreate, NotificationSeverity,
+    AuditStatus, NotificationCreate, NotificationSeverity,
     GPSLocation
 )
 from ..database import (
-    audits_collection, vehicles_collection, dealers_collection, notifications_collection,
-    find_one_and_convert, find_many_and_convert
+    audits_collection, vehicles_collection, dealers_collection,
+    to_document, from_document, find_one_and_convert, find_options, command_options, id_filter
 )
+from ..services.vin_lookup import nfc_tag_cache, normalize_scanned_vin
+from ..services.sync import sync_stamp
+from ..services.retention import find_with_archive
+from ..services.jobs import send_compliance_alert
+from ..services.query_budget import query_budget, budget_exceeded, REPORT_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads, primary_reads
 
-router = APIRouter(prefix="/audits", tags=["audits"])
+router = APIRouter(prefix="/audits", tags=["audits"], dependencies=[route_reads("audits")])
 logger = logging.getLogger(__name__)
 
-@router.post("/", response_model=AuditsResponse)
-async def create_audit(audit_data: AuditCreate):
-    """Create a new NFC audit record"""
-    try:
-        # Verify vehicle exists
-        vehicle = await find_one_and_convert(vehicles_collection, {"id": audit_data.vehicle_id})
-        if not vehicle:
-            raise HTTPException(status_code=404, detail="Vehicle not found")
-        
-        # Create audit
-        new_audit = Audit(**audit_data.dict())
-        
-        # Determine compliance status based on location (mock logic)
-        dealer_location = GPSLocation(lat=34.0522, lng=-118.2437)  # Mock dealer lot location
-        distance = abs(audit_data.location.lat - dealer_location.lat) + abs(audit_data.location.lng - dealer_location.lng)
-        
-        if distance > 0.005:  # ~500 meters threshold
-            new_audit.status = AuditStatus.flagged
-            
-            # Create compliance notification
-            notification = Notification(
-                dealer_id=audit_data.dealer_id,
-                type="compliance_alert",
-                title="Vehicle Location Alert",
-                message=f"Vehicle VIN {audit_data.vin} flagged for location compliance",
-                severity=NotificationSeverity.warning
-            )
-            await notifications_collection.insert_one(notification.dict())
-        else:
-            new_audit.status = AuditStatus.compliant
+async def _record_audit(audit_data: AuditCreate, nfc_tag_id: Optional[str] = None) -> Optional[Audit]:
+    """Insert an audit and stamp the vehicle; None if the vehicle (still carrying the tag, if given) is gone"""
+    vehicle_filter = id_filter(audit_data.vehicle_id)
+    if nfc_tag_id:
+        vehicle_filter = {**vehicle_filter, "nfc_tag_id": nfc_tag_id}
+    
+    # Verify vehicle exists
+    vehicle = await vehicles_collection.find_one(vehicle_filter, {"_id": 1}, **find_options())
+    if not vehicle:
+        return None
+    
+    # Create audit
+    new_audit = Audit(**audit_data.dict())
+    
+    # Determine compliance status based on location (mock logic)
+    dealer_location = GPSLocation(lat=34.0522, lng=-118.2437)  # Mock dealer lot location
+    distance = abs(audit_data.location.lat - dealer_location.lat) + abs(audit_data.location.lng - dealer_location.lng)
+    
+    if distance > 0.005:  # ~500 meters threshold
+        new_audit.status = AuditStatus.flagged
         
-        await audits_collection.insert_one(new_audit.dict())
-        
-        # Update vehicle last audit time
+        # Create or coalesce the compliance notification for this vehicle in the background
+        await send_compliance_alert(
+            dealer_id=audit_data.dealer_id,
+            subject_id=audit_data.vehicle_id,
+            title="Vehicle Location Alert",
+            message=f"Vehicle VIN {audit_data.vin} flagged for location compliance",
+            severity=NotificationSeverity.warning
+        )
+    else:
+        new_audit.status = AuditStatus.compliant
+    
+    await audits_collection.insert_one(to_document(new_audit.dict()))
+    
+    # Update vehicle last audit time
+    async with sync_stamp() as stamp:
         await vehicles_collection.update_one(
-            {"id": audit_data.vehicle_id},
+            vehicle_filter,
             {
                 "$set": {
                     "last_audit": new_audit.timestamp,
                     "gps_location": audit_data.location.dict(),
-                    "updated_at": datetime.utcnow()
+                    "updated_at": datetime.utcnow(),
+                    **stamp
                 }
             }
         )
+    return new_audit
+
+@router.post("/", response_model=AuditsResponse)
+async def create_audit(audit_data: AuditCreate):
+    """Create a new NFC audit record"""
+    try:
+        new_audit = await _record_audit(audit_data)
+        if not new_audit:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
         
         return AuditsResponse(
             success=True, 
@@ -73,11 +93,11 @@ async def create_audit(audit_data: AuditCreate):
         logger.error(f"Error creating audit: {e}")
         raise HTTPException(status_code=500, detail="Failed to create audit")
 
-@router.get("/{audit_id}")
+@router.get("/{audit_id}", dependencies=[primary_reads()])
 async def get_audit(audit_id: str):
     """Get audit details by ID"""
     try:
-        audit_doc = await find_one_and_convert(audits_collection, {"id": audit_id})
+        audit_doc = await find_one_and_convert(audits_collection, id_filter(audit_id))
         
         if not audit_doc:
             raise HTTPException(status_code=404, detail="Audit not found")
@@ -108,15 +128,14 @@ async def get_audits(
         if status:
             filter_dict["status"] = status
         
-        # Filter by date range
+        # Filter by date range; older history is read from the archive
         start_date = datetime.utcnow() - timedelta(days=days)
-        filter_dict["timestamp"] = {"$gte": start_date}
         
-        audits = await find_many_and_convert(
-            audits_collection, 
+        audits = await find_with_archive(
+            audits_collection,
             filter_dict,
-            sort=[("timestamp", -1)],
-            limit=100
+            limit=100,
+            since=start_date
         )
         
         return AuditsResponse(success=True, data=audits)
@@ -126,31 +145,57 @@ async def get_audits(
         raise HTTPException(status_code=500, detail="Failed to retrieve audits")
 
 @router.post("/nfc-scan")
-async def nfc_scan(vin: str, dealer_id: str, auditor_wallet: str, location: GPSLocation):
+async def nfc_scan(
+    dealer_id: str,
+    auditor_wallet: str,
+    location: GPSLocation,
+    vin: Optional[str] = None,
+    nfc_tag_id: Optional[str] = None
+):
     """Process NFC tag scan and create audit"""
     try:
-        # Find vehicle by VIN
-        vehicle_doc = await find_one_and_convert(vehicles_collection, {"vin": vin})
-        if not vehicle_doc:
-            raise HTTPException(status_code=404, detail="Vehicle not found")
+        if nfc_tag_id:
+            # Resolve the tag from the in-memory tag map
+            vehicle_ref = await nfc_tag_cache.resolve(nfc_tag_id)
+        elif vin:
+            # Find vehicle by VIN
+            vehicle_doc = await find_one_and_convert(vehicles_collection, {"vin": vin})
+            if not vehicle_doc:
+                vehicle_doc = await find_one_and_convert(
+                    vehicles_collection,
+                    {"vin_normalized": normalize_scanned_vin(vin)}
+                )
+            vehicle_ref = {"vehicle_id": vehicle_doc["id"], "vin": vehicle_doc["vin"]} if vehicle_doc else None
+        else:
+            raise HTTPException(status_code=400, detail="Either vin or nfc_tag_id is required")
         
-        # Create audit record
-        audit_data = AuditCreate(
-            vehicle_id=vehicle_doc["id"],
-            vin=vin,
-            dealer_id=dealer_id,
-            auditor_wallet=auditor_wallet,
-            location=location,
-            nfc_tag_scanned=True,
-            notes="NFC tag scanned successfully"
-        )
+        def scanned(vehicle_ref):
+            return AuditCreate(
+                vehicle_id=vehicle_ref["vehicle_id"],
+                vin=vehicle_ref["vin"],
+                dealer_id=dealer_id,
+                auditor_wallet=auditor_wallet,
+                location=location,
+                nfc_tag_scanned=True,
+                notes="NFC tag scanned successfully"
+            )
+        
+        # Create audit record; the write only matches a vehicle still carrying the tag
+        audit = await _record_audit(scanned(vehicle_ref), nfc_tag_id) if vehicle_ref else None
+        if not audit and vehicle_ref and nfc_tag_id:
+            # Another worker retagged or deleted the cached vehicle; look the tag up again
+            nfc_tag_cache.discard(nfc_tag_id)
+            vehicle_ref = await nfc_tag_cache.resolve(nfc_tag_id)
+            if vehicle_ref:
+                audit = await _record_audit(scanned(vehicle_ref), nfc_tag_id)
         
-        result = await create_audit(audit_data)
+        if not audit:
+            raise HTTPException(status_code=404, detail="Vehicle not found")
         
         return {
             "success": True,
             "message": "NFC scan processed successfully",
-            "audit": result.data[0] if result.data else None
+            "audit": audit
         }
         
     except HTTPException:
@@ -160,15 +205,15 @@ async def nfc_scan(vin: str, dealer_id: str, auditor_wallet: str, location: GPSL
         raise HTTPException(status_code=500, detail="Failed to process NFC scan")
 
 @router.get("/vehicle/{vehicle_id}/history")
-async def get_vehicle_audit_history(vehicle_id: str, limit: int = 20):
-    """Get audit history for a specific vehicle"""
+async def get_vehicle_audit_history(vehicle_id: str, limit: int = 20, include_archive: bool = False):
+    """Get audit history for a specific vehicle; archived history only when asked for"""
     try:
-        audits = await find_many_and_convert(
-            audits_collection,
-            {"vehicle_id": vehicle_id},
-            sort=[("timestamp", -1)],
-            limit=limit
-        )
+        filter_dict = {"vehicle_id": vehicle_id}
+        vehicle = await vehicles_collection.find_one(id_filter(vehicle_id), {"dealer_id": 1})
+        if vehicle:
+            filter_dict["dealer_id"] = vehicle["dealer_id"]
+        
+        audits = await find_with_archive(audits_collection, filter_dict, limit=limit, include_archive=include_archive)
         
         return AuditsResponse(success=True, data=audits)
         
@@ -176,25 +221,27 @@ async def get_vehicle_audit_history(vehicle_id: str, limit: int = 20):
         logger.error(f"Error getting vehicle audit history: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve audit history")
 
-@router.get("/dealer/{dealer_id}/compliance")
+@router.get("/dealer/{dealer_id}/compliance", dependencies=[query_budget(REPORT_QUERY_BUDGET_MS)])
 async def get_dealer_compliance_report(dealer_id: str, days: int = 30):
     """Get compliance report for a dealer"""
     try:
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Get all audits for the dealer within the time range
-        audits = await find_many_and_convert(
-            audits_collection,
-            {
-                "dealer_id": dealer_id,
-                "timestamp": {"$gte": start_date}
-            }
-        )
+        # Count by status on the server and fetch only the audits the report shows
+        results = await audits_collection.aggregate([
+            {"$match": {"dealer_id": dealer_id, "timestamp": {"$gte": start_date}}},
+            {"$facet": {
+                "by_status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}],
+                "recent": [{"$sort": {"timestamp": -1}}, {"$limit": 10}]
+            }}
+        ], **command_options()).to_list(length=1)
+        result = results[0] if results else {}
+        counts = {row["_id"]: row["count"] for row in result.get("by_status", [])}
         
         # Calculate compliance stats
-        total_audits = len(audits)
-        compliant_audits = len([a for a in audits if a.get("status") == "compliant"])
-        flagged_audits = len([a for a in audits if a.get("status") == "flagged"])
+        total_audits = sum(counts.values())
+        compliant_audits = counts.get("compliant", 0)
+        flagged_audits = counts.get("flagged", 0)
         
         compliance_rate = (compliant_audits / total_audits * 100) if total_audits > 0 else 0
         
@@ -206,10 +253,12 @@ async def get_dealer_compliance_report(dealer_id: str, days: int = 30):
                 "compliant_audits": compliant_audits,
                 "flagged_audits": flagged_audits,
                 "compliance_rate": round(compliance_rate, 2),
-                "recent_audits": audits[:10]  # Last 10 audits
+                "recent_audits": [from_document(audit) for audit in result.get("recent", [])]
             }
         }
         
+    except ExecutionTimeout:
+        raise budget_exceeded()
     except Exception as e:
         logger.error(f"Error getting compliance report: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate compliance report")
@@ -219,7 +268,7 @@ async def resolve_audit_flag(audit_id: str, resolution_notes: str):
     """Resolve a flagged audit"""
     try:
         result = await audits_collection.update_one(
-            {"id": audit_id},
+            id_filter(audit_id),
             {
                 "$set": {
                     "status": AuditStatus.compliant,
@@ -1,21 +1,73 @@
-from fastapi import APIRouter, HTTPException, Depends
+from fastapi import APIRouter, HTTPException, Depends, Request, Response
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta
+import asyncio
 import logging
 
+from pymongo.errors import ExecutionTimeout
+
 from ..models import (
-    Dealer, DealerCreate, DealerUpdate, DealerResponse,
+    LoanStatus, VehicleStatus, Dealer, DealerCreate, DealerUpdate, DealerResponse,
     LoansResponse, VehiclesResponse, TransactionsResponse, NotificationsResponse
 )
 from ..database import (
     dealers_collection, loans_collection, vehicles_collection, 
     transactions_collection, notifications_collection,
-    find_one_and_convert, find_many_and_convert
+    to_document, from_document, find_one_and_convert, find_many_and_convert,
+    find_options, command_options, id_filter
+)
+from ..services.conditional import (
+    payload_etag, etag_matches, not_modified, apply_validators,
+    resource_validators, docs_list_validators, check_resource, check_list
 )
+from ..services.query_budget import query_budget, budget_exceeded, DASHBOARD_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads, primary_reads
 
-router = APIRouter(prefix="/dealers", tags=["dealers"])
+router = APIRouter(prefix="/dealers", tags=["dealers"], dependencies=[route_reads("dealers")])
 logger = logging.getLogger(__name__)
 
+DASHBOARD_LOAN_LIMIT = 3
+DASHBOARD_NOTIFICATION_LIMIT = 3
+DASHBOARD_TRANSACTION_LIMIT = 5
+AUDIT_STALE_AFTER = timedelta(hours=24)
+
+DASHBOARD_DEALER_FIELDS = {
+    "id": 1, "name": 1, "wallet_address": 1, "kyc_status": 1,
+    "anvl_tokens": 1, "total_loaned": 1, "total_repaid": 1, "active_loans": 1
+}
+DASHBOARD_LOAN_FIELDS = {
+    "id": 1, "amount": 1, "currency": 1, "interest_rate": 1, "status": 1,
+    "remaining_balance": 1, "vehicles_financed": 1, "next_payment_due": 1, "next_payment_amount": 1
+}
+DASHBOARD_NOTIFICATION_FIELDS = {
+    "id": 1, "type": 1, "title": 1, "message": 1, "severity": 1, "read": 1, "timestamp": 1
+}
+DASHBOARD_TRANSACTION_FIELDS = {
+    "id": 1, "type": 1, "amount": 1, "currency": 1, "status": 1, "timestamp": 1
+}
+
+async def _dashboard_loan_totals(dealer_id: str):
+    rows = await loans_collection.aggregate([
+        {"$match": {"dealer_id": dealer_id, "status": LoanStatus.active.value}},
+        {"$group": {"_id": None, "count": {"$sum": 1}, "outstanding": {"$sum": "$remaining_balance"}}}
+    ], **command_options()).to_list(length=1)
+    return rows[0] if rows else {"count": 0, "outstanding": 0}
+
+async def _dashboard_vehicle_counts(dealer_id: str, audit_cutoff: datetime):
+    rows = await vehicles_collection.aggregate([
+        {"$match": {"dealer_id": dealer_id}},
+        {"$group": {
+            "_id": None,
+            "on_lot": {"$sum": {"$cond": [{"$eq": ["$status", VehicleStatus.on_lot.value]}, 1, 0]}},
+            "sold": {"$sum": {"$cond": [{"$eq": ["$status", VehicleStatus.sold.value]}, 1, 0]}},
+            # Never-audited units count from their arrival, as out-of-trust detection does
+            "need_audit": {"$sum": {"$cond": [
+                {"$lt": [{"$ifNull": ["$last_audit", "$created_at"]}, audit_cutoff]}, 1, 0
+            ]}}
+        }}
+    ], **command_options()).to_list(length=1)
+    return rows[0] if rows else {"on_lot": 0, "sold": 0, "need_audit": 0}
+
 @router.post("/connect-wallet", response_model=DealerResponse)
 async def connect_wallet(dealer_data: DealerCreate):
     """Connect wallet and create/retrieve dealer profile"""
@@ -41,7 +93,7 @@ async def connect_wallet(dealer_data: DealerCreate):
         
         # Create new dealer
         new_dealer = Dealer(**dealer_data.dict())
-        await dealers_collection.insert_one(new_dealer.dict())
+        await dealers_collection.insert_one(to_document(new_dealer.dict()))
         
         return DealerResponse(
             success=True, 
@@ -53,15 +105,20 @@ async def connect_wallet(dealer_data: DealerCreate):
         logger.error(f"Error connecting wallet: {e}")
         raise HTTPException(status_code=500, detail="Failed to connect wallet")
 
-@router.get("/{dealer_id}", response_model=DealerResponse)
-async def get_dealer(dealer_id: str):
+@router.get("/{dealer_id}", response_model=DealerResponse, dependencies=[primary_reads()])
+async def get_dealer(dealer_id: str, request: Request, response: Response):
     """Get dealer profile by ID"""
     try:
-        dealer_doc = await find_one_and_convert(dealers_collection, {"id": dealer_id})
+        unchanged = await check_resource(request, dealers_collection, id_filter(dealer_id))
+        if unchanged:
+            return unchanged
+        
+        dealer_doc = await find_one_and_convert(dealers_collection, id_filter(dealer_id))
         
         if not dealer_doc:
             raise HTTPException(status_code=404, detail="Dealer not found")
         
+        apply_validators(response, *resource_validators(dealer_doc))
         dealer = Dealer(**dealer_doc)
         return DealerResponse(success=True, data=dealer)
         
@@ -71,7 +128,65 @@ async def get_dealer(dealer_id: str):
         logger.error(f"Error getting dealer: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve dealer")
 
-@router.get("/wallet/{wallet_address}", response_model=DealerResponse)
+@router.get("/{dealer_id}/dashboard", dependencies=[query_budget(DASHBOARD_QUERY_BUDGET_MS)])
+async def get_dealer_dashboard(dealer_id: str, request: Request, response: Response):
+    """Everything the dealer dashboard shows, fetched concurrently in one request"""
+    try:
+        audit_cutoff = datetime.utcnow() - AUDIT_STALE_AFTER
+        dealer, loan_totals, active_loans, vehicle_counts, notifications, unread, transactions = await asyncio.gather(
+            dealers_collection.find_one(id_filter(dealer_id), DASHBOARD_DEALER_FIELDS, **find_options()),
+            _dashboard_loan_totals(dealer_id),
+            loans_collection.find(
+                {"dealer_id": dealer_id, "status": LoanStatus.active.value}, DASHBOARD_LOAN_FIELDS, **find_options()
+            ).sort("created_at", -1).limit(DASHBOARD_LOAN_LIMIT).to_list(length=DASHBOARD_LOAN_LIMIT),
+            _dashboard_vehicle_counts(dealer_id, audit_cutoff),
+            notifications_collection.find(
+                {"dealer_id": dealer_id}, DASHBOARD_NOTIFICATION_FIELDS, **find_options()
+            ).sort("timestamp", -1).limit(DASHBOARD_NOTIFICATION_LIMIT).to_list(length=DASHBOARD_NOTIFICATION_LIMIT),
+            notifications_collection.count_documents({"dealer_id": dealer_id, "read": False}, **command_options()),
+            transactions_collection.find(
+                {"dealer_id": dealer_id}, DASHBOARD_TRANSACTION_FIELDS, **find_options()
+            ).sort("timestamp", -1).limit(DASHBOARD_TRANSACTION_LIMIT).to_list(length=DASHBOARD_TRANSACTION_LIMIT)
+        )
+        
+        if not dealer:
+            raise HTTPException(status_code=404, detail="Dealer not found")
+        
+        from_document(dealer)
+        for doc in active_loans + notifications + transactions:
+            from_document(doc)
+        data = {
+            "dealer": dealer,
+            "stats": {
+                "total_outstanding": loan_totals["outstanding"],
+                "active_loans": loan_totals["count"],
+                "vehicles_on_lot": vehicle_counts["on_lot"],
+                "vehicles_sold": vehicle_counts["sold"],
+                "vehicles_need_audit": vehicle_counts["need_audit"],
+                "unread_notifications": unread,
+                "anvl_tokens": dealer.get("anvl_tokens", 0)
+            },
+            "active_loans": active_loans,
+            "recent_notifications": notifications,
+            "recent_transactions": transactions
+        }
+        
+        etag = payload_etag(data)
+        if etag_matches(request, etag):
+            return not_modified(etag)
+        
+        apply_validators(response, etag)
+        return {"success": True, "data": data}
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error getting dealer dashboard: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve dashboard")
+
+@router.get("/wallet/{wallet_address}", response_model=DealerResponse, dependencies=[primary_reads()])
 async def get_dealer_by_wallet(wallet_address: str):
     """Get dealer profile by wallet address"""
     try:
@@ -100,14 +215,14 @@ async def update_dealer(dealer_id: str, dealer_update: DealerUpdate):
         update_data["updated_at"] = datetime.utcnow()
         
         result = await dealers_collection.update_one(
-            {"id": dealer_id},
+            id_filter(dealer_id),
             {"$set": update_data}
         )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Dealer not found")
         
-        updated_dealer = await find_one_and_convert(dealers_collection, {"id": dealer_id})
+        updated_dealer = await find_one_and_convert(dealers_collection, id_filter(dealer_id))
         dealer = Dealer(**updated_dealer)
         
         return DealerResponse(
@@ -123,15 +238,20 @@ async def update_dealer(dealer_id: str, dealer_update: DealerUpdate):
         raise HTTPException(status_code=500, detail="Failed to update dealer")
 
 @router.get("/{dealer_id}/loans", response_model=LoansResponse)
-async def get_dealer_loans(dealer_id: str):
+async def get_dealer_loans(dealer_id: str, request: Request, response: Response):
     """Get all loans for a dealer"""
     try:
+        unchanged = await check_list(request, loans_collection, {"dealer_id": dealer_id})
+        if unchanged:
+            return unchanged
+        
         loans = await find_many_and_convert(
             loans_collection, 
             {"dealer_id": dealer_id},
             sort=[("created_at", -1)]
         )
         
+        apply_validators(response, *docs_list_validators(loans))
         return LoansResponse(success=True, data=loans)
         
     except Exception as e:
@@ -139,15 +259,20 @@ async def get_dealer_loans(dealer_id: str):
         raise HTTPException(status_code=500, detail="Failed to retrieve loans")
 
 @router.get("/{dealer_id}/vehicles", response_model=VehiclesResponse)
-async def get_dealer_vehicles(dealer_id: str):
+async def get_dealer_vehicles(dealer_id: str, request: Request, response: Response):
     """Get all vehicles for a dealer"""
     try:
+        unchanged = await check_list(request, vehicles_collection, {"dealer_id": dealer_id})
+        if unchanged:
+            return unchanged
+        
         vehicles = await find_many_and_convert(
             vehicles_collection, 
             {"dealer_id": dealer_id},
             sort=[("created_at", -1)]
         )
         
+        apply_validators(response, *docs_list_validators(vehicles))
         return VehiclesResponse(success=True, data=vehicles)
         
     except Exception as e:
@@ -193,8 +318,8 @@ async def mark_notification_read(dealer_id: str, notification_id: str):
     """Mark a notification as read"""
     try:
         result = await notifications_collection.update_one(
-            {"id": notification_id, "dealer_id": dealer_id},
-            {"$set": {"read": True}}
+            {**id_filter(notification_id), "dealer_id": dealer_id},
+            {"$set": {"read": True, "read_at": datetime.utcnow()}}
         )
         
         if result.matched_count == 0:
@@ -1,26 +1,138 @@
-from fastapi import APIRouter, HTTPException
-from typing import List
+from fastapi import APIRouter, HTTPException, Request, Response
+from typing import List, Optional
 from datetime import datetime, timedelta
+from collections import defaultdict
 import logging
+import uuid
+
+from pymongo import UpdateOne, InsertOne
+from pymongo.errors import ExecutionTimeout
 
 from ..models import (
-    Loan, LoanCreate, LoanUpdate, LoansResponse,
-    LoanStatus, Transaction, TransactionCreate, TransactionType
+    Loan, LoanCreate, LoanUpdate, LoansResponse, LoanBatchApproval,
+    LoanStatus, Transaction, TransactionCreate, TransactionType, VehicleStatus
 )
 from ..database import (
-    loans_collection, dealers_collection, transactions_collection,
-    find_one_and_convert, find_many_and_convert
+    loans_collection, dealers_collection, transactions_collection, vehicles_collection,
+    to_document, from_document, find_one_and_convert,
+    find_options, command_options, id_filter, ids_filter, BUSINESS_ID
+)
+from ..services.reward_epochs import reward_transaction
+from ..services.conditional import (
+    apply_validators, resource_validators, check_resource,
+    query_list_validators, is_not_modified, not_modified, validator_headers
 )
+from ..services.json_stream import streaming_list_response
+from ..services.jobs import update_dealer_stats, rescan_out_of_trust
+from ..services.loan_ledger import post_transactions, unpost_transactions, record_payment, adjust_balance, balance_as_of, list_entries
+from ..services.query_budget import query_budget, budget_exceeded, REPORT_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads, primary_reads
 
-router = APIRouter(prefix="/loans", tags=["loans"])
+router = APIRouter(prefix="/loans", tags=["loans"], dependencies=[route_reads("loans")])
 logger = logging.getLogger(__name__)
 
+APPROVAL_REWARD_TOKENS = 100
+MAX_BATCH_APPROVALS = 1000
+LOAN_DETAIL_TRANSACTION_LIMIT = 100
+MAX_COLLATERAL_PAGE_SIZE = 200
+MAX_LEDGER_PAGE_SIZE = 1000
+
+COLLATERAL_VEHICLE_FIELDS = {
+    "_id": 0, "id": BUSINESS_ID, "vin": 1, "make": 1, "model": 1, "year": 1,
+    "price": 1, "status": 1, "last_audit": 1, "created_at": 1
+}
+
+def _collateral_lookup() -> dict:
+    """Join a loan's vehicles, totalled on the vehicles side of the loan_id index"""
+    on_lot = {"$eq": ["$status", VehicleStatus.on_lot.value]}
+    return {
+        "$lookup": {
+            "from": vehicles_collection.name,
+            "let": {"loan_id": BUSINESS_ID},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$loan_id", "$$loan_id"]}}},
+                {"$group": {
+                    "_id": None,
+                    "units": {"$sum": 1},
+                    "units_on_lot": {"$sum": {"$cond": [on_lot, 1, 0]}},
+                    "collateral_value": {"$sum": {"$cond": [on_lot, "$price", 0]}}
+                }}
+            ],
+            "as": "collateral"
+        }
+    }
+
+def _collateral_fields() -> List[dict]:
+    """Flatten the joined totals and derive loan-to-value against on-lot collateral"""
+    collateral = {"$ifNull": [{"$arrayElemAt": ["$collateral", 0]}, {}]}
+    return [
+        {"$addFields": {"collateral": collateral}},
+        {"$addFields": {
+            "units": {"$ifNull": ["$collateral.units", 0]},
+            "units_on_lot": {"$ifNull": ["$collateral.units_on_lot", 0]},
+            "collateral_value": {"$ifNull": ["$collateral.collateral_value", 0]}
+        }},
+        {"$addFields": {
+            "ltv": {"$cond": [
+                {"$gt": ["$collateral_value", 0]},
+                {"$round": [{"$divide": ["$remaining_balance", "$collateral_value"]}, 4]},
+                None
+            ]}
+        }},
+        {"$addFields": {"id": BUSINESS_ID}},
+        {"$project": {"_id": 0, "collateral": 0}}
+    ]
+
+def _approval_update(loan: Loan, start_date: datetime) -> dict:
+    """Fields set on a loan when it is approved"""
+    return {
+        "status": LoanStatus.active,
+        "start_date": start_date,
+        "next_payment_due": start_date + timedelta(days=30),  # Monthly payments
+        "next_payment_amount": loan.remaining_balance / loan.term,
+        "updated_at": datetime.utcnow()
+    }
+
+def _disbursement_transaction(loan: Loan) -> Transaction:
+    """Disbursement transaction recorded when a loan is approved"""
+    return Transaction(
+        dealer_id=loan.dealer_id,
+        type=TransactionType.loan_disbursement,
+        amount=loan.amount,
+        currency=loan.currency,
+        loan_id=loan.id,
+        status="confirmed",
+        tx_hash=f"0x{''.join(['a', 'b', 'c', 'd', 'e', 'f'] + [str(i) for i in range(10)][:40])}"  # Mock hash
+    )
+
+async def _release_batch_claims(loans: List[Loan], batch_id: str):
+    """Return loans claimed by a failed batch to how they were before the claim"""
+    await loans_collection.bulk_write(
+        [
+            UpdateOne(
+                {**id_filter(loan.id), "approval_batch_id": batch_id},
+                {
+                    "$set": {
+                        "status": loan.status,
+                        "start_date": loan.start_date,
+                        "next_payment_due": loan.next_payment_due,
+                        "next_payment_amount": loan.next_payment_amount,
+                        "updated_at": loan.updated_at
+                    },
+                    "$unset": {"approval_batch_id": ""}
+                }
+            )
+            for loan in loans
+        ],
+        ordered=False
+    )
+
 @router.post("/", response_model=LoansResponse)
 async def create_loan(loan_data: LoanCreate):
     """Create a new loan application"""
     try:
         # Verify dealer exists
-        dealer = await find_one_and_convert(dealers_collection, {"id": loan_data.dealer_id})
+        dealer = await find_one_and_convert(dealers_collection, id_filter(loan_data.dealer_id))
         if not dealer:
             raise HTTPException(status_code=404, detail="Dealer not found")
         
@@ -29,7 +141,7 @@ async def create_loan(loan_data: LoanCreate):
         new_loan.remaining_balance = new_loan.amount
         new_loan.status = LoanStatus.pending
         
-        await loans_collection.insert_one(new_loan.dict())
+        await loans_collection.insert_one(to_document(new_loan.dict()))
         
         return LoansResponse(
             success=True, 
@@ -43,15 +155,278 @@ async def create_loan(loan_data: LoanCreate):
         logger.error(f"Error creating loan: {e}")
         raise HTTPException(status_code=500, detail="Failed to create loan")
 
-@router.get("/{loan_id}")
-async def get_loan(loan_id: str):
+@router.post("/approve-batch")
+async def approve_loans_batch(batch: LoanBatchApproval):
+    """Approve many pending loans and disburse funds in bulk"""
+    try:
+        loan_ids = list(dict.fromkeys(batch.loan_ids))
+        if len(loan_ids) > MAX_BATCH_APPROVALS:
+            raise HTTPException(
+                status_code=400,
+                detail=f"At most {MAX_BATCH_APPROVALS} loans can be approved per batch"
+            )
+        
+        results = {loan_id: {"loan_id": loan_id, "success": False} for loan_id in loan_ids}
+        loans = {}
+        async for loan_doc in loans_collection.find(ids_filter(loan_ids), **find_options()):
+            loan = Loan(**from_document(loan_doc))
+            loans[loan.id] = loan
+        
+        candidates = []
+        for loan_id in loan_ids:
+            loan = loans.get(loan_id)
+            if not loan:
+                results[loan_id]["error"] = "Loan not found"
+            elif loan.status != LoanStatus.pending:
+                results[loan_id]["error"] = "Loan is not in pending status"
+            else:
+                candidates.append(loan)
+        
+        if candidates:
+            # Claim each loan with a conditional update so concurrent approvals cannot both win
+            batch_id = str(uuid.uuid4())
+            start_date = datetime.utcnow()
+            claimed = set()
+            try:
+                await loans_collection.bulk_write(
+                    [
+                        UpdateOne(
+                            {**id_filter(loan.id), "status": LoanStatus.pending},
+                            {"$set": {**_approval_update(loan, start_date), "approval_batch_id": batch_id}}
+                        )
+                        for loan in candidates
+                    ],
+                    ordered=False
+                )
+                
+                async for loan_doc in loans_collection.find(
+                    {**ids_filter(loan.id for loan in candidates), "approval_batch_id": batch_id},
+                    {"_id": 1, "id": 1}
+                ):
+                    claimed.add(from_document(loan_doc)["id"])
+            except Exception as e:
+                logger.error(f"Error claiming loan batch {batch_id}, rolling back: {e}")
+                await _release_batch_claims(candidates, batch_id)
+                for loan in candidates:
+                    results[loan.id]["error"] = "Failed to approve loan"
+                candidates = []
+            
+            approved = []
+            for loan in candidates:
+                if loan.id in claimed:
+                    approved.append(loan)
+                else:
+                    results[loan.id]["error"] = "Loan is not in pending status"
+            
+            if approved:
+                transactions = {loan.id: _disbursement_transaction(loan) for loan in approved}
+                rewards = [reward_transaction(loan.dealer_id, APPROVAL_REWARD_TOKENS) for loan in approved]
+                try:
+                    await transactions_collection.bulk_write(
+                        [InsertOne(to_document(transaction.dict())) for transaction in transactions.values()]
+                        + [InsertOne(to_document(reward.dict())) for reward in rewards],
+                        ordered=False
+                    )
+                    await post_transactions(transactions.values())
+                except Exception as e:
+                    # Undo the claim and anything written for it, then report the loans as failed
+                    logger.error(f"Error disbursing loan batch {batch_id}, rolling back: {e}")
+                    transaction_ids = [t.id for t in transactions.values()] + [reward.id for reward in rewards]
+                    await unpost_transactions(transaction_ids)
+                    await transactions_collection.delete_many(ids_filter(transaction_ids))
+                    await _release_batch_claims(approved, batch_id)
+                    for loan in approved:
+                        results[loan.id]["error"] = "Failed to disburse loan"
+                    approved = []
+                
+                if approved:
+                    await loans_collection.update_many(
+                        {**ids_filter(loan.id for loan in approved), "approval_batch_id": batch_id},
+                        {"$unset": {"approval_batch_id": ""}}
+                    )
+                
+                dealer_totals = defaultdict(lambda: {"total_loaned": 0, "active_loans": 0, "anvl_tokens": 0})
+                for loan in approved:
+                    totals = dealer_totals[loan.dealer_id]
+                    totals["total_loaned"] += loan.amount
+                    totals["active_loans"] += 1
+                    totals["anvl_tokens"] += APPROVAL_REWARD_TOKENS
+                
+                # Retried jobs, as for single approvals, so a failed counter update cannot fail the batch
+                for dealer_id, totals in dealer_totals.items():
+                    try:
+                        await update_dealer_stats(dealer_id, totals)
+                    except Exception as e:
+                        logger.error(f"Error queueing dealer stats for {dealer_id} in loan batch {batch_id}: {e}")
+                
+                for loan in approved:
+                    results[loan.id].update(success=True, transaction_id=transactions[loan.id].id)
+        
+        approved_count = sum(1 for result in results.values() if result["success"])
+        return {
+            "success": True,
+            "message": f"Approved {approved_count} of {len(loan_ids)} loans",
+            "data": {
+                "approved": approved_count,
+                "failed": len(loan_ids) - approved_count,
+                "results": list(results.values())
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error approving loan batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to approve loans")
+
+@router.get("/collateral", dependencies=[query_budget(REPORT_QUERY_BUDGET_MS)])
+async def get_loans_with_collateral(
+    dealer_id: str = None,
+    status: LoanStatus = None,
+    skip: int = 0,
+    limit: int = 50
+):
+    """List loans with per-loan collateral value, units on lot and LTV"""
+    try:
+        filter_dict = {}
+        if dealer_id:
+            filter_dict["dealer_id"] = dealer_id
+        if status:
+            filter_dict["status"] = status
+        
+        skip = max(0, skip)
+        limit = max(1, min(limit, MAX_COLLATERAL_PAGE_SIZE))
+        
+        # Only the requested page is joined; the total comes from the same match
+        pipeline = [
+            {"$match": filter_dict},
+            {
+                "$facet": {
+                    "loans": [
+                        {"$sort": {"created_at": -1}},
+                        {"$skip": skip},
+                        {"$limit": limit},
+                        _collateral_lookup()
+                    ] + _collateral_fields(),
+                    "total": [{"$count": "count"}]
+                }
+            }
+        ]
+        
+        results = await loans_collection.aggregate(pipeline, **command_options()).to_list(length=1)
+        result = results[0] if results else {}
+        total = result.get("total") or [{"count": 0}]
+        
+        return {
+            "success": True,
+            "data": {
+                "loans": result.get("loans", []),
+                "total": total[0]["count"],
+                "skip": skip,
+                "limit": limit
+            }
+        }
+        
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error getting loans with collateral: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve loans")
+
+@router.get("/{loan_id}/detail", dependencies=[query_budget(REPORT_QUERY_BUDGET_MS)])
+async def get_loan_detail(loan_id: str):
+    """Get a loan with its collateral vehicles, coverage and payment history in one query"""
+    try:
+        pipeline = [
+            {"$match": id_filter(loan_id)},
+            {"$limit": 1},
+            _collateral_lookup(),
+            {
+                "$lookup": {
+                    "from": vehicles_collection.name,
+                    "let": {"loan_id": BUSINESS_ID},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$loan_id", "$$loan_id"]}}},
+                        {"$sort": {"created_at": -1}},
+                        {"$project": COLLATERAL_VEHICLE_FIELDS}
+                    ],
+                    "as": "vehicles"
+                }
+            },
+            {
+                "$lookup": {
+                    "from": transactions_collection.name,
+                    "let": {"loan_id": BUSINESS_ID},
+                    "pipeline": [
+                        {"$match": {"$expr": {"$eq": ["$loan_id", "$$loan_id"]}}},
+                        {"$sort": {"timestamp": -1}},
+                        {"$limit": LOAN_DETAIL_TRANSACTION_LIMIT},
+                        {"$addFields": {"id": BUSINESS_ID}},
+                        {"$project": {"_id": 0}}
+                    ],
+                    "as": "transactions"
+                }
+            }
+        ] + _collateral_fields()
+        
+        results = await loans_collection.aggregate(pipeline, **command_options()).to_list(length=1)
+        if not results:
+            raise HTTPException(status_code=404, detail="Loan not found")
+        
+        return {"success": True, "data": results[0]}
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error getting loan detail: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve loan")
+
+@router.get("/{loan_id}/balance", dependencies=[primary_reads()])
+async def get_loan_balance(loan_id: str, as_of: Optional[datetime] = None):
+    """Get a loan's ledger balance, now or as of a past date"""
+    try:
+        loan = await loans_collection.find_one(id_filter(loan_id), {"_id": 1}, **find_options())
+        if not loan:
+            raise HTTPException(status_code=404, detail="Loan not found")
+        
+        as_of = as_of or datetime.utcnow()
+        balance = await balance_as_of(loan_id, as_of)
+        
+        return {"success": True, "data": {"loan_id": loan_id, "as_of": as_of, "balance": balance}}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting loan balance: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve loan balance")
+
+@router.get("/{loan_id}/ledger")
+async def get_loan_ledger(loan_id: str, limit: int = 100):
+    """Get a loan's ledger entries, newest first"""
+    try:
+        entries = await list_entries(loan_id, max(1, min(limit, MAX_LEDGER_PAGE_SIZE)))
+        return {"success": True, "data": entries}
+        
+    except Exception as e:
+        logger.error(f"Error getting loan ledger: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve loan ledger")
+
+@router.get("/{loan_id}", dependencies=[primary_reads()])
+async def get_loan(loan_id: str, request: Request, response: Response):
     """Get loan details by ID"""
     try:
-        loan_doc = await find_one_and_convert(loans_collection, {"id": loan_id})
+        unchanged = await check_resource(request, loans_collection, id_filter(loan_id))
+        if unchanged:
+            return unchanged
+        
+        loan_doc = await find_one_and_convert(loans_collection, id_filter(loan_id))
         
         if not loan_doc:
             raise HTTPException(status_code=404, detail="Loan not found")
         
+        apply_validators(response, *resource_validators(loan_doc))
         loan = Loan(**loan_doc)
         return {"success": True, "data": loan}
         
@@ -65,24 +440,33 @@ async def get_loan(loan_id: str):
 async def update_loan(loan_id: str, loan_update: LoanUpdate):
     """Update loan status and details"""
     try:
+        loan_doc = await find_one_and_convert(loans_collection, id_filter(loan_id))
+        if not loan_doc:
+            raise HTTPException(status_code=404, detail="Loan not found")
+        
         update_data = {k: v for k, v in loan_update.dict().items() if v is not None}
         update_data["updated_at"] = datetime.utcnow()
         
-        result = await loans_collection.update_one(
-            {"id": loan_id},
+        # Balance changes go through the ledger as adjustments
+        if "remaining_balance" in update_data:
+            update_data["remaining_balance"] = await adjust_balance(
+                loan_doc, update_data["remaining_balance"], "Balance set through loan update"
+            )
+        
+        await loans_collection.update_one(
+            id_filter(loan_id),
             {"$set": update_data}
         )
         
-        if result.matched_count == 0:
-            raise HTTPException(status_code=404, detail="Loan not found")
-        
-        updated_loan = await find_one_and_convert(loans_collection, {"id": loan_id})
+        updated_loan = await find_one_and_convert(loans_collection, id_filter(loan_id))
         loan = Loan(**updated_loan)
         
         return {"success": True, "data": loan, "message": "Loan updated successfully"}
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error updating loan: {e}")
         raise HTTPException(status_code=500, detail="Failed to update loan")
@@ -91,7 +475,7 @@ async def update_loan(loan_id: str, loan_update: LoanUpdate):
 async def approve_loan(loan_id: str):
     """Approve a loan and disburse funds"""
     try:
-        loan_doc = await find_one_and_convert(loans_collection, {"id": loan_id})
+        loan_doc = await find_one_and_convert(loans_collection, id_filter(loan_id))
         if not loan_doc:
             raise HTTPException(status_code=404, detail="Loan not found")
         
@@ -100,47 +484,28 @@ async def approve_loan(loan_id: str):
         if loan.status != LoanStatus.pending:
             raise HTTPException(status_code=400, detail="Loan is not in pending status")
         
-        # Update loan status
-        start_date = datetime.utcnow()
-        next_payment_due = start_date + timedelta(days=30)  # Monthly payments
-        
-        await loans_collection.update_one(
-            {"id": loan_id},
-            {
-                "$set": {
-                    "status": LoanStatus.active,
-                    "start_date": start_date,
-                    "next_payment_due": next_payment_due,
-                    "next_payment_amount": loan.remaining_balance / loan.term,
-                    "updated_at": datetime.utcnow()
-                }
-            }
+        # Claim the loan only if no other approval or batch got to it first
+        result = await loans_collection.update_one(
+            {**id_filter(loan_id), "status": LoanStatus.pending, "approval_batch_id": {"$exists": False}},
+            {"$set": _approval_update(loan, datetime.utcnow())}
         )
+        if result.matched_count == 0:
+            raise HTTPException(status_code=409, detail="Loan is already being approved")
         
         # Create disbursement transaction
-        transaction = Transaction(
-            dealer_id=loan.dealer_id,
-            type=TransactionType.loan_disbursement,
-            amount=loan.amount,
-            currency=loan.currency,
-            loan_id=loan_id,
-            status="confirmed",
-            tx_hash=f"0x{''.join(['a', 'b', 'c', 'd', 'e', 'f'] + [str(i) for i in range(10)][:40])}"  # Mock hash
-        )
-        
-        await transactions_collection.insert_one(transaction.dict())
-        
-        # Update dealer stats
-        await dealers_collection.update_one(
-            {"id": loan.dealer_id},
-            {
-                "$inc": {
-                    "total_loaned": loan.amount,
-                    "active_loans": 1,
-                    "anvl_tokens": 100  # Reward tokens
-                }
-            }
-        )
+        transaction = _disbursement_transaction(loan)
+        await transactions_collection.insert_many([
+            to_document(transaction.dict()),
+            to_document(reward_transaction(loan.dealer_id, APPROVAL_REWARD_TOKENS).dict())
+        ])
+        await post_transactions([transaction])
+        
+        # Update dealer stats in the background
+        await update_dealer_stats(loan.dealer_id, {
+            "total_loaned": loan.amount,
+            "active_loans": 1,
+            "anvl_tokens": APPROVAL_REWARD_TOKENS
+        })
         
         return {"success": True, "message": "Loan approved and funds disbursed"}
         
@@ -154,7 +519,7 @@ async def approve_loan(loan_id: str):
 async def make_payment(loan_id: str, payment_amount: float, method: str = "ACH"):
     """Make a payment towards a loan"""
     try:
-        loan_doc = await find_one_and_convert(loans_collection, {"id": loan_id})
+        loan_doc = await find_one_and_convert(loans_collection, id_filter(loan_id))
         if not loan_doc:
             raise HTTPException(status_code=404, detail="Loan not found")
         
@@ -163,50 +528,16 @@ async def make_payment(loan_id: str, payment_amount: float, method: str = "ACH")
         if loan.status != LoanStatus.active:
             raise HTTPException(status_code=400, detail="Loan is not active")
         
-        if payment_amount > loan.remaining_balance:
-            payment_amount = loan.remaining_balance
+        # The ledger caps the payment at the balance and updates the loan from it
+        transaction, new_balance, loan_status = await record_payment(loan_doc, payment_amount, method)
         
-        new_balance = loan.remaining_balance - payment_amount
-        loan_status = LoanStatus.paid if new_balance == 0 else LoanStatus.active
+        # Update dealer stats and re-score out-of-trust findings in the background
+        dealer_increments = {"total_repaid": transaction.amount}
+        if loan_status == LoanStatus.paid:
+            dealer_increments["active_loans"] = -1
         
-        # Update loan
-        update_data = {
-            "remaining_balance": new_balance,
-            "status": loan_status,
-            "updated_at": datetime.utcnow()
-        }
-        
-        if new_balance == 0:
-            update_data["paid_off_date"] = datetime.utcnow()
-        else:
-            # Calculate next payment
-            update_data["next_payment_due"] = datetime.utcnow() + timedelta(days=30)
-            update_data["next_payment_amount"] = min(
-                new_balance / max(1, loan.term - 1), 
-                new_balance
-            )
-        
-        await loans_collection.update_one({"id": loan_id}, {"$set": update_data})
-        
-        # Create payment transaction
-        transaction = Transaction(
-            dealer_id=loan.dealer_id,
-            type=TransactionType.payment,
-            amount=payment_amount,
-            currency="USD",
-            loan_id=loan_id,
-            method=method,
-            status="confirmed"
-        )
-        
-        await transactions_collection.insert_one(transaction.dict())
-        
-        # Update dealer stats
-        dealer_update = {"$inc": {"total_repaid": payment_amount}}
-        if new_balance == 0:
-            dealer_update["$inc"]["active_loans"] = -1
-        
-        await dealers_collection.update_one({"id": loan.dealer_id}, dealer_update)
+        await update_dealer_stats(loan.dealer_id, dealer_increments)
+        await rescan_out_of_trust()
         
         return {
             "success": True, 
@@ -222,7 +553,11 @@ async def make_payment(loan_id: str, payment_amount: float, method: str = "ACH")
         raise HTTPException(status_code=500, detail="Failed to process payment")
 
 @router.get("/")
-async def get_all_loans(dealer_id: str = None, status: LoanStatus = None):
+async def get_all_loans(
+    request: Request,
+    dealer_id: str = None,
+    status: LoanStatus = None
+):
     """Get loans with optional filters"""
     try:
         filter_dict = {}
@@ -231,13 +566,12 @@ async def get_all_loans(dealer_id: str = None, status: LoanStatus = None):
         if status:
             filter_dict["status"] = status
         
-        loans = await find_many_and_convert(
-            loans_collection, 
-            filter_dict,
-            sort=[("created_at", -1)]
-        )
+        etag, last_modified = await query_list_validators(loans_collection, filter_dict)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
         
-        return LoansResponse(success=True, data=loans)
+        cursor = loans_collection.find(filter_dict, **find_options()).sort("created_at", -1)
+        return await streaming_list_response(cursor, Loan, validator_headers(etag, last_modified))
         
     except Exception as e:
         logger.error(f"Error getting loans: {e}")
@@ -0,0 +1,39 @@
+from fastapi import APIRouter, HTTPException
+import logging
+import os
+import re
+
+from ..services.presale_indexer import presale_summary, wallet_purchases
+from ..services.read_preference import route_reads
+
+router = APIRouter(prefix="/presale", tags=["presale"], dependencies=[route_reads("presale")])
+logger = logging.getLogger(__name__)
+
+WALLET_ADDRESS_PATTERN = re.compile(r"^0x[0-9a-fA-F]{40}$")
+
+@router.get("/summary")
+async def get_presale_summary():
+    """Get presale totals from indexed contract events"""
+    try:
+        data = await presale_summary(os.environ.get("PRESALE_CONTRACT_ADDRESS"))
+        return {"success": True, "data": data}
+        
+    except Exception as e:
+        logger.error(f"Error getting presale summary: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve presale summary")
+
+@router.get("/wallet/{wallet_address}")
+async def get_wallet_purchases(wallet_address: str, limit: int = 100):
+    """Get presale purchases and claim status for a wallet"""
+    try:
+        if not WALLET_ADDRESS_PATTERN.match(wallet_address):
+            raise HTTPException(status_code=400, detail="Invalid wallet address")
+        
+        data = await wallet_purchases(wallet_address, limit=max(1, min(limit, 1000)))
+        return {"success": True, "data": data}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting wallet purchases: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve wallet purchases")
@@ -0,0 +1,117 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+import logging
+
+from ..database import (
+    reward_epochs_collection, reward_proofs_collection, transactions_collection,
+    convert_objectid_to_str
+)
+from ..models import TransactionType
+from ..services.reward_epochs import build_epoch, publish_epoch, publisher_from_env
+from ..services.admin_auth import require_admin
+
+router = APIRouter(prefix="/rewards", tags=["rewards"])
+logger = logging.getLogger(__name__)
+
+@router.get("/epochs")
+async def get_reward_epochs(limit: int = 20):
+    """Get the most recent reward epochs"""
+    try:
+        limit = max(1, min(limit, 100))
+        cursor = reward_epochs_collection.find({}).sort("_id", -1).limit(limit)
+        epochs = [convert_objectid_to_str(doc) for doc in await cursor.to_list(length=limit)]
+        return {"success": True, "data": epochs}
+        
+    except Exception as e:
+        logger.error(f"Error getting reward epochs: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve reward epochs")
+
+@router.post("/epochs", dependencies=[require_admin()])
+async def create_reward_epoch():
+    """Build a reward epoch from all outstanding rewards now"""
+    try:
+        epoch = await build_epoch(publisher=publisher_from_env())
+        if not epoch:
+            return {"success": True, "data": None, "message": "No outstanding rewards to settle"}
+        
+        return {"success": True, "data": epoch, "message": f"Reward epoch {epoch['_id']} built"}
+        
+    except Exception as e:
+        logger.error(f"Error building reward epoch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to build reward epoch")
+
+@router.get("/epochs/{epoch}")
+async def get_reward_epoch(epoch: int):
+    """Get a reward epoch by number"""
+    try:
+        epoch_doc = await reward_epochs_collection.find_one({"_id": epoch})
+        if not epoch_doc:
+            raise HTTPException(status_code=404, detail="Reward epoch not found")
+        
+        return {"success": True, "data": epoch_doc}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting reward epoch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve reward epoch")
+
+@router.post("/epochs/{epoch}/publish", dependencies=[require_admin()])
+async def publish_reward_epoch(epoch: int, tx_hash: Optional[str] = None):
+    """Publish an epoch root on-chain, or record the hash of a root published externally"""
+    try:
+        epoch_doc = await publish_epoch(epoch, publisher=publisher_from_env(), tx_hash=tx_hash)
+        return {"success": True, "data": epoch_doc, "message": f"Reward epoch {epoch} published"}
+        
+    except LookupError:
+        raise HTTPException(status_code=404, detail="Reward epoch not found")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error publishing reward epoch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to publish reward epoch")
+
+@router.get("/dealer/{dealer_id}/proofs")
+async def get_dealer_reward_proofs(dealer_id: str, limit: int = 50):
+    """Get Merkle claim proofs for a dealer's published reward epochs"""
+    try:
+        proofs = await reward_proofs_collection.find(
+            {"dealer_id": dealer_id},
+            {"_id": 0}
+        ).sort("epoch", -1).to_list(length=max(1, min(limit, 500)))
+        
+        published = set()
+        if proofs:
+            async for epoch_doc in reward_epochs_collection.find(
+                {"_id": {"$in": [p["epoch"] for p in proofs]}, "status": "published"},
+                {"_id": 1}
+            ):
+                published.add(epoch_doc["_id"])
+        
+        for proof in proofs:
+            proof["published"] = proof["epoch"] in published
+        
+        return {"success": True, "data": proofs}
+        
+    except Exception as e:
+        logger.error(f"Error getting reward proofs: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve reward proofs")
+
+@router.get("/dealer/{dealer_id}/pending")
+async def get_dealer_pending_rewards(dealer_id: str):
+    """Get rewards not yet settled in a published epoch"""
+    try:
+        rows = await transactions_collection.aggregate([
+            {"$match": {"dealer_id": dealer_id, "type": TransactionType.anvl_reward, "status": "pending"}},
+            {"$group": {"_id": None, "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+        ]).to_list(length=1)
+        
+        pending = rows[0] if rows else {"amount": 0, "count": 0}
+        return {
+            "success": True,
+            "data": {"dealer_id": dealer_id, "amount": pending["amount"], "count": pending["count"]}
+        }
+        
+    except Exception as e:
+        logger.error(f"Error getting pending rewards: {e}")
+        raise HTTPException(status_code=500, detail="Failed to retrieve pending rewards")
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+import logging
+
+from ..services.sync import changes_since, InvalidSyncToken, DEFAULT_SYNC_LIMIT
+
+router = APIRouter(prefix="/sync", tags=["sync"])
+logger = logging.getLogger(__name__)
+
+@router.get("")
+async def sync_vehicles(dealer_id: str, since: Optional[str] = None, limit: int = DEFAULT_SYNC_LIMIT):
+    """Get vehicles changed or deleted since a sync token; omit the token for a full sync"""
+    try:
+        data = await changes_since(dealer_id, since, limit)
+        return {"success": True, "data": data}
+        
+    except InvalidSyncToken as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error syncing vehicles: {e}")
+        raise HTTPException(status_code=500, detail="Failed to sync vehicles")
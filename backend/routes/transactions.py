@@ -1,18 +1,28 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request
 from typing import List, Optional
 from datetime import datetime, timedelta
 import logging
 
+from pymongo.errors import ExecutionTimeout
+
 from ..models import (
     Transaction, TransactionCreate, TransactionsResponse,
-    TransactionType
+    TransactionType, LoanStatus
 )
 from ..database import (
     transactions_collection, dealers_collection, loans_collection,
-    find_one_and_convert, find_many_and_convert
+    to_document, from_document, find_one_and_convert, command_options, id_filter
+)
+from ..services.reward_epochs import reward_transaction
+from ..services.retention import find_with_archive
+from ..services.loan_ledger import (
+    transaction_entries, ensure_opening, post_transactions, record_payment, refresh_cached_balance
 )
+from ..services.query_budget import query_budget, budget_exceeded, REPORT_QUERY_BUDGET_MS, IMPORT_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads, primary_reads
+from ..services.ach_reconciliation import reconcile_ach_file, DEFAULT_CHUNK_SIZE
 
-router = APIRouter(prefix="/transactions", tags=["transactions"])
+router = APIRouter(prefix="/transactions", tags=["transactions"], dependencies=[route_reads("transactions")])
 logger = logging.getLogger(__name__)
 
 @router.post("/", response_model=TransactionsResponse)
@@ -20,7 +30,7 @@ async def create_transaction(transaction_data: TransactionCreate):
     """Create a new transaction record"""
     try:
         # Verify dealer exists
-        dealer = await find_one_and_convert(dealers_collection, {"id": transaction_data.dealer_id})
+        dealer = await find_one_and_convert(dealers_collection, id_filter(transaction_data.dealer_id))
         if not dealer:
             raise HTTPException(status_code=404, detail="Dealer not found")
         
@@ -28,11 +38,36 @@ async def create_transaction(transaction_data: TransactionCreate):
         new_transaction = Transaction(**transaction_data.dict())
         new_transaction.status = "confirmed"
         
+        # ANVL rewards settle on-chain with the next reward epoch
+        if transaction_data.type == TransactionType.anvl_reward:
+            new_transaction.status = "pending"
+        
         # Generate mock transaction hash for blockchain transactions
-        if transaction_data.type in [TransactionType.loan_disbursement, TransactionType.anvl_reward]:
+        if transaction_data.type == TransactionType.loan_disbursement:
             new_transaction.tx_hash = f"0x{''.join(['a', 'b', 'c', 'd', 'e', 'f'] + [str(i) for i in range(10)][:40])}"
         
-        await transactions_collection.insert_one(new_transaction.dict())
+        # Loan disbursements, payments and fees move the loan's ledger balance
+        loan = None
+        if transaction_entries([new_transaction]):
+            loan = await find_one_and_convert(loans_collection, id_filter(new_transaction.loan_id))
+            if not loan:
+                raise HTTPException(status_code=404, detail="Loan not found")
+            if transaction_data.type == TransactionType.payment:
+                # The ledger caps the payment at the balance and updates the loan from it
+                transaction, _, _ = await record_payment(
+                    loan, transaction_data.amount, transaction_data.method or "ACH", dealer_id=transaction_data.dealer_id
+                )
+                return TransactionsResponse(success=True, data=[transaction], message="Transaction recorded successfully")
+            # Until disbursement the ledger is empty; the approval sets the balance
+            if loan.get("status") == LoanStatus.pending:
+                raise HTTPException(status_code=400, detail="Loan is pending approval")
+        
+        await transactions_collection.insert_one(to_document(new_transaction.dict()))
+        
+        if loan:
+            await ensure_opening(loan)
+            await post_transactions([new_transaction])
+            await refresh_cached_balance(loan["id"])
         
         return TransactionsResponse(
             success=True, 
@@ -42,15 +77,17 @@ async def create_transaction(transaction_data: TransactionCreate):
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error creating transaction: {e}")
         raise HTTPException(status_code=500, detail="Failed to create transaction")
 
-@router.get("/{transaction_id}")
+@router.get("/{transaction_id}", dependencies=[primary_reads()])
 async def get_transaction(transaction_id: str):
     """Get transaction details by ID"""
     try:
-        transaction_doc = await find_one_and_convert(transactions_collection, {"id": transaction_id})
+        transaction_doc = await find_one_and_convert(transactions_collection, id_filter(transaction_id))
         
         if not transaction_doc:
             raise HTTPException(status_code=404, detail="Transaction not found")
@@ -81,15 +118,14 @@ async def get_transactions(
         if type:
             filter_dict["type"] = type
         
-        # Filter by date range
+        # Filter by date range; older history is read from the archive
         start_date = datetime.utcnow() - timedelta(days=days)
-        filter_dict["timestamp"] = {"$gte": start_date}
         
-        transactions = await find_many_and_convert(
-            transactions_collection, 
+        transactions = await find_with_archive(
+            transactions_collection,
             filter_dict,
-            sort=[("timestamp", -1)],
-            limit=100
+            limit=100,
+            since=start_date
         )
         
         return TransactionsResponse(success=True, data=transactions)
@@ -98,54 +134,62 @@ async def get_transactions(
         logger.error(f"Error getting transactions: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve transactions")
 
-@router.get("/dealer/{dealer_id}/summary")
+@router.get("/dealer/{dealer_id}/summary", dependencies=[query_budget(REPORT_QUERY_BUDGET_MS)])
 async def get_dealer_transaction_summary(dealer_id: str, days: int = 30):
     """Get transaction summary for a dealer"""
     try:
         start_date = datetime.utcnow() - timedelta(days=days)
         
-        # Get all transactions for the dealer within the time range
-        transactions = await find_many_and_convert(
-            transactions_collection,
-            {
-                "dealer_id": dealer_id,
-                "timestamp": {"$gte": start_date}
-            }
-        )
+        # Total by type on the server and fetch only the transactions the summary shows
+        results = await transactions_collection.aggregate([
+            {"$match": {"dealer_id": dealer_id, "timestamp": {"$gte": start_date}}},
+            {"$facet": {
+                "by_type": [{"$group": {"_id": "$type", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}],
+                "recent": [{"$sort": {"timestamp": -1}}, {"$limit": 10}]
+            }}
+        ], **command_options()).to_list(length=1)
+        result = results[0] if results else {}
+        totals = {row["_id"]: row for row in result.get("by_type", [])}
         
         # Calculate summary stats
-        total_disbursed = sum(t.get("amount", 0) for t in transactions if t.get("type") == "loan_disbursement")
-        total_payments = sum(t.get("amount", 0) for t in transactions if t.get("type") == "payment")
-        total_fees = sum(t.get("amount", 0) for t in transactions if t.get("type") == "fee")
-        anvl_earned = sum(t.get("amount", 0) for t in transactions if t.get("type") == "anvl_reward")
+        total_disbursed = totals.get("loan_disbursement", {}).get("amount", 0)
+        total_payments = (
+            totals.get("payment", {}).get("amount", 0)
+            - totals.get("payment_return", {}).get("amount", 0)
+        )
+        total_fees = totals.get("fee", {}).get("amount", 0)
+        anvl_earned = totals.get("anvl_reward", {}).get("amount", 0)
         
         return {
             "success": True,
             "data": {
                 "period_days": days,
-                "total_transactions": len(transactions),
+                "total_transactions": sum(row["count"] for row in totals.values()),
                 "total_disbursed": total_disbursed,
                 "total_payments": total_payments,
                 "total_fees": total_fees,
                 "anvl_earned": anvl_earned,
                 "net_flow": total_disbursed - total_payments,
-                "recent_transactions": transactions[:10]
+                "recent_transactions": [from_document(transaction) for transaction in result.get("recent", [])]
             }
         }
         
+    except ExecutionTimeout:
+        raise budget_exceeded()
     except Exception as e:
         logger.error(f"Error getting transaction summary: {e}")
         raise HTTPException(status_code=500, detail="Failed to generate transaction summary")
 
 @router.get("/loan/{loan_id}/history")
-async def get_loan_transaction_history(loan_id: str):
-    """Get transaction history for a specific loan"""
+async def get_loan_transaction_history(loan_id: str, include_archive: bool = False):
+    """Get transaction history for a specific loan; archived history only when asked for"""
     try:
-        transactions = await find_many_and_convert(
-            transactions_collection,
-            {"loan_id": loan_id},
-            sort=[("timestamp", -1)]
-        )
+        filter_dict = {"loan_id": loan_id}
+        loan = await loans_collection.find_one(id_filter(loan_id), {"dealer_id": 1})
+        if loan:
+            filter_dict["dealer_id"] = loan["dealer_id"]
+        
+        transactions = await find_with_archive(transactions_collection, filter_dict, include_archive=include_archive)
         
         return TransactionsResponse(success=True, data=transactions)
         
@@ -158,34 +202,12 @@ async def simulate_ach_payment(dealer_id: str, loan_id: str, amount: float):
     """Simulate an ACH payment (for demo purposes)"""
     try:
         # Verify loan exists
-        loan = await find_one_and_convert(loans_collection, {"id": loan_id})
+        loan = await find_one_and_convert(loans_collection, id_filter(loan_id))
         if not loan:
             raise HTTPException(status_code=404, detail="Loan not found")
         
-        # Create payment transaction
-        transaction = Transaction(
-            dealer_id=dealer_id,
-            type=TransactionType.payment,
-            amount=amount,
-            currency="USD",
-            loan_id=loan_id,
-            method="ACH",
-            status="confirmed"
-        )
-        
-        await transactions_collection.insert_one(transaction.dict())
-        
-        # Update loan balance (this would normally be done in the loans endpoint)
-        new_balance = max(0, loan["remaining_balance"] - amount)
-        await loans_collection.update_one(
-            {"id": loan_id},
-            {
-                "$set": {
-                    "remaining_balance": new_balance,
-                    "updated_at": datetime.utcnow()
-                }
-            }
-        )
+        # Same ledger posting as loan payments, so both agree on the balance
+        transaction, new_balance, _ = await record_payment(loan, amount, "ACH", dealer_id=dealer_id)
         
         return {
             "success": True,
@@ -196,30 +218,64 @@ async def simulate_ach_payment(dealer_id: str, loan_id: str, amount: float):
         
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     except Exception as e:
         logger.error(f"Error simulating payment: {e}")
         raise HTTPException(status_code=500, detail="Failed to process payment")
 
+@router.post("/ach/reconcile", dependencies=[query_budget(IMPORT_QUERY_BUDGET_MS)])
+async def reconcile_ach(request: Request, dry_run: bool = False, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """Apply an ACH settlement or return file (NACHA) and report the entries that could not be applied"""
+    try:
+        chunk_size = max(1, min(chunk_size, 10000))
+        
+        if request.headers.get("content-type", "").startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing file upload")
+            
+            async def chunks():
+                while True:
+                    data = await upload.read(64 * 1024)
+                    if not data:
+                        break
+                    yield data
+        else:
+            chunks = request.stream
+        
+        summary = await reconcile_ach_file(chunks(), chunk_size=chunk_size, dry_run=dry_run)
+        
+        return {
+            "success": True,
+            "data": summary,
+            "message": (
+                f"Applied {summary['payments_applied']} payments and {summary['returns_applied']} returns; "
+                f"{summary['exceptions']} exceptions"
+            )
+        }
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error reconciling ACH file: {e}")
+        raise HTTPException(status_code=500, detail="Failed to reconcile ACH file")
+
 @router.post("/reward-anvl")
 async def reward_anvl_tokens(dealer_id: str, amount: int, reason: str):
     """Award ANVL tokens to a dealer"""
     try:
-        # Create ANVL reward transaction
-        transaction = Transaction(
-            dealer_id=dealer_id,
-            type=TransactionType.anvl_reward,
-            amount=amount,
-            currency="ANVL",
-            status="confirmed",
-            tx_hash=f"0x{''.join(['a', 'b', 'c', 'd', 'e', 'f'] + [str(i) for i in range(10)][:40])}"
-        )
-        
-        await transactions_collection.insert_one(transaction.dict())
+        # Record the reward; it settles on-chain with the next reward epoch
+        transaction = reward_transaction(dealer_id, amount)
+        await transactions_collection.insert_one(to_document(transaction.dict()))
         
         # Update dealer ANVL balance
         await dealers_collection.update_one(
-            {"id": dealer_id},
-            {"$inc": {"anvl_tokens": amount}}
+            id_filter(dealer_id),
+            {"$inc": {"anvl_tokens": amount}, "$set": {"updated_at": datetime.utcnow()}}
         )
         
         return {
@@ -1,19 +1,38 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import JSONResponse
 from typing import List, Optional
 from datetime import datetime
 import logging
 import uuid
 
+from pymongo import ReturnDocument
+from pymongo.errors import ExecutionTimeout
+
 from ..models import (
     Vehicle, VehicleCreate, VehicleUpdate, VehiclesResponse,
-    VehicleStatus, GPSLocation
+    VehicleStatus, GPSLocation, VinLookupRequest
 )
 from ..database import (
     vehicles_collection, dealers_collection, loans_collection,
-    find_one_and_convert, find_many_and_convert
+    to_document, from_document, find_one_and_convert,
+    find_options, command_options, id_filter, BUSINESS_ID
+)
+from ..services.vehicle_import import (
+    import_vehicles, iter_json_array, iter_csv_rows, ImportAborted, DEFAULT_CHUNK_SIZE
+)
+from ..services.vin_lookup import (
+    lookup_vins, normalize_scanned_vin, vin_fragments, nfc_tag_cache
+)
+from ..services.sync import sync_stamp, record_tombstone
+from ..services.conditional import (
+    apply_validators, resource_validators, check_resource,
+    query_list_validators, is_not_modified, not_modified, validator_headers
 )
+from ..services.json_stream import streaming_list_response
+from ..services.query_budget import query_budget, budget_exceeded, REPORT_QUERY_BUDGET_MS
+from ..services.read_preference import route_reads, primary_reads
 
-router = APIRouter(prefix="/vehicles", tags=["vehicles"])
+router = APIRouter(prefix="/vehicles", tags=["vehicles"], dependencies=[route_reads("vehicles")])
 logger = logging.getLogger(__name__)
 
 @router.post("/", response_model=VehiclesResponse)
@@ -21,7 +40,7 @@ async def create_vehicle(vehicle_data: VehicleCreate):
     """Add a new vehicle to inventory"""
     try:
         # Verify dealer exists
-        dealer = await find_one_and_convert(dealers_collection, {"id": vehicle_data.dealer_id})
+        dealer = await find_one_and_convert(dealers_collection, id_filter(vehicle_data.dealer_id))
         if not dealer:
             raise HTTPException(status_code=404, detail="Dealer not found")
         
@@ -36,7 +55,11 @@ async def create_vehicle(vehicle_data: VehicleCreate):
         new_vehicle.nft_token_id = f"nft_{str(uuid.uuid4())[:8]}"
         new_vehicle.ipfs_hash = f"Qm{str(uuid.uuid4()).replace('-', '')}[:44]"
         
-        await vehicles_collection.insert_one(new_vehicle.dict())
+        async with sync_stamp() as stamp:
+            await vehicles_collection.insert_one({
+                **to_document(new_vehicle.dict()), **vin_fragments(new_vehicle.vin), **stamp
+            })
+        nfc_tag_cache.put(new_vehicle.nfc_tag_id, new_vehicle.id, new_vehicle.vin)
         
         return VehiclesResponse(
             success=True, 
@@ -50,15 +73,178 @@ async def create_vehicle(vehicle_data: VehicleCreate):
         logger.error(f"Error creating vehicle: {e}")
         raise HTTPException(status_code=500, detail="Failed to create vehicle")
 
-@router.get("/{vehicle_id}")
-async def get_vehicle(vehicle_id: str):
+@router.post("/bulk")
+async def bulk_import_vehicles(
+    request: Request,
+    dealer_id: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    validate_check_digit: bool = True
+):
+    """Import many vehicles from a JSON array or CSV upload"""
+    try:
+        content_type = request.headers.get("content-type", "")
+        chunk_size = max(1, min(chunk_size, 5000))
+        
+        if content_type.startswith("multipart/form-data"):
+            form = await request.form()
+            upload = form.get("file")
+            if upload is None or isinstance(upload, str):
+                raise HTTPException(status_code=400, detail="Missing file upload")
+            
+            async def chunks():
+                while True:
+                    data = await upload.read(64 * 1024)
+                    if not data:
+                        break
+                    yield data
+            
+            is_csv = (upload.filename or "").lower().endswith(".csv") or "csv" in (upload.content_type or "")
+            records = iter_csv_rows(chunks()) if is_csv else iter_json_array(chunks())
+        elif "csv" in content_type:
+            records = iter_csv_rows(request.stream())
+        else:
+            records = iter_json_array(request.stream())
+        
+        summary = await import_vehicles(
+            records,
+            dealer_id=dealer_id,
+            chunk_size=chunk_size,
+            validate_check_digit=validate_check_digit
+        )
+        
+        return {
+            "success": True,
+            "data": summary,
+            "message": f"Imported {summary['inserted']} of {summary['received']} vehicles"
+        }
+        
+    except HTTPException:
+        raise
+    except ImportAborted as e:
+        # Earlier chunks are already stored; tell the caller which rows made it
+        return JSONResponse(
+            status_code=400,
+            content={"success": False, "data": e.summary, "message": f"Import stopped: {e}"}
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error importing vehicles: {e}")
+        raise HTTPException(status_code=500, detail="Failed to import vehicles")
+
+SEARCH_SORT_FIELDS = {"created_at", "price", "year", "mileage", "make"}
+
+@router.get("/search", dependencies=[query_budget(REPORT_QUERY_BUDGET_MS)])
+async def search_vehicles(
+    q: Optional[str] = None,
+    dealer_id: Optional[str] = None,
+    status: Optional[VehicleStatus] = None,
+    make: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    min_year: Optional[int] = None,
+    max_year: Optional[int] = None,
+    min_mileage: Optional[int] = None,
+    max_mileage: Optional[int] = None,
+    sort: str = "-created_at",
+    skip: int = 0,
+    limit: int = 50
+):
+    """Search inventory with text, range filters and facet counts"""
+    try:
+        filter_dict = {}
+        if q:
+            filter_dict["$text"] = {"$search": q}
+        if dealer_id:
+            filter_dict["dealer_id"] = dealer_id
+        if status:
+            filter_dict["status"] = status
+        if make:
+            filter_dict["make"] = make
+        
+        for field, low, high in (
+            ("price", min_price, max_price),
+            ("year", min_year, max_year),
+            ("mileage", min_mileage, max_mileage)
+        ):
+            bounds = {}
+            if low is not None:
+                bounds["$gte"] = low
+            if high is not None:
+                bounds["$lte"] = high
+            if bounds:
+                filter_dict[field] = bounds
+        
+        sort_field = sort.lstrip("-")
+        if sort_field == "relevance" and q:
+            sort_stage = {"score": {"$meta": "textScore"}, "created_at": -1}
+        elif sort_field in SEARCH_SORT_FIELDS:
+            sort_stage = {sort_field: -1 if sort.startswith("-") else 1}
+        else:
+            raise HTTPException(status_code=400, detail=f"Unsupported sort field: {sort_field}")
+        
+        skip = max(0, skip)
+        limit = max(1, min(limit, 200))
+        
+        pipeline = [
+            {"$match": filter_dict},
+            {
+                "$facet": {
+                    "vehicles": [
+                        {"$sort": sort_stage},
+                        {"$skip": skip},
+                        {"$limit": limit},
+                        {"$addFields": {"id": BUSINESS_ID}},
+                        {"$project": {"_id": 0}}
+                    ],
+                    "total": [{"$count": "count"}],
+                    "make": [{"$group": {"_id": "$make", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}],
+                    "status": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}, {"$sort": {"count": -1}}],
+                    "year": [{"$group": {"_id": "$year", "count": {"$sum": 1}}}, {"$sort": {"_id": -1}}]
+                }
+            }
+        ]
+        
+        results = await vehicles_collection.aggregate(pipeline, **command_options()).to_list(length=1)
+        result = results[0] if results else {}
+        total = result.get("total") or [{"count": 0}]
+        
+        return {
+            "success": True,
+            "data": {
+                "vehicles": [Vehicle(**doc) for doc in result.get("vehicles", [])],
+                "total": total[0]["count"],
+                "skip": skip,
+                "limit": limit,
+                "facets": {
+                    facet: [{"value": bucket["_id"], "count": bucket["count"]} for bucket in result.get(facet, [])]
+                    for facet in ("make", "status", "year")
+                }
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except ExecutionTimeout:
+        raise budget_exceeded()
+    except Exception as e:
+        logger.error(f"Error searching vehicles: {e}")
+        raise HTTPException(status_code=500, detail="Failed to search vehicles")
+
+@router.get("/{vehicle_id}", dependencies=[primary_reads()])
+async def get_vehicle(vehicle_id: str, request: Request, response: Response):
     """Get vehicle details by ID"""
     try:
-        vehicle_doc = await find_one_and_convert(vehicles_collection, {"id": vehicle_id})
+        unchanged = await check_resource(request, vehicles_collection, id_filter(vehicle_id))
+        if unchanged:
+            return unchanged
+        
+        vehicle_doc = await find_one_and_convert(vehicles_collection, id_filter(vehicle_id))
         
         if not vehicle_doc:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
+        apply_validators(response, *resource_validators(vehicle_doc))
         vehicle = Vehicle(**vehicle_doc)
         return {"success": True, "data": vehicle}
         
@@ -68,11 +254,58 @@ async def get_vehicle(vehicle_id: str):
         logger.error(f"Error getting vehicle: {e}")
         raise HTTPException(status_code=500, detail="Failed to retrieve vehicle")
 
-@router.get("/vin/{vin}")
+@router.get("/vin/lookup", dependencies=[primary_reads()])
+async def lookup_vehicle_by_partial_vin(
+    q: str,
+    mode: str = "auto",
+    dealer_id: Optional[str] = None,
+    limit: int = 10
+):
+    """Find vehicles by a full, partial or last-8 VIN read from a scanner"""
+    try:
+        results = await lookup_vins([q], mode=mode, dealer_id=dealer_id, limit=max(1, min(limit, 50)))
+        result = results[0]
+        result["matches"] = [Vehicle(**doc) for doc in result["matches"]]
+        return {"success": True, "data": result}
+        
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error looking up VIN: {e}")
+        raise HTTPException(status_code=500, detail="Failed to look up VIN")
+
+@router.post("/vin/lookup")
+async def lookup_vehicles_by_vin_batch(lookup: VinLookupRequest):
+    """Resolve a batch of scanned VINs, batching the exact and last-8 reads"""
+    try:
+        if len(lookup.vins) > 1000:
+            raise HTTPException(status_code=400, detail="At most 1000 VINs can be looked up per request")
+        
+        results = await lookup_vins(lookup.vins, mode=lookup.mode, dealer_id=lookup.dealer_id)
+        for result in results:
+            result["matches"] = [Vehicle(**doc) for doc in result["matches"]]
+        
+        return {"success": True, "data": results}
+        
+    except HTTPException:
+        raise
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error looking up VIN batch: {e}")
+        raise HTTPException(status_code=500, detail="Failed to look up VINs")
+
+@router.get("/vin/{vin}", dependencies=[primary_reads()])
 async def get_vehicle_by_vin(vin: str):
     """Get vehicle details by VIN"""
     try:
         vehicle_doc = await find_one_and_convert(vehicles_collection, {"vin": vin})
+        if not vehicle_doc:
+            # Fall back to the normalised VIN to tolerate scanner noise
+            vehicle_doc = await find_one_and_convert(
+                vehicles_collection,
+                {"vin_normalized": normalize_scanned_vin(vin)}
+            )
         
         if not vehicle_doc:
             raise HTTPException(status_code=404, detail="Vehicle not found")
@@ -93,16 +326,19 @@ async def update_vehicle(vehicle_id: str, vehicle_update: VehicleUpdate):
         update_data = {k: v for k, v in vehicle_update.dict().items() if v is not None}
         update_data["updated_at"] = datetime.utcnow()
         
-        result = await vehicles_collection.update_one(
-            {"id": vehicle_id},
-            {"$set": update_data}
-        )
+        async with sync_stamp() as stamp:
+            updated_vehicle = await vehicles_collection.find_one_and_update(
+                id_filter(vehicle_id),
+                {"$set": {**update_data, **stamp}},
+                return_document=ReturnDocument.AFTER
+            )
         
-        if result.matched_count == 0:
+        if not updated_vehicle:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
-        updated_vehicle = await find_one_and_convert(vehicles_collection, {"id": vehicle_id})
-        vehicle = Vehicle(**updated_vehicle)
+        # Scans re-resolve the tag from Mongo rather than this worker's copy
+        nfc_tag_cache.discard(updated_vehicle.get("nfc_tag_id"))
+        vehicle = Vehicle(**from_document(updated_vehicle))
         
         return {"success": True, "data": vehicle, "message": "Vehicle updated successfully"}
         
@@ -116,7 +352,7 @@ async def update_vehicle(vehicle_id: str, vehicle_update: VehicleUpdate):
 async def sell_vehicle(vehicle_id: str, sale_price: Optional[float] = None):
     """Mark vehicle as sold"""
     try:
-        vehicle_doc = await find_one_and_convert(vehicles_collection, {"id": vehicle_id})
+        vehicle_doc = await find_one_and_convert(vehicles_collection, id_filter(vehicle_id))
         if not vehicle_doc:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
@@ -134,7 +370,8 @@ async def sell_vehicle(vehicle_id: str, sale_price: Optional[float] = None):
         if sale_price:
             update_data["price"] = sale_price
         
-        await vehicles_collection.update_one({"id": vehicle_id}, {"$set": update_data})
+        async with sync_stamp() as stamp:
+            await vehicles_collection.update_one(id_filter(vehicle_id), {"$set": {**update_data, **stamp}})
         
         return {"success": True, "message": "Vehicle marked as sold"}
         
@@ -148,16 +385,18 @@ async def sell_vehicle(vehicle_id: str, sale_price: Optional[float] = None):
 async def update_vehicle_location(vehicle_id: str, location: GPSLocation):
     """Update vehicle GPS location"""
     try:
-        result = await vehicles_collection.update_one(
-            {"id": vehicle_id},
-            {
-                "$set": {
-                    "gps_location": location.dict(),
-                    "last_audit": datetime.utcnow(),
-                    "updated_at": datetime.utcnow()
+        async with sync_stamp() as stamp:
+            result = await vehicles_collection.update_one(
+                id_filter(vehicle_id),
+                {
+                    "$set": {
+                        "gps_location": location.dict(),
+                        "last_audit": datetime.utcnow(),
+                        "updated_at": datetime.utcnow(),
+                        **stamp
+                    }
                 }
-            }
-        )
+            )
         
         if result.matched_count == 0:
             raise HTTPException(status_code=404, detail="Vehicle not found")
@@ -172,6 +411,7 @@ async def update_vehicle_location(vehicle_id: str, location: GPSLocation):
 
 @router.get("/")
 async def get_vehicles(
+    request: Request,
     dealer_id: Optional[str] = None,
     status: Optional[VehicleStatus] = None,
     loan_id: Optional[str] = None
@@ -186,13 +426,12 @@ async def get_vehicles(
         if loan_id:
             filter_dict["loan_id"] = loan_id
         
-        vehicles = await find_many_and_convert(
-            vehicles_collection, 
-            filter_dict,
-            sort=[("created_at", -1)]
-        )
+        etag, last_modified = await query_list_validators(vehicles_collection, filter_dict)
+        if is_not_modified(request, etag, last_modified):
+            return not_modified(etag, last_modified)
         
-        return VehiclesResponse(success=True, data=vehicles)
+        cursor = vehicles_collection.find(filter_dict, **find_options()).sort("created_at", -1)
+        return await streaming_list_response(cursor, Vehicle, validator_headers(etag, last_modified))
         
     except Exception as e:
         logger.error(f"Error getting vehicles: {e}")
@@ -202,11 +441,17 @@ async def get_vehicles(
 async def delete_vehicle(vehicle_id: str):
     """Delete a vehicle from inventory"""
     try:
-        result = await vehicles_collection.delete_one({"id": vehicle_id})
+        deleted = await vehicles_collection.find_one_and_delete(
+            id_filter(vehicle_id),
+            projection={"dealer_id": 1, "nfc_tag_id": 1}
+        )
         
-        if result.deleted_count == 0:
+        if not deleted:
             raise HTTPException(status_code=404, detail="Vehicle not found")
         
+        nfc_tag_cache.discard(deleted.get("nfc_tag_id"))
+        await record_tombstone(from_document(deleted))
+        
         return {"success": True, "message": "Vehicle deleted successfully"}
         
     except HTTPException:
@@ -0,0 +1,164 @@
+"""
+Production entry point for the ANVL API
+Pre-forks worker processes that share one listening socket. The app is imported
+once in the supervisor before forking, so workers start quickly and share the
+loaded modules; uvicorn picks uvloop and httptools when they are installed.
+MONGO_POOL_TOTAL connections are split across the workers instead of each one
+opening the driver default, and only worker 0 runs index builds, backfills and
+the periodic scheduler. Workers that crash are replaced.
+
+On SIGTERM a worker reports not-ready and keeps serving for DRAIN_DELAY_SECONDS
+while load balancers move traffic away. It then stops accepting connections,
+waits up to GRACEFUL_TIMEOUT_SECONDS for in-flight requests, and lets running
+background jobs finish before it exits.
+
+    python -m backend.serve [--workers 8] [--host 0.0.0.0] [--port 8001]
+"""
+import argparse
+import importlib.util
+import logging
+import os
+import signal
+import time
+from pathlib import Path
+from typing import Dict
+
+import uvicorn
+from dotenv import load_dotenv
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+from .services import lifecycle  # noqa: E402 - after .env so settings apply
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get("WEB_CONCURRENCY", str(os.cpu_count() or 1)))
+MONGO_POOL_TOTAL = int(os.environ.get("MONGO_POOL_TOTAL", "400"))
+MIN_POOL_PER_WORKER = 10
+DRAIN_DELAY_SECONDS = float(os.environ.get("DRAIN_DELAY_SECONDS", "5"))
+GRACEFUL_TIMEOUT_SECONDS = int(os.environ.get("GRACEFUL_TIMEOUT_SECONDS", "30"))
+RESPAWN_DELAY_SECONDS = 1
+
+
+def pool_size_per_worker(workers: int, total: int = MONGO_POOL_TOTAL) -> int:
+    return max(MIN_POOL_PER_WORKER, total // max(1, workers))
+
+
+class DrainingServer(uvicorn.Server):
+    """uvicorn server that goes not-ready and keeps serving for a while after SIGTERM"""
+
+    def __init__(self, config: uvicorn.Config, drain_delay: float = DRAIN_DELAY_SECONDS):
+        super().__init__(config)
+        self.drain_delay = drain_delay
+        self.drain_deadline = None
+
+    def handle_exit(self, sig, frame):
+        lifecycle.begin_drain()
+        if sig == signal.SIGTERM and self.drain_delay > 0 and self.drain_deadline is None and not self.should_exit:
+            self.drain_deadline = time.monotonic() + self.drain_delay
+            logger.info(f"Worker {os.getpid()} draining for {self.drain_delay}s before shutdown")
+            return
+        super().handle_exit(sig, frame)
+
+    async def on_tick(self, counter: int) -> bool:
+        if self.drain_deadline is not None and time.monotonic() >= self.drain_deadline:
+            self.should_exit = True
+        return await super().on_tick(counter)
+
+
+class Supervisor:
+    """Forks `workers` copies of the preloaded app and restarts any that die"""
+
+    def __init__(self, config: uvicorn.Config, workers: int):
+        self.config = config
+        self.workers = workers
+        self.children: Dict[int, int] = {}
+        self.stopping = False
+
+    def spawn(self, index: int, sockets):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                signal.signal(signal.SIGINT, signal.SIG_DFL)
+                os.environ["WORKER_INDEX"] = str(index)
+                DrainingServer(self.config).run(sockets=sockets)
+            except BaseException:
+                logger.exception(f"Worker {index} crashed")
+                code = 1
+            finally:
+                os._exit(code)
+        self.children[pid] = index
+        logger.info(f"Started worker {index} (pid {pid})")
+
+    def stop(self, sig, frame):
+        # Ctrl-C reaches the workers directly; SIGTERM is forwarded so each drains
+        self.stopping = True
+        for pid in list(self.children):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    def run(self, sockets):
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for index in range(self.workers):
+            self.spawn(index, sockets)
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except ChildProcessError:
+                break
+            index = self.children.pop(pid, None)
+            if index is None:
+                continue
+            if not self.stopping:
+                logger.warning(f"Worker {index} (pid {pid}) exited with {os.waitstatus_to_exitcode(status)}; restarting")
+                time.sleep(RESPAWN_DELAY_SECONDS)
+                if not self.stopping:
+                    self.spawn(index, sockets)
+        logger.info("All workers stopped")
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Run the ANVL API with multiple worker processes")
+    parser.add_argument("--workers", type=int, default=WORKERS)
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", "8001")))
+    args = parser.parse_args()
+    workers = max(1, args.workers)
+
+    # Read by database.py when the app is imported below
+    os.environ.setdefault("MONGO_MAX_POOL_SIZE", str(pool_size_per_worker(workers)))
+    logger.info(
+        f"Starting {workers} workers on {args.host}:{args.port} "
+        f"(uvloop: {importlib.util.find_spec('uvloop') is not None}, "
+        f"httptools: {importlib.util.find_spec('httptools') is not None}, "
+        f"Mongo pool per worker: {os.environ['MONGO_MAX_POOL_SIZE']})"
+    )
+
+    config = uvicorn.Config(
+        "backend.server:app",
+        host=args.host,
+        port=args.port,
+        loop="auto",
+        http="auto",
+        proxy_headers=True,
+        timeout_graceful_shutdown=GRACEFUL_TIMEOUT_SECONDS,
+    )
+    config.load()
+    sockets = [config.bind_socket()]
+
+    if workers == 1:
+        DrainingServer(config).run(sockets=sockets)
+    else:
+        Supervisor(config, workers).run(sockets)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    _main()
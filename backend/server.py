@@ -1,22 +1,37 @@
 from fastapi import FastAPI, APIRouter
+from fastapi.responses import JSONResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+import asyncio
 import os
 import logging
 from pathlib import Path
 
 # Import routes
-from .routes import dealers, loans, vehicles, audits, transactions
-from .database import create_indexes
+from .routes import dealers, loans, vehicles, audits, transactions, analytics, presale, rewards, sync, admin
+from .database import client, db, create_indexes
+from .services.vin_lookup import backfill_vin_fragments, nfc_tag_cache
+from .services.sync import backfill_sync_sequence
+from .services.portfolio_rollups import refresh_rollups
+from .services.presale_indexer import indexer_from_env
+from .services.reward_epochs import run_epoch
+from .services.retention import ensure_notification_ttl, run_retention
+from .services.notification_aggregator import deliver_digests
+from .services.out_of_trust import run_detection
+from .services.loan_ledger import snapshot_balances
+from .services import scheduler, lifecycle
+from .services import jobs  # noqa: F401 - registers the job handlers
+from .services.job_queue import WorkerPool
+from .services.compression import CompressionMiddleware
+from .services.query_budget import QueryCancellationMiddleware, DEFAULT_QUERY_BUDGET_MS
+from .services.admission import AdmissionControlMiddleware, buckets_from_env
+from .services.profiling import ProfilingMiddleware
+from .services.tracing import TracingMiddleware, tracer
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ.get('DB_NAME', 'anvl_db')]
+READINESS_TIMEOUT_SECONDS = float(os.environ.get("READINESS_TIMEOUT_SECONDS", "2"))
 
 # Create the main app without a prefix
 app = FastAPI(title="ANVL API", description="Web3 Floor Plan Financing API", version="1.0.0")
@@ -38,16 +53,46 @@ async def health_check():
     except Exception as e:
         return {"status": "unhealthy", "database": "disconnected", "error": str(e)}
 
+@api_router.get("/health/live")
+async def liveness_check():
+    """The process is up and its event loop is answering; no dependencies checked"""
+    return {"status": "alive", "pid": os.getpid()}
+
+@api_router.get("/health/ready")
+async def readiness_check():
+    """Whether this worker should get traffic: started, not draining, database reachable"""
+    if not lifecycle.is_ready():
+        return JSONResponse(status_code=503, content={"status": lifecycle.state()})
+    try:
+        await asyncio.wait_for(db.command("ping"), READINESS_TIMEOUT_SECONDS)
+    except Exception as e:
+        return JSONResponse(status_code=503, content={"status": "unavailable", "database": "disconnected", "error": str(e)})
+    return {"status": "ready", "pid": os.getpid()}
+
 # Include all route modules
 api_router.include_router(dealers.router)
 api_router.include_router(loans.router)
 api_router.include_router(vehicles.router)
 api_router.include_router(audits.router)
 api_router.include_router(transactions.router)
+api_router.include_router(analytics.router)
+api_router.include_router(presale.router)
+api_router.include_router(rewards.router)
+api_router.include_router(sync.router)
+api_router.include_router(admin.router)
 
 # Include the router in the main app
 app.include_router(api_router)
 
+# Innermost, so it runs in the request task that the cancellation middleware creates
+app.add_middleware(ProfilingMiddleware)
+
+app.add_middleware(QueryCancellationMiddleware, client=client, default_budget_ms=DEFAULT_QUERY_BUDGET_MS)
+
+# Inside CORS so that 429/503 rejections still carry CORS headers
+if os.environ.get("ADMISSION_CONTROL", "on") != "off":
+    app.add_middleware(AdmissionControlMiddleware, buckets=buckets_from_env())
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -56,6 +101,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(
+    CompressionMiddleware,
+    minimum_size=int(os.environ.get("COMPRESSION_MINIMUM_SIZE", "1024"))
+)
+
+# Outermost, so request spans include admission queueing and compression
+app.add_middleware(TracingMiddleware)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -63,19 +116,106 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+job_workers = WorkerPool()
+
 @app.on_event("startup")
 async def startup_db():
     """Initialize database indexes on startup"""
+    # Under backend.serve only worker 0 does the once-per-deployment work
+    if os.environ.get("WORKER_INDEX", "0") == "0":
+        await prepare_database()
+        start_periodic_tasks()
+    
+    try:
+        await nfc_tag_cache.warm()
+    except Exception as e:
+        logger.error(f"Error warming NFC tag cache: {e}")
+    
+    if os.environ.get("JOB_WORKERS_IN_PROCESS", "true").lower() == "true":
+        job_workers.start()
+    
+    lifecycle.mark_ready()
+
+async def prepare_database():
     try:
         await create_indexes()
         logger.info("Database indexes created successfully")
     except Exception as e:
         logger.error(f"Error creating database indexes: {e}")
+    
+    try:
+        await backfill_vin_fragments()
+    except Exception as e:
+        logger.error(f"Error preparing VIN lookup: {e}")
+    
+    try:
+        await backfill_sync_sequence()
+    except Exception as e:
+        logger.error(f"Error backfilling sync sequence: {e}")
+    
+    try:
+        await ensure_notification_ttl()
+    except Exception as e:
+        logger.error(f"Error creating notification TTL index: {e}")
+
+def start_periodic_tasks():
+    scheduler.schedule(
+        "portfolio_rollups",
+        float(os.environ.get("PORTFOLIO_ROLLUP_INTERVAL_SECONDS", "3600")),
+        refresh_rollups
+    )
+    
+    presale_indexer = indexer_from_env()
+    if presale_indexer:
+        scheduler.schedule(
+            "presale_indexer",
+            float(os.environ.get("PRESALE_INDEX_INTERVAL_SECONDS", "15")),
+            presale_indexer.run_once
+        )
+    
+    scheduler.schedule(
+        "reward_epochs",
+        float(os.environ.get("REWARD_EPOCH_INTERVAL_SECONDS", "86400")),
+        run_epoch,
+        run_immediately=False
+    )
+    
+    scheduler.schedule(
+        "retention",
+        float(os.environ.get("ARCHIVE_INTERVAL_SECONDS", "86400")),
+        run_retention,
+        run_immediately=False
+    )
+    
+    scheduler.schedule(
+        "notification_digests",
+        float(os.environ.get("NOTIFICATION_DIGEST_INTERVAL_SECONDS", "3600")),
+        deliver_digests,
+        run_immediately=False
+    )
+    
+    scheduler.schedule(
+        "out_of_trust",
+        float(os.environ.get("OUT_OF_TRUST_INTERVAL_SECONDS", "900")),
+        run_detection
+    )
+    
+    scheduler.schedule(
+        "loan_balance_snapshots",
+        float(os.environ.get("LEDGER_SNAPSHOT_INTERVAL_SECONDS", "3600")),
+        snapshot_balances,
+        run_immediately=False
+    )
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    lifecycle.begin_drain()
+    await job_workers.stop()
+    await scheduler.stop_all()
+    tracer.shutdown()
     client.close()
 
+# Development server; production runs python -m backend.serve
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
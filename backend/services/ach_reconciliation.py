@@ -0,0 +1,526 @@
+"""
+ACH settlement and return file reconciliation
+Parses NACHA files record by record as they stream in and reconciles entries
+in chunks: one `$in` lookup for the chunk's loans and one for the payments its
+returns reverse, then bulk writes for transactions, ledger entries, loan
+balances and dealer totals. Settled debits become loan payments; entries with
+a return addenda reverse the payment carrying the original trace number.
+Anything that cannot be applied goes to the exceptions report. Transaction
+ids derive from trace numbers, so re-importing a file applies nothing twice.
+
+A settlement entry names its loan in a payment-related (05) addenda, or in the
+individual identification number when the loan id fits in 15 characters.
+
+    python -m backend.services.ach_reconciliation FILE [--dry-run] [--exceptions exceptions.csv]
+"""
+import argparse
+import asyncio
+import csv
+import logging
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
+
+from ..models import LoanStatus, Transaction, TransactionType
+from ..database import (
+    loans_collection, transactions_collection, dealers_collection,
+    to_document, from_document, find_options, id_filter, ids_filter
+)
+from .loan_ledger import ensure_openings, post_transactions
+
+logger = logging.getLogger(__name__)
+
+RECORD_LENGTH = 94
+DEFAULT_CHUNK_SIZE = 2000
+MAX_REPORTED_EXCEPTIONS = 1000
+DUPLICATE_KEY_ERROR = 11000
+BALANCE_TOLERANCE = 0.005
+
+PAYMENT_INFO_ADDENDA = "05"
+CHANGE_ADDENDA = "98"
+RETURN_ADDENDA = "99"
+
+LOAN_FIELDS = {"id": 1, "dealer_id": 1, "status": 1, "remaining_balance": 1, "start_date": 1, "created_at": 1}
+ORIGINAL_FIELDS = {"dealer_id": 1, "loan_id": 1, "amount": 1, "ach_trace": 1}
+
+# Exception reasons
+MALFORMED_RECORD = "malformed_record"
+CONTROL_MISMATCH = "control_mismatch"
+UNSUPPORTED_ENTRY = "unsupported_transaction_code"
+NOTIFICATION_OF_CHANGE = "notification_of_change"
+UNKNOWN_LOAN = "unknown_loan"
+LOAN_NOT_DISBURSED = "loan_not_disbursed"
+OVERPAYMENT = "overpayment"
+UNKNOWN_ORIGINAL = "unknown_original_entry"
+ALREADY_APPLIED = "already_applied"
+
+
+def _field(record: str, start: int, end: int) -> str:
+    """Characters `start` to `end` inclusive, 1-based as in the NACHA spec"""
+    return record[start - 1:end].strip()
+
+
+def _cents(value: str) -> int:
+    return int(value) if value.isdigit() else 0
+
+
+def _is_debit(transaction_code: str) -> bool:
+    # Second digit 0-4 is a credit (live, prenote, return), 5-9 a debit
+    return len(transaction_code) == 2 and transaction_code[1] in "56789"
+
+
+def _effective_date(value: str) -> Optional[datetime]:
+    try:
+        return datetime.strptime(value, "%y%m%d")
+    except ValueError:
+        return None
+
+
+async def iter_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[Tuple[int, str]]:
+    """Yield (record number, record) from a file with one record per line or fixed 94-byte blocks"""
+    buffer = ""
+    by_line: Optional[bool] = None
+    number = 0
+    async for chunk in chunks:
+        buffer += chunk.decode("latin-1")
+        if by_line is None:
+            if len(buffer) <= RECORD_LENGTH and "\n" not in buffer:
+                continue
+            by_line = "\n" in buffer[:RECORD_LENGTH + 2]
+        if by_line:
+            lines = buffer.split("\n")
+            buffer = lines.pop()
+        else:
+            cut = len(buffer) - len(buffer) % RECORD_LENGTH
+            lines = [buffer[i:i + RECORD_LENGTH] for i in range(0, cut, RECORD_LENGTH)]
+            buffer = buffer[cut:]
+        for line in lines:
+            number += 1
+            yield number, line.rstrip("\r")
+    if buffer.strip():
+        yield number + 1, buffer.rstrip("\r\n")
+
+
+class NachaParser:
+    """Turns NACHA records into entry dicts with their addenda, checking batch and file controls"""
+
+    def __init__(self, on_problem: Callable[[int, str, str], None]):
+        self.on_problem = on_problem
+        self.batches = 0
+        self._batch: Dict[str, Any] = {}
+        self._batch_totals = self._empty_totals()
+        self._file_totals = self._empty_totals()
+
+    @staticmethod
+    def _empty_totals() -> Dict[str, int]:
+        return {"records": 0, "hash": 0, "debit": 0, "credit": 0}
+
+    def _count(self, kind: str, amount: int = 0, routing: str = ""):
+        for totals in (self._batch_totals, self._file_totals):
+            totals["records"] += 1
+            if routing.isdigit():
+                totals["hash"] += int(routing)
+            if kind:
+                totals[kind] += amount
+
+    def _check(self, number: int, what: str, totals: Dict[str, int], records: str, entry_hash: str, debit: str, credit: str):
+        expected = {
+            "entry/addenda count": (_cents(records), totals["records"]),
+            "entry hash": (_cents(entry_hash), totals["hash"] % 10 ** 10),
+            "total debits": (_cents(debit), totals["debit"]),
+            "total credits": (_cents(credit), totals["credit"]),
+        }
+        for name, (stated, counted) in expected.items():
+            if stated != counted:
+                self.on_problem(number, CONTROL_MISMATCH, f"{what} {name} is {stated}, entries add up to {counted}")
+
+    async def entries(self, records: AsyncIterator[Tuple[int, str]]) -> AsyncIterator[Dict[str, Any]]:
+        entry: Optional[Dict[str, Any]] = None
+        async for number, record in records:
+            record_type = record[:1]
+            if record_type == "7" and entry is not None:
+                self._count(None)
+                addenda_type = _field(record, 2, 3)
+                addenda = {"type": addenda_type, "line": number}
+                if addenda_type == RETURN_ADDENDA:
+                    addenda.update(
+                        reason=_field(record, 4, 6),
+                        original_trace=_field(record, 7, 21),
+                        info=_field(record, 36, 79),
+                    )
+                elif addenda_type == CHANGE_ADDENDA:
+                    addenda.update(reason=_field(record, 4, 6), corrected=_field(record, 36, 64))
+                else:
+                    addenda["info"] = _field(record, 4, 83)
+                entry["addenda"].append(addenda)
+                continue
+            if entry is not None:
+                yield entry
+                entry = None
+
+            if record_type == "6":
+                transaction_code = _field(record, 2, 3)
+                amount = _cents(_field(record, 30, 39))
+                routing = _field(record, 4, 11)
+                self._count("debit" if _is_debit(transaction_code) else "credit", amount, routing)
+                entry = {
+                    **self._batch,
+                    "line": number,
+                    "transaction_code": transaction_code,
+                    "routing": routing,
+                    "account": _field(record, 13, 29),
+                    "amount_cents": amount,
+                    "individual_id": _field(record, 40, 54),
+                    "name": _field(record, 55, 76),
+                    "trace": _field(record, 80, 94),
+                    "addenda": [],
+                }
+            elif record_type == "5":
+                self.batches += 1
+                self._batch_totals = self._empty_totals()
+                self._batch = {
+                    "batch": _field(record, 88, 94),
+                    "company_name": _field(record, 5, 20),
+                    "sec_code": _field(record, 51, 53),
+                    "effective_date": _effective_date(_field(record, 70, 75)),
+                }
+            elif record_type == "8":
+                self._check(
+                    number, f"Batch {self._batch.get('batch')}", self._batch_totals,
+                    _field(record, 5, 10), _field(record, 11, 20), _field(record, 21, 32), _field(record, 33, 44)
+                )
+            elif record_type == "9":
+                if set(record.strip()) == {"9"}:
+                    continue  # block padding
+                if _cents(_field(record, 2, 7)) != self.batches:
+                    self.on_problem(number, CONTROL_MISMATCH, f"File batch count is {_field(record, 2, 7)}, found {self.batches}")
+                self._check(
+                    number, "File", self._file_totals,
+                    _field(record, 14, 21), _field(record, 22, 31), _field(record, 32, 43), _field(record, 44, 55)
+                )
+            elif record_type != "1" and record.strip():
+                self.on_problem(number, MALFORMED_RECORD, f"Unexpected record type {record_type!r}")
+        if entry is not None:
+            yield entry
+
+
+def loan_reference(entry: Dict[str, Any]) -> str:
+    for addenda in entry["addenda"]:
+        if addenda["type"] == PAYMENT_INFO_ADDENDA and addenda.get("info"):
+            return addenda["info"].replace("\\", "*").split("*")[0].strip()
+    return entry["individual_id"]
+
+
+class AchReconciler:
+    """Applies parsed NACHA entries to loans chunk by chunk and collects exceptions"""
+
+    def __init__(
+        self,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        dry_run: bool = False,
+        on_exception: Optional[Callable[[Dict[str, Any]], None]] = None,
+    ):
+        self.chunk_size = chunk_size
+        self.dry_run = dry_run
+        self.on_exception = on_exception
+        self.entries = 0
+        self.skipped = 0
+        self.duplicates = 0
+        self.payments = {"count": 0, "amount_cents": 0}
+        self.returns = {"count": 0, "amount_cents": 0}
+        self.exception_counts: Counter = Counter()
+        self.exceptions: List[Dict[str, Any]] = []
+        self._pending: List[Dict[str, Any]] = []
+        self.parser = NachaParser(self.problem)
+
+    def exception(self, reason: str, entry: Optional[Dict[str, Any]] = None, detail: Optional[str] = None, line: Optional[int] = None):
+        record = {
+            "line": line if line is not None else entry and entry["line"],
+            "reason": reason,
+            "trace": entry and entry["trace"],
+            "reference": entry and loan_reference(entry),
+            "amount": entry and entry["amount_cents"] / 100,
+            "detail": detail,
+        }
+        self.exception_counts[reason] += 1
+        if len(self.exceptions) < MAX_REPORTED_EXCEPTIONS:
+            self.exceptions.append(record)
+        if self.on_exception:
+            self.on_exception(record)
+
+    def problem(self, line: int, reason: str, detail: str):
+        self.exception(reason, detail=detail, line=line)
+
+    async def add(self, entry: Dict[str, Any]):
+        self.entries += 1
+        self._pending.append(entry)
+        if len(self._pending) >= self.chunk_size:
+            await self.flush()
+
+    async def _find_loans(self, loan_ids: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+        loans = {}
+        cursor = loans_collection.find(ids_filter(set(loan_ids)), LOAN_FIELDS, **find_options())
+        async for loan in cursor:
+            loan = from_document(loan)
+            loans[loan["id"]] = loan
+        return loans
+
+    async def _insert(self, transactions: List[Tuple[Dict[str, Any], Transaction]]) -> List[Tuple[Dict[str, Any], Transaction]]:
+        """Insert the transactions; return those that were not already applied"""
+        if not transactions:
+            return []
+        if self.dry_run:
+            cursor = transactions_collection.find(
+                ids_filter(transaction.id for _, transaction in transactions), {"_id": 1, "id": 1}, **find_options()
+            )
+            existing = {from_document(doc)["id"] async for doc in cursor}
+            duplicate = {i for i, (_, transaction) in enumerate(transactions) if transaction.id in existing}
+        else:
+            try:
+                await transactions_collection.bulk_write(
+                    [InsertOne(to_document(transaction.dict())) for _, transaction in transactions],
+                    ordered=False
+                )
+                duplicate = set()
+            except BulkWriteError as e:
+                duplicate = set()
+                for write_error in e.details.get("writeErrors", []):
+                    if write_error.get("code") != DUPLICATE_KEY_ERROR:
+                        raise
+                    duplicate.add(write_error["index"])
+        for index in sorted(duplicate):
+            self.duplicates += 1
+            self.exception(ALREADY_APPLIED, transactions[index][0])
+        return [pair for index, pair in enumerate(transactions) if index not in duplicate]
+
+    async def _apply(self, applied: List[Tuple[Dict[str, Any], Transaction]], loans: Dict[str, Dict[str, Any]]):
+        """Post applied transactions to the ledger and roll them into loan balances and dealer totals"""
+        if not applied or self.dry_run:
+            return
+        # Openings first, so they carry the balances from before this file
+        await ensure_openings([loans[loan_id] for loan_id in {transaction.loan_id for _, transaction in applied} if loan_id in loans])
+        await post_transactions(transaction for _, transaction in applied)
+
+        loan_deltas = defaultdict(float)
+        dealer_repaid = defaultdict(float)
+        for _, transaction in applied:
+            sign = -1 if transaction.type == TransactionType.payment else 1
+            loan_deltas[transaction.loan_id] += sign * transaction.amount
+            dealer_repaid[transaction.dealer_id] -= sign * transaction.amount
+
+        now = datetime.utcnow()
+        paid_off = {"$lte": ["$remaining_balance", 0]}
+        loan_updates = []
+        dealer_active = defaultdict(int)
+        for loan_id, delta in loan_deltas.items():
+            loan = loans.get(loan_id)
+            if loan is None:
+                continue
+            balance = round((loan.get("remaining_balance") or 0) + delta, 2)
+            was_paid = loan.get("status") == LoanStatus.paid
+            if balance <= 0 and not was_paid:
+                dealer_active[loan["dealer_id"]] -= 1
+            elif balance > 0 and was_paid:
+                dealer_active[loan["dealer_id"]] += 1
+            loan_updates.append(UpdateOne(id_filter(loan_id), [
+                {"$set": {
+                    "remaining_balance": {"$round": [{"$add": [{"$ifNull": ["$remaining_balance", 0]}, delta]}, 2]},
+                    "updated_at": now,
+                }},
+                {"$set": {
+                    "paid_off_date": {"$cond": [
+                        {"$and": [paid_off, {"$ne": ["$status", LoanStatus.paid.value]}]}, now, "$paid_off_date"
+                    ]},
+                    "status": {"$switch": {
+                        "branches": [
+                            {"case": paid_off, "then": LoanStatus.paid.value},
+                            {"case": {"$eq": ["$status", LoanStatus.paid.value]}, "then": LoanStatus.active.value},
+                        ],
+                        "default": "$status",
+                    }},
+                }},
+            ]))
+        await loans_collection.bulk_write(loan_updates, ordered=False)
+
+        dealer_updates = []
+        for dealer_id in set(dealer_repaid) | set(dealer_active):
+            increments = {"total_repaid": round(dealer_repaid[dealer_id], 2)}
+            if dealer_active[dealer_id]:
+                increments["active_loans"] = dealer_active[dealer_id]
+            dealer_updates.append(UpdateOne(id_filter(dealer_id), {"$inc": increments, "$set": {"updated_at": now}}))
+        await dealers_collection.bulk_write(dealer_updates, ordered=False)
+
+    def _timestamp(self, entry: Dict[str, Any]) -> datetime:
+        # Files are often dated ahead; the ledger must not hold the payment until then
+        now = datetime.utcnow()
+        return min(entry["effective_date"], now) if entry.get("effective_date") else now
+
+    async def _settle(self, entries: List[Dict[str, Any]]):
+        loans = await self._find_loans(loan_reference(entry) for entry in entries)
+        remaining = {loan_id: loan.get("remaining_balance") or 0 for loan_id, loan in loans.items()}
+        transactions = []
+        for entry in entries:
+            reference = loan_reference(entry)
+            loan = loans.get(reference)
+            if loan is None:
+                self.exception(UNKNOWN_LOAN, entry)
+                continue
+            if loan.get("status") == LoanStatus.pending:
+                self.exception(LOAN_NOT_DISBURSED, entry)
+                continue
+            amount = entry["amount_cents"] / 100
+            if amount > remaining[reference] + BALANCE_TOLERANCE:
+                # The money has moved, so it is applied; the overage needs a refund or credit
+                self.exception(OVERPAYMENT, entry, f"Balance before payment {round(remaining[reference], 2)}")
+            remaining[reference] -= amount
+            transactions.append((entry, Transaction(
+                id=f"ach:{entry['trace']}",
+                dealer_id=loan["dealer_id"],
+                type=TransactionType.payment,
+                amount=amount,
+                currency="USD",
+                loan_id=reference,
+                method="ACH",
+                status="confirmed",
+                ach_trace=entry["trace"],
+                timestamp=self._timestamp(entry),
+            )))
+        applied = await self._insert(transactions)
+        await self._apply(applied, loans)
+        self.payments["count"] += len(applied)
+        self.payments["amount_cents"] += sum(entry["amount_cents"] for entry, _ in applied)
+
+    async def _reverse(self, entries: List[Dict[str, Any]]):
+        returns = {entry["trace"]: next(a for a in entry["addenda"] if a["type"] == RETURN_ADDENDA) for entry in entries}
+        originals = {}
+        cursor = transactions_collection.find(
+            {"ach_trace": {"$in": [addenda["original_trace"] for addenda in returns.values()]}, "type": TransactionType.payment.value},
+            ORIGINAL_FIELDS,
+            **find_options()
+        )
+        async for original in cursor:
+            originals[original["ach_trace"]] = original
+
+        transactions = []
+        for entry in entries:
+            addenda = returns[entry["trace"]]
+            original = originals.get(addenda["original_trace"])
+            if original is None:
+                self.exception(UNKNOWN_ORIGINAL, entry, f"{addenda['reason']} for trace {addenda['original_trace']}")
+                continue
+            transactions.append((entry, Transaction(
+                id=f"ach-return:{addenda['original_trace']}",
+                dealer_id=original["dealer_id"],
+                type=TransactionType.payment_return,
+                amount=original["amount"],
+                currency="USD",
+                loan_id=original["loan_id"],
+                method="ACH",
+                status="confirmed",
+                ach_trace=addenda["original_trace"],
+                return_reason=addenda["reason"],
+                timestamp=self._timestamp(entry),
+            )))
+        applied = await self._insert(transactions)
+        loans = await self._find_loans(transaction.loan_id for _, transaction in applied) if applied else {}
+        await self._apply(applied, loans)
+        self.returns["count"] += len(applied)
+        self.returns["amount_cents"] += sum(round(transaction.amount * 100) for _, transaction in applied)
+
+    async def flush(self):
+        pending, self._pending = self._pending, []
+        settlements, returns = [], []
+        for entry in pending:
+            addenda_types = {addenda["type"] for addenda in entry["addenda"]}
+            if RETURN_ADDENDA in addenda_types:
+                returns.append(entry)
+            elif CHANGE_ADDENDA in addenda_types:
+                change = next(a for a in entry["addenda"] if a["type"] == CHANGE_ADDENDA)
+                self.exception(NOTIFICATION_OF_CHANGE, entry, f"{change['reason']}: {change['corrected']}")
+            elif not _is_debit(entry["transaction_code"]):
+                self.exception(UNSUPPORTED_ENTRY, entry, f"Transaction code {entry['transaction_code']}")
+            elif entry["amount_cents"] == 0:
+                self.skipped += 1  # prenotes carry no money
+            else:
+                settlements.append(entry)
+        # Settle first so a return of a payment in the same chunk finds it
+        if settlements:
+            await self._settle(settlements)
+        if returns:
+            await self._reverse(returns)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "dry_run": self.dry_run,
+            "batches": self.parser.batches,
+            "entries": self.entries,
+            "payments_applied": self.payments["count"],
+            "payment_amount": self.payments["amount_cents"] / 100,
+            "returns_applied": self.returns["count"],
+            "return_amount": self.returns["amount_cents"] / 100,
+            "duplicates": self.duplicates,
+            "skipped": self.skipped,
+            "exceptions": sum(self.exception_counts.values()),
+            "exceptions_by_reason": dict(self.exception_counts),
+            "exception_report": self.exceptions,
+        }
+
+
+async def reconcile_ach_file(
+    chunks: AsyncIterator[bytes],
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    dry_run: bool = False,
+    on_exception: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Reconcile a streamed NACHA file and return totals and the exceptions report"""
+    reconciler = AchReconciler(chunk_size, dry_run, on_exception)
+    async for entry in reconciler.parser.entries(iter_records(chunks)):
+        await reconciler.add(entry)
+    await reconciler.flush()
+    summary = reconciler.summary()
+    logger.info(
+        f"ACH reconciliation: {summary['payments_applied']} payments, {summary['returns_applied']} returns, "
+        f"{summary['exceptions']} exceptions from {summary['entries']} entries"
+    )
+    return summary
+
+
+async def _read_file(path: str, size: int = 1024 * 1024) -> AsyncIterator[bytes]:
+    with open(path, "rb") as file:
+        while True:
+            data = file.read(size)
+            if not data:
+                break
+            yield data
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Reconcile an ACH settlement or return file")
+    parser.add_argument("file", help="NACHA file")
+    parser.add_argument("--dry-run", action="store_true", help="Match entries and report without writing")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--exceptions", help="Write every exception to this CSV file")
+    args = parser.parse_args()
+
+    report_file = open(args.exceptions, "w", newline="") if args.exceptions else None
+    writer = None
+    if report_file:
+        writer = csv.DictWriter(report_file, fieldnames=["line", "reason", "trace", "reference", "amount", "detail"])
+        writer.writeheader()
+    try:
+        summary = await reconcile_ach_file(
+            _read_file(args.file), args.chunk_size, args.dry_run, writer.writerow if writer else None
+        )
+    finally:
+        if report_file:
+            report_file.close()
+    summary.pop("exception_report")
+    logger.info(f"Summary: {summary}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
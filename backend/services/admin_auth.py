@@ -0,0 +1,27 @@
+"""
+Shared-secret authorisation for operator endpoints
+Callers send ADMIN_TOKEN in the X-Admin-Token header. When ADMIN_TOKEN is not
+configured the admin surface is disabled rather than left open.
+"""
+import hmac
+import os
+from typing import Optional
+
+from fastapi import Depends, Header, HTTPException
+
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN", "")
+ADMIN_TOKEN_HEADER = "x-admin-token"
+
+
+def is_admin(token: Optional[str]) -> bool:
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+
+def require_admin():
+    """Route dependency rejecting requests without the admin token"""
+    async def check_admin(x_admin_token: Optional[str] = Header(None)):
+        if not is_admin(x_admin_token):
+            raise HTTPException(status_code=403, detail="Admin token required")
+    return Depends(check_admin)
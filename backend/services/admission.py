@@ -0,0 +1,266 @@
+"""
+Admission control for the ANVL API
+Requests are sorted into lanes (payments, scans, analytics, default). Each
+dealer or wallet gets a token bucket per lane, and each lane has its own
+concurrency cap with a short bounded queue, so one client's scan or report
+traffic cannot starve payment processing. A dealer or wallet named by the
+request itself is unverified, so it is bucketed together with the client
+address, and the address as a whole gets ADMISSION_ADDRESS_FACTOR times the
+lane's limits; rotating the claimed id does not buy fresh tokens. Only an id
+asserted by an authenticating gateway (ADMISSION_VERIFIED_IDENTITY_HEADER) is
+bucketed on its own. Over-rate requests get 429 and
+requests that cannot be admitted in time get 503, both with Retry-After.
+Buckets live in process by default; the Mongo store shares them across
+workers. Concurrency caps are always per process, like the Mongo pool.
+"""
+import asyncio
+import logging
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from pymongo import ReturnDocument
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from ..database import rate_limit_buckets_collection
+
+logger = logging.getLogger(__name__)
+
+PAYMENTS = "payments"
+SCANS = "scans"
+ANALYTICS = "analytics"
+DEFAULT = "default"
+
+MAX_MEMORY_BUCKETS = 100000
+UNLIMITED_PATHS = {"/api/", "/api/health", "/api/health/live", "/api/health/ready"}
+
+# First match wins; a None method matches any method
+ROUTE_LANES: List[Tuple[str, Optional[str], "re.Pattern"]] = [
+    (PAYMENTS, "POST", re.compile(r"^/api/loans/(approve-batch|[^/]+/(approve|payment))$")),
+    (PAYMENTS, "POST", re.compile(r"^/api/transactions/(simulate-payment)?$")),
+    (SCANS, "POST", re.compile(r"^/api/audits/(nfc-scan)?$")),
+    (SCANS, None, re.compile(r"^/api/vehicles/vin/lookup$")),
+    (SCANS, "POST", re.compile(r"^/api/vehicles/[^/]+/location$")),
+    (SCANS, "GET", re.compile(r"^/api/sync$")),
+    (ANALYTICS, None, re.compile(r"^/api/analytics/")),
+    (ANALYTICS, "GET", re.compile(
+        r"^/api/(audits/dealer/[^/]+/compliance|transactions/dealer/[^/]+/summary"
+        r"|vehicles/search|loans/collateral|loans/[^/]+/detail|dealers/[^/]+/dashboard)$"
+    )),
+    (ANALYTICS, "GET", re.compile(r"^/api/(loans|vehicles|transactions|audits)/$")),
+]
+
+WALLET_PATH = re.compile(r"/wallet/([^/]+)")
+DEALER_PATH = re.compile(r"/dealers?/([^/]+)")
+IDENTITY_HEADERS = ("x-dealer-id", "x-wallet-address")
+IDENTITY_PARAMS = ("dealer_id", "wallet_address", "auditor_wallet")
+# Set by a gateway in front of the API that has authenticated the caller
+VERIFIED_IDENTITY_HEADER = os.environ.get("ADMISSION_VERIFIED_IDENTITY_HEADER", "").lower()
+ADDRESS_FACTOR = float(os.environ.get("ADMISSION_ADDRESS_FACTOR", "4"))
+
+
+def _env_number(name: str, default: float) -> float:
+    return float(os.environ.get(name, default))
+
+
+class Lane:
+    """Token bucket settings plus a concurrency cap with a bounded wait queue"""
+
+    def __init__(
+        self,
+        name: str,
+        rate: float,
+        burst: float,
+        concurrency: Optional[int] = None,
+        queue_size: int = 0,
+        queue_timeout: float = 0.0,
+    ):
+        self.name = name
+        self.rate = rate
+        self.burst = burst
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.waiting = 0
+        self._semaphore = asyncio.Semaphore(concurrency) if concurrency else None
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting up to queue_timeout; False means shed"""
+        if self._semaphore is None:
+            return True
+        if self._semaphore.locked() and self.waiting >= self.queue_size:
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.queue_timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+
+    def release(self):
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+
+def lanes_from_env() -> Dict[str, Lane]:
+    """Lane limits; payments get the most headroom and wait longest before shedding"""
+    defaults = {
+        PAYMENTS: (20, 40, 64, 256, 5.0),
+        SCANS: (10, 30, 32, 64, 1.0),
+        ANALYTICS: (2, 10, 8, 16, 0.5),
+        DEFAULT: (20, 50, None, 0, 0.0),
+    }
+    lanes = {}
+    for name, (rate, burst, concurrency, queue_size, queue_timeout) in defaults.items():
+        prefix = f"ADMISSION_{name.upper()}"
+        concurrency = os.environ.get(f"{prefix}_CONCURRENCY", concurrency)
+        lanes[name] = Lane(
+            name,
+            rate=_env_number(f"{prefix}_RATE", rate),
+            burst=_env_number(f"{prefix}_BURST", burst),
+            concurrency=int(concurrency) if concurrency else None,
+            queue_size=int(_env_number(f"{prefix}_QUEUE", queue_size)),
+            queue_timeout=_env_number(f"{prefix}_QUEUE_TIMEOUT", queue_timeout),
+        )
+    return lanes
+
+
+def classify(method: str, path: str) -> str:
+    for lane, lane_method, pattern in ROUTE_LANES:
+        if (lane_method is None or lane_method == method) and pattern.match(path):
+            return lane
+    return DEFAULT
+
+
+def claimed_identity(scope: Scope, headers: Headers) -> Optional[str]:
+    """The dealer or wallet a request says it acts for"""
+    for header in IDENTITY_HEADERS:
+        if headers.get(header):
+            return headers[header].lower()
+    params = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    for param in IDENTITY_PARAMS:
+        if params.get(param):
+            return params[param][0].lower()
+    match = WALLET_PATH.search(scope.get("path", "")) or DEALER_PATH.search(scope.get("path", ""))
+    return match.group(1).lower() if match else None
+
+
+def client_identity(scope: Scope) -> Tuple[str, Optional[str]]:
+    """Bucket key for the caller, plus the client address bucket it also draws from when unverified"""
+    headers = Headers(scope=scope)
+    if VERIFIED_IDENTITY_HEADER and headers.get(VERIFIED_IDENTITY_HEADER):
+        return headers[VERIFIED_IDENTITY_HEADER].lower(), None
+    client = scope.get("client")
+    address = f"ip:{client[0]}" if client else "anonymous"
+    claimed = claimed_identity(scope, headers)
+    if claimed is None:
+        return address, None
+    return f"{address}/{claimed}", address
+
+
+class MemoryBuckets:
+    """In-process token buckets, evicting the least recently used beyond max_keys"""
+
+    def __init__(self, max_keys: int = MAX_MEMORY_BUCKETS):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        """Spend one token; return 0 if allowed, else seconds until one is available"""
+        now = time.monotonic()
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated) * rate)
+        if tokens >= 1:
+            tokens -= 1
+            wait = 0.0
+        else:
+            wait = (1 - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_keys:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class MongoBuckets:
+    """Token buckets shared by all workers, refilled and spent in one atomic update"""
+
+    def __init__(self, collection=rate_limit_buckets_collection):
+        self.collection = collection
+
+    async def take(self, key: str, rate: float, burst: float) -> float:
+        now = datetime.utcnow()
+        elapsed = {"$divide": [{"$subtract": [now, {"$ifNull": ["$updated_at", now]}]}, 1000]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, rate]}]}]}
+        bucket = await self.collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"tokens": refilled, "updated_at": now}},
+                {"$set": {"allowed": {"$gte": ["$tokens", 1]}}},
+                {"$set": {"tokens": {"$cond": ["$allowed", {"$subtract": ["$tokens", 1]}, "$tokens"]}}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return 0.0 if bucket["allowed"] else (1 - bucket["tokens"]) / rate
+
+
+def buckets_from_env():
+    if os.environ.get("ADMISSION_STORE", "memory") == "mongo":
+        return MongoBuckets()
+    return MemoryBuckets()
+
+
+def _rejection(status_code: int, detail: str, retry_after: float) -> JSONResponse:
+    return JSONResponse(
+        {"detail": detail},
+        status_code=status_code,
+        headers={"Retry-After": str(max(1, math.ceil(retry_after)))}
+    )
+
+
+class AdmissionControlMiddleware:
+    def __init__(self, app: ASGIApp, buckets=None, lanes: Optional[Dict[str, Lane]] = None):
+        self.app = app
+        self.buckets = buckets or MemoryBuckets()
+        self.lanes = lanes or lanes_from_env()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or scope["method"] == "OPTIONS" or scope["path"] in UNLIMITED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.lanes[classify(scope["method"], scope["path"])]
+        identity, address = client_identity(scope)
+        try:
+            wait = await self.buckets.take(f"{lane.name}:{identity}", lane.rate, lane.burst)
+            if address is not None:
+                wait = max(wait, await self.buckets.take(
+                    f"{lane.name}:{address}", lane.rate * ADDRESS_FACTOR, lane.burst * ADDRESS_FACTOR
+                ))
+        except Exception as e:
+            # Fail open: a limiter outage should not take the API down with it
+            logger.warning(f"Rate limiter unavailable: {e}")
+            wait = 0.0
+        if wait > 0:
+            response = _rejection(429, "Rate limit exceeded", wait)
+            await response(scope, receive, send)
+            return
+
+        if not await lane.acquire():
+            logger.warning(f"Shedding {scope['method']} {scope['path']} from the {lane.name} lane")
+            response = _rejection(503, "Server busy, try again shortly", lane.queue_timeout or 1)
+            await response(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            lane.release()
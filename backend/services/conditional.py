@@ -0,0 +1,138 @@
+"""
+Conditional GET support for the ANVL API
+Builds ETag and Last-Modified validators from `updated_at` (plus the vehicle
+sync sequence when present) and answers If-None-Match / If-Modified-Since with
+304 from a projection-only read before any model is constructed.
+"""
+import hashlib
+import json
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from ..database import from_document, find_options, command_options
+
+VALIDATOR_FIELDS = {"_id": 1, "id": 1, "updated_at": 1, "sync_seq": 1}
+
+Validators = Tuple[str, Optional[datetime]]
+
+
+def _millis(moment: Optional[datetime]) -> int:
+    if moment is None:
+        return 0
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return int(moment.timestamp() * 1000)
+
+
+def resource_validators(doc: Dict[str, Any]) -> Validators:
+    """ETag and Last-Modified for a single document"""
+    updated_at = doc.get("updated_at")
+    etag = f'W/"{doc.get("id")}-{_millis(updated_at)}-{doc.get("sync_seq") or 0}"'
+    return etag, updated_at
+
+
+def list_validators(count: int, last_modified: Optional[datetime], version: Optional[int] = None) -> Validators:
+    """ETag and Last-Modified for a list, from its size and newest change"""
+    return f'W/"n{count}-{_millis(last_modified)}-{version or 0}"', last_modified
+
+
+def docs_list_validators(docs: Iterable[Dict[str, Any]]) -> Validators:
+    """List validators computed from documents already fetched"""
+    docs = list(docs)
+    updated = [doc["updated_at"] for doc in docs if doc.get("updated_at")]
+    versions = [doc["sync_seq"] for doc in docs if doc.get("sync_seq")]
+    return list_validators(len(docs), max(updated, default=None), max(versions, default=None))
+
+
+async def query_list_validators(collection, filter_dict: Dict[str, Any]) -> Validators:
+    """List validators from one grouped read, without fetching the documents"""
+    rows = await collection.aggregate([
+        {"$match": filter_dict},
+        {"$group": {
+            "_id": None,
+            "count": {"$sum": 1},
+            "last_modified": {"$max": "$updated_at"},
+            "version": {"$max": "$sync_seq"}
+        }}
+    ], **command_options()).to_list(length=1)
+    if not rows:
+        return list_validators(0, None)
+    return list_validators(rows[0]["count"], rows[0].get("last_modified"), rows[0].get("version"))
+
+
+def payload_etag(payload: Any) -> str:
+    """Weak ETag over a composed response payload"""
+    body = json.dumps(jsonable_encoder(payload), sort_keys=True, separators=(",", ":"))
+    return f'W/"{hashlib.sha1(body.encode("utf-8")).hexdigest()}"'
+
+
+def has_conditional_headers(request: Request) -> bool:
+    return "if-none-match" in request.headers or "if-modified-since" in request.headers
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = [tag.strip() for tag in header.split(",")]
+    # Weak comparison: W/"x" and "x" refer to the same representation
+    return "*" in candidates or etag.removeprefix("W/") in [tag.removeprefix("W/") for tag in candidates]
+
+
+def is_not_modified(request: Request, etag: str, last_modified: Optional[datetime] = None) -> bool:
+    """If-None-Match takes precedence; If-Modified-Since is only consulted without it"""
+    if "if-none-match" in request.headers:
+        return etag_matches(request, etag)
+    since = request.headers.get("if-modified-since")
+    if not since or last_modified is None:
+        return False
+    try:
+        since_at = parsedate_to_datetime(since)
+    except (TypeError, ValueError):
+        return False
+    if since_at.tzinfo is None:
+        since_at = since_at.replace(tzinfo=timezone.utc)
+    return _millis(last_modified) // 1000 <= int(since_at.timestamp())
+
+
+def validator_headers(etag: str, last_modified: Optional[datetime] = None) -> Dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if last_modified is not None:
+        moment = last_modified if last_modified.tzinfo else last_modified.replace(tzinfo=timezone.utc)
+        headers["Last-Modified"] = format_datetime(moment.astimezone(timezone.utc), usegmt=True)
+    return headers
+
+
+def not_modified(etag: str, last_modified: Optional[datetime] = None) -> Response:
+    return Response(status_code=304, headers=validator_headers(etag, last_modified))
+
+
+def apply_validators(response: Response, etag: str, last_modified: Optional[datetime] = None):
+    response.headers.update(validator_headers(etag, last_modified))
+
+
+async def check_resource(request: Request, collection, filter_dict: Dict[str, Any]) -> Optional[Response]:
+    """304 from a projection-only read when the client's copy is current, otherwise None"""
+    if not has_conditional_headers(request):
+        return None
+    doc = from_document(await collection.find_one(filter_dict, VALIDATOR_FIELDS, **find_options()))
+    if not doc:
+        return None
+    etag, last_modified = resource_validators(doc)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    return None
+
+
+async def check_list(request: Request, collection, filter_dict: Dict[str, Any]) -> Optional[Response]:
+    """304 for a list when nothing matching the filter was added, removed or updated"""
+    if not has_conditional_headers(request):
+        return None
+    etag, last_modified = await query_list_validators(collection, filter_dict)
+    if is_not_modified(request, etag, last_modified):
+        return not_modified(etag, last_modified)
+    return None
@@ -0,0 +1,91 @@
+"""
+Minimal Ethereum JSON-RPC helpers shared by the on-chain services
+"""
+import asyncio
+from typing import Any, Dict, List, Optional
+
+import requests
+from Crypto.Hash import keccak
+
+
+class JsonRpcError(Exception):
+    pass
+
+
+def keccak256(data: bytes) -> bytes:
+    return keccak.new(digest_bits=256, data=data).digest()
+
+
+def function_selector(signature: str) -> bytes:
+    """First four bytes of keccak256 of a Solidity function signature"""
+    return keccak256(signature.encode("ascii"))[:4]
+
+
+def encode_uint256(value: int) -> bytes:
+    return value.to_bytes(32, "big")
+
+
+def encode_address(address: str) -> bytes:
+    return bytes.fromhex(address[2:].rjust(64, "0"))
+
+
+class JsonRpcClient:
+    """Ethereum JSON-RPC client; blocking calls run in a worker thread"""
+
+    def __init__(self, url: str, timeout: float = 30):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        self._request_id = 0
+
+    def _call(self, method: str, params: List[Any]) -> Any:
+        self._request_id += 1
+        response = self.session.post(
+            self.url,
+            json={"jsonrpc": "2.0", "id": self._request_id, "method": method, "params": params},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        payload = response.json()
+        if payload.get("error"):
+            raise JsonRpcError(payload["error"].get("message", str(payload["error"])))
+        return payload["result"]
+
+    async def call(self, method: str, params: Optional[List[Any]] = None) -> Any:
+        return await asyncio.to_thread(self._call, method, params or [])
+
+    async def block_number(self) -> int:
+        return int(await self.call("eth_blockNumber"), 16)
+
+    async def block_hash(self, number: int) -> Optional[str]:
+        block = await self.call("eth_getBlockByNumber", [hex(number), False])
+        return block["hash"] if block else None
+
+    async def get_logs(self, address: str, from_block: int, to_block: int, topics: List[Any]) -> List[Dict[str, Any]]:
+        return await self.call("eth_getLogs", [{
+            "address": address,
+            "fromBlock": hex(from_block),
+            "toBlock": hex(to_block),
+            "topics": topics,
+        }])
+
+    async def eth_call(self, to: str, data: bytes) -> bytes:
+        result = await self.call("eth_call", [{"to": to, "data": "0x" + data.hex()}, "latest"])
+        return bytes.fromhex(result[2:])
+
+    async def send_transaction(self, sender: str, to: str, data: bytes) -> str:
+        """Send a transaction from an account the node can sign for (e.g. anvil or a signer proxy)"""
+        return await self.call("eth_sendTransaction", [{"from": sender, "to": to, "data": "0x" + data.hex()}])
+
+    async def wait_for_receipt(self, tx_hash: str, timeout: float = 120, poll_interval: float = 1) -> Dict[str, Any]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            receipt = await self.call("eth_getTransactionReceipt", [tx_hash])
+            if receipt:
+                if int(receipt.get("status", "0x1"), 16) != 1:
+                    raise JsonRpcError(f"Transaction {tx_hash} reverted")
+                return receipt
+            if loop.time() > deadline:
+                raise JsonRpcError(f"Timed out waiting for transaction {tx_hash}")
+            await asyncio.sleep(poll_interval)
@@ -0,0 +1,263 @@
+"""
+Migration of business ids into the Mongo primary key
+Documents written before the business `id` became `_id` carry an ObjectId `_id`
+and a separate `id` field. `_id` cannot be changed in place, so each document
+is copied under its business id first and the legacy copy is deleted only if it
+still matches what was read. A legacy copy written in the meantime is re-read
+and copied again, so no write is lost and the document is never missing; an
+interrupted run leaves both copies and the next run finishes the move. Where a
+unique index (vin, email, wallet) rules out a second copy, the conditional
+delete and the insert run in one transaction instead.
+
+While LEGACY_ID_COMPAT is on, every document keeps its `id` field as well, so
+instances still running the old code keep finding documents during a rolling
+deploy; the migration also backfills `id` on documents written without it.
+Once no old instance is left, run `--drop-legacy-id`, then turn
+LEGACY_ID_COMPAT off.
+
+    python -m backend.services.id_migration --status
+    python -m backend.services.id_migration [--collections dealers loans] [--batch-size 500]
+    python -m backend.services.id_migration --drop-legacy-id
+"""
+import argparse
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+
+from ..database import (
+    LEGACY_ID_COMPAT, client, dealers_collection, loans_collection, vehicles_collection, audits_collection,
+    transactions_collection, notifications_collection, indexer_checkpoints_collection
+)
+
+logger = logging.getLogger(__name__)
+
+MIGRATED_COLLECTIONS = {
+    collection.name: collection
+    for collection in (
+        dealers_collection, loans_collection, vehicles_collection,
+        audits_collection, transactions_collection, notifications_collection
+    )
+}
+DEFAULT_BATCH_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+MAX_MOVE_ATTEMPTS = 5
+LEGACY_FILTER = {"_id": {"$type": "objectId"}, "id": {"$type": "string"}}
+
+
+def _checkpoint_id(name: str) -> str:
+    return f"id_migration:{name}"
+
+
+def _rewrite(document: Dict[str, Any]) -> Dict[str, Any]:
+    rewritten = {field: value for field, value in document.items() if field != "_id"}
+    rewritten["_id"] = document["id"]
+    return rewritten
+
+
+async def _insert_rewritten(collection, documents: List[Dict[str, Any]]) -> Tuple[Set[Any], Set[Any], Set[Any]]:
+    """Insert the rewritten documents; return the legacy ObjectIds that failed, were already copied,
+    and were blocked by a unique index on another field"""
+    try:
+        await collection.insert_many([_rewrite(doc) for doc in documents], ordered=False)
+        return set(), set(), set()
+    except BulkWriteError as e:
+        failed, copied, blocked = set(), set(), set()
+        for write_error in e.details.get("writeErrors", []):
+            document = documents[write_error["index"]]
+            if write_error.get("code") == DUPLICATE_KEY_ERROR:
+                # A duplicate business id means an interrupted run already copied it; a duplicate
+                # vin, email or wallet is the legacy copy itself, so the two cannot coexist
+                if "_id" in write_error.get("keyPattern", {}):
+                    copied.add(document["_id"])
+                else:
+                    blocked.add(document["_id"])
+                continue
+            logger.error(f"Could not migrate {collection.name} {document['id']}: {write_error.get('errmsg')}")
+            failed.add(document["_id"])
+        return failed, copied, blocked
+
+
+async def _refresh_copy(collection, document: Dict[str, Any], session=None) -> bool:
+    """Overwrite the business-id copy with the legacy content unless the copy was written more
+    recently; return whether the copy exists"""
+    filter_dict = {"_id": document["id"]}
+    if document.get("updated_at") is not None:
+        filter_dict["updated_at"] = {"$not": {"$gt": document["updated_at"]}}
+    result = await collection.replace_one(filter_dict, _rewrite(document), session=session)
+    if result.matched_count:
+        return True
+    return await collection.count_documents({"_id": document["id"]}, limit=1, session=session) > 0
+
+
+def _unchanged(document: Dict[str, Any]) -> Dict[str, Any]:
+    """Filter matching the legacy copy only while it is exactly as read"""
+    return {"_id": document["_id"], "$expr": {"$eq": ["$$ROOT", {"$literal": document}]}}
+
+
+async def _settle(collection, document: Dict[str, Any]) -> bool:
+    """Delete the legacy copy once the business-id copy holds its latest content"""
+    for _ in range(MAX_MOVE_ATTEMPTS):
+        result = await collection.delete_one(_unchanged(document))
+        if result.deleted_count:
+            return True
+        current = await collection.find_one({"_id": document["_id"]})
+        if current is None:
+            # Deleted through the legacy copy since it was read; the delete wins
+            await collection.delete_one({"_id": document["id"]})
+            return True
+        # Written through the legacy copy since it was read; carry the write over
+        await _refresh_copy(collection, current)
+        document = current
+    logger.error(f"{collection.name} {document['id']} kept changing; leaving it for the next run")
+    return False
+
+
+async def _swap(collection, document: Dict[str, Any]) -> bool:
+    """Replace the unchanged legacy copy with the business-id copy in one transaction"""
+    for _ in range(MAX_MOVE_ATTEMPTS):
+        try:
+            async with await client.start_session() as session:
+                async with session.start_transaction():
+                    result = await collection.delete_one(_unchanged(document), session=session)
+                    if result.deleted_count:
+                        if not await _refresh_copy(collection, document, session):
+                            await collection.insert_one(_rewrite(document), session=session)
+                        return True
+        except DuplicateKeyError as e:
+            logger.error(f"Could not migrate {collection.name} {document['id']}: {e}")
+            return False
+        except OperationFailure as e:
+            if not e.has_error_label("TransientTransactionError"):
+                raise
+        current = await collection.find_one({"_id": document["_id"]})
+        if current is None:
+            return True
+        document = current
+    logger.error(f"{collection.name} {document['id']} kept changing; leaving it for the next run")
+    return False
+
+
+async def _move(collection, documents: List[Dict[str, Any]]) -> int:
+    """Copy legacy documents under their business id, then delete the unchanged legacy copies"""
+    failed, copied, blocked = await _insert_rewritten(collection, documents)
+    moved = 0
+    for document in documents:
+        if document["_id"] in failed:
+            continue
+        if document["_id"] in blocked:
+            settled = await _swap(collection, document)
+        else:
+            if document["_id"] in copied:
+                await _refresh_copy(collection, document)
+            settled = await _settle(collection, document)
+        if settled:
+            moved += 1
+    if moved < len(documents):
+        raise RuntimeError(f"{len(documents) - moved} {collection.name} documents were not migrated")
+    return moved
+
+
+async def backfill_legacy_id(collection) -> int:
+    """Copy `_id` into `id` on documents keyed by business id that lack the legacy field"""
+    result = await collection.update_many(
+        {"_id": {"$type": "string"}, "id": {"$exists": False}}, [{"$set": {"id": "$_id"}}]
+    )
+    if result.modified_count:
+        logger.info(f"Backfilled the legacy id field on {result.modified_count} {collection.name} documents")
+    return result.modified_count
+
+
+async def migrate_collection(collection, batch_size: int = DEFAULT_BATCH_SIZE, pause: float = 0.0) -> int:
+    """Move every legacy document in the collection to its business id; safe to re-run"""
+    migrated = 0
+    while True:
+        documents = await collection.find(LEGACY_FILTER).sort("_id", 1).limit(batch_size).to_list(length=batch_size)
+        if not documents:
+            break
+        migrated += await _move(collection, documents)
+        await indexer_checkpoints_collection.update_one(
+            {"_id": _checkpoint_id(collection.name)},
+            {"$inc": {"migrated": len(documents)}, "$set": {"updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+        if len(documents) < batch_size:
+            break
+        if pause:
+            await asyncio.sleep(pause)
+
+    if LEGACY_ID_COMPAT:
+        await backfill_legacy_id(collection)
+
+    remaining = await collection.count_documents({"_id": {"$type": "objectId"}})
+    update = {"updated_at": datetime.utcnow(), "remaining": remaining}
+    if remaining == 0:
+        update["completed_at"] = datetime.utcnow()
+    await indexer_checkpoints_collection.update_one(
+        {"_id": _checkpoint_id(collection.name)}, {"$set": update}, upsert=True
+    )
+    if remaining:
+        logger.warning(f"{remaining} {collection.name} documents have an ObjectId _id but no string id")
+    logger.info(f"Migrated {migrated} {collection.name} documents to business-id primary keys")
+    return migrated
+
+
+async def drop_legacy_id(collection, batch_size: int = DEFAULT_BATCH_SIZE) -> int:
+    """Remove the duplicated `id` field once no instance reads it any more"""
+    if await collection.count_documents({"_id": {"$type": "objectId"}}, limit=1):
+        # Unmigrated documents only have their business id in `id`
+        raise RuntimeError(f"{collection.name} still has unmigrated documents; finish the migration first")
+    filter_dict = {"_id": {"$not": {"$type": "objectId"}}, "id": {"$exists": True}}
+    dropped = 0
+    while True:
+        documents = await collection.find(filter_dict, {"_id": 1}).limit(batch_size).to_list(length=batch_size)
+        if not documents:
+            break
+        result = await collection.update_many(
+            {"_id": {"$in": [doc["_id"] for doc in documents]}}, {"$unset": {"id": ""}}
+        )
+        dropped += result.modified_count
+    logger.info(f"Dropped the legacy id field from {dropped} {collection.name} documents")
+    return dropped
+
+
+async def migration_status(names: Optional[Iterable[str]] = None) -> Dict[str, Dict[str, Any]]:
+    status = {}
+    for name in names or MIGRATED_COLLECTIONS:
+        collection = MIGRATED_COLLECTIONS[name]
+        checkpoint = await indexer_checkpoints_collection.find_one({"_id": _checkpoint_id(name)}) or {}
+        status[name] = {
+            "legacy": await collection.count_documents({"_id": {"$type": "objectId"}}),
+            "migrated": checkpoint.get("migrated", 0),
+            "completed_at": checkpoint.get("completed_at"),
+        }
+    return status
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Store business ids as the Mongo _id")
+    parser.add_argument("--collections", nargs="+", choices=sorted(MIGRATED_COLLECTIONS), default=list(MIGRATED_COLLECTIONS))
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--pause", type=float, default=0.0, help="Seconds to wait between batches")
+    parser.add_argument("--drop-legacy-id", action="store_true", help="Remove the duplicated id field after the deploy")
+    parser.add_argument("--status", action="store_true", help="Report progress and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        for name, counts in (await migration_status(args.collections)).items():
+            logger.info(f"{name}: {counts}")
+        return
+
+    for name in args.collections:
+        collection = MIGRATED_COLLECTIONS[name]
+        if args.drop_legacy_id:
+            await drop_legacy_id(collection, args.batch_size)
+        else:
+            await migrate_collection(collection, args.batch_size, args.pause)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
@@ -0,0 +1,301 @@
+"""
+Durable background jobs for the ANVL API
+Jobs are documents in the jobs collection. Workers lease one at a time with an
+atomic find_one_and_update that sets a visibility timeout; a job whose worker
+dies becomes visible again once the lease expires. Failed jobs are retried with
+exponential backoff until max_attempts, then kept as failed for inspection.
+Delivery is at-least-once, so handlers must tolerate running twice.
+
+The worker pool runs inside the API process by default, or on its own:
+
+    python -m backend.services.job_queue [--concurrency 8]
+    python -m backend.services.job_queue --status
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import signal
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from ..database import jobs_collection
+from .tracing import tracer
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "4"))
+VISIBILITY_TIMEOUT = timedelta(seconds=int(os.environ.get("JOB_VISIBILITY_TIMEOUT_SECONDS", "60")))
+MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "5"))
+RETRY_BASE_SECONDS = float(os.environ.get("JOB_RETRY_BASE_SECONDS", "5"))
+RETRY_MAX_SECONDS = float(os.environ.get("JOB_RETRY_MAX_SECONDS", "900"))
+POLL_INTERVAL_SECONDS = float(os.environ.get("JOB_POLL_INTERVAL_SECONDS", "1"))
+SHUTDOWN_GRACE_SECONDS = 30
+
+JobHandler = Callable[[Dict[str, Any]], Awaitable[Any]]
+_handlers: Dict[str, JobHandler] = {}
+# Set by an in-process pool so enqueued jobs start without waiting for a poll
+_wakeup: Optional[asyncio.Event] = None
+
+
+def job_handler(job_type: str):
+    """Register the coroutine that runs jobs of this type; it receives the job document"""
+    def register(func: JobHandler) -> JobHandler:
+        _handlers[job_type] = func
+        return func
+    return register
+
+
+async def enqueue(
+    job_type: str,
+    payload: Dict[str, Any],
+    delay: float = 0,
+    max_attempts: int = MAX_ATTEMPTS,
+    dedupe_key: Optional[str] = None,
+) -> str:
+    """Queue a job and return its id; a queued job with the same dedupe_key absorbs this one"""
+    now = datetime.utcnow()
+    job = {
+        "_id": str(uuid.uuid4()),
+        "type": job_type,
+        "payload": payload,
+        "status": QUEUED,
+        "attempts": 0,
+        "max_attempts": max_attempts,
+        "run_at": now + timedelta(seconds=delay),
+        "created_at": now,
+        "updated_at": now,
+    }
+    if dedupe_key is None:
+        await jobs_collection.insert_one(job)
+    else:
+        job["dedupe_key"] = dedupe_key
+        try:
+            result = await jobs_collection.find_one_and_update(
+                {"dedupe_key": dedupe_key, "status": QUEUED},
+                {"$setOnInsert": job},
+                upsert=True,
+                projection={"_id": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            job["_id"] = result["_id"]
+        except DuplicateKeyError:
+            # Another enqueue inserted the same key first; that job will do
+            existing = await jobs_collection.find_one({"dedupe_key": dedupe_key, "status": QUEUED}, {"_id": 1})
+            job["_id"] = existing["_id"] if existing else job["_id"]
+    if _wakeup is not None:
+        _wakeup.set()
+    return job["_id"]
+
+
+async def lease(worker_id: str, now: Optional[datetime] = None) -> Optional[Dict[str, Any]]:
+    """Claim the next due job, or one whose previous lease expired"""
+    now = now or datetime.utcnow()
+    return await jobs_collection.find_one_and_update(
+        {"$or": [
+            {"status": QUEUED, "run_at": {"$lte": now}},
+            {"status": RUNNING, "lease_expires_at": {"$lte": now}},
+        ]},
+        {
+            "$set": {
+                "status": RUNNING,
+                "leased_by": worker_id,
+                "lease_token": str(uuid.uuid4()),
+                "lease_expires_at": now + VISIBILITY_TIMEOUT,
+                "started_at": now,
+                "updated_at": now,
+            },
+            "$inc": {"attempts": 1},
+            "$unset": {"dedupe_key": ""},
+        },
+        sort=[("run_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+
+async def extend_lease(job: Dict[str, Any]) -> bool:
+    """Push the visibility timeout out while a long job is still running"""
+    now = datetime.utcnow()
+    result = await jobs_collection.update_one(
+        {"_id": job["_id"], "lease_token": job["lease_token"]},
+        {"$set": {"lease_expires_at": now + VISIBILITY_TIMEOUT, "updated_at": now}}
+    )
+    return result.modified_count == 1
+
+
+async def complete(job: Dict[str, Any]):
+    now = datetime.utcnow()
+    await jobs_collection.update_one(
+        {"_id": job["_id"], "lease_token": job["lease_token"]},
+        {
+            "$set": {"status": DONE, "finished_at": now, "updated_at": now},
+            "$unset": {"lease_expires_at": "", "lease_token": ""},
+        }
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """Exponential backoff with jitter, so a failing dependency is not hammered in lockstep"""
+    delay = min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+async def fail(job: Dict[str, Any], error: str):
+    """Schedule a retry, or give up once the job has used its attempts"""
+    now = datetime.utcnow()
+    if job["attempts"] >= job.get("max_attempts", MAX_ATTEMPTS):
+        update = {"status": FAILED, "finished_at": now}
+        logger.error(f"Job {job['type']} {job['_id']} failed after {job['attempts']} attempts: {error}")
+    else:
+        update = {"status": QUEUED, "run_at": now + timedelta(seconds=retry_delay(job["attempts"]))}
+        logger.warning(f"Job {job['type']} {job['_id']} attempt {job['attempts']} failed, retrying: {error}")
+    await jobs_collection.update_one(
+        {"_id": job["_id"], "lease_token": job["lease_token"]},
+        {
+            "$set": {**update, "last_error": error, "updated_at": now},
+            "$unset": {"lease_expires_at": "", "lease_token": ""},
+        }
+    )
+
+
+async def run_job(job: Dict[str, Any]):
+    """Run one leased job, keeping its lease alive, and record the outcome"""
+    handler = _handlers.get(job["type"])
+    if handler is None:
+        await fail(job, f"No handler registered for job type {job['type']}")
+        return
+    if job["attempts"] > job.get("max_attempts", MAX_ATTEMPTS):
+        # Its earlier workers kept dying mid-run; stop handing it out
+        await fail(job, job.get("last_error") or "Lease expired on every attempt")
+        return
+
+    async def heartbeat():
+        while True:
+            await asyncio.sleep(VISIBILITY_TIMEOUT.total_seconds() / 3)
+            if not await extend_lease(job):
+                logger.warning(f"Job {job['type']} {job['_id']} lost its lease")
+                return
+
+    keeper = asyncio.ensure_future(heartbeat())
+    try:
+        with tracer.span(f"job {job['type']}", attributes={"job.id": job["_id"], "job.attempt": job["attempts"]}):
+            await handler(job)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        keeper.cancel()
+        await fail(job, f"{type(e).__name__}: {e}")
+        return
+    finally:
+        keeper.cancel()
+    await complete(job)
+
+
+class WorkerPool:
+    """`concurrency` workers leasing and running jobs until stopped"""
+
+    def __init__(self, concurrency: int = JOB_WORKERS, poll_interval: float = POLL_INTERVAL_SECONDS):
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.worker_id = None
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+        self._workers: List[asyncio.Task] = []
+
+    async def _work(self, index: int):
+        while not self._stopping:
+            try:
+                job = await lease(f"{self.worker_id}/{index}")
+            except Exception as e:
+                logger.error(f"Error leasing jobs: {e}")
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            try:
+                await run_job(job)
+            except Exception as e:
+                # Recording the outcome failed; the lease expires and the job is retried
+                logger.error(f"Error running job {job['type']} {job['_id']}: {e}")
+
+    def start(self):
+        global _wakeup
+        if self._workers:
+            return
+        self._stopping = False
+        # Set here rather than in __init__ so pre-forked workers get their own pid
+        self.worker_id = f"{os.uname().nodename}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._wakeup = _wakeup = asyncio.Event()
+        self._workers = [
+            asyncio.create_task(self._work(index), name=f"job_worker_{index}")
+            for index in range(self.concurrency)
+        ]
+        logger.info(f"Started {self.concurrency} job workers as {self.worker_id}")
+
+    async def stop(self, grace: float = SHUTDOWN_GRACE_SECONDS):
+        """Stop leasing, let running jobs finish for up to `grace` seconds, then cancel"""
+        global _wakeup
+        if not self._workers:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        _, pending = await asyncio.wait(self._workers, timeout=grace)
+        for task in pending:
+            # Cancelled jobs keep their lease and are retried once it expires
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if _wakeup is self._wakeup:
+            _wakeup = None
+
+
+async def queue_stats() -> Dict[str, Any]:
+    counts = await jobs_collection.aggregate([
+        {"$group": {"_id": {"type": "$type", "status": "$status"}, "count": {"$sum": 1}}}
+    ]).to_list(length=None)
+    stats: Dict[str, Dict[str, int]] = {}
+    for row in counts:
+        stats.setdefault(row["_id"]["type"], {})[row["_id"]["status"]] = row["count"]
+    return stats
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Run ANVL background job workers")
+    parser.add_argument("--concurrency", type=int, default=JOB_WORKERS)
+    parser.add_argument("--status", action="store_true", help="Report job counts by type and status and exit")
+    args = parser.parse_args()
+
+    if args.status:
+        for job_type, counts in (await queue_stats()).items():
+            logger.info(f"{job_type}: {counts}")
+        return
+
+    from . import jobs  # noqa: F401 - registers the job handlers
+
+    stopping = asyncio.Event()
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, stopping.set)
+    pool = WorkerPool(args.concurrency)
+    pool.start()
+    try:
+        await stopping.wait()
+    finally:
+        await pool.stop()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
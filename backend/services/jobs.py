@@ -0,0 +1,85 @@
+"""
+Background job handlers for the ANVL API
+Follow-up work that routes used to do inline: dealer counter updates after
+approvals and payments, compliance alert fan-out, and out-of-trust re-scoring
+after payments. Routes call the enqueue helpers here and return immediately.
+"""
+import logging
+from datetime import datetime
+from typing import Any, Dict
+
+from ..models import NotificationSeverity
+from ..database import dealers_collection, id_filter
+from .job_queue import enqueue, job_handler
+from .notification_aggregator import record_alert
+from .out_of_trust import run_detection
+
+logger = logging.getLogger(__name__)
+
+DEALER_STATS = "dealer_stats"
+COMPLIANCE_ALERT = "compliance_alert"
+OUT_OF_TRUST_RESCAN = "out_of_trust_rescan"
+
+# Recent job ids kept on each dealer so a retried counter job is not applied twice
+APPLIED_JOBS_KEPT = 200
+RESCAN_DELAY_SECONDS = 30
+
+
+async def update_dealer_stats(dealer_id: str, increments: Dict[str, float]) -> str:
+    return await enqueue(DEALER_STATS, {"dealer_id": dealer_id, "inc": increments})
+
+
+async def send_compliance_alert(
+    dealer_id: str,
+    subject_id: str,
+    title: str,
+    message: str,
+    severity: NotificationSeverity = NotificationSeverity.warning,
+) -> str:
+    return await enqueue(COMPLIANCE_ALERT, {
+        "dealer_id": dealer_id,
+        "subject_id": subject_id,
+        "title": title,
+        "message": message,
+        "severity": severity.value,
+        "occurred_at": datetime.utcnow(),
+    })
+
+
+async def rescan_out_of_trust() -> str:
+    """Re-score out-of-trust findings soon; bursts of payments share one run"""
+    return await enqueue(OUT_OF_TRUST_RESCAN, {}, delay=RESCAN_DELAY_SECONDS, dedupe_key=OUT_OF_TRUST_RESCAN)
+
+
+@job_handler(DEALER_STATS)
+async def apply_dealer_stats(job: Dict[str, Any]):
+    payload = job["payload"]
+    result = await dealers_collection.update_one(
+        {**id_filter(payload["dealer_id"]), "applied_jobs": {"$ne": job["_id"]}},
+        {
+            "$inc": payload["inc"],
+            "$set": {"updated_at": datetime.utcnow()},
+            "$push": {"applied_jobs": {"$each": [job["_id"]], "$slice": -APPLIED_JOBS_KEPT}},
+        }
+    )
+    if result.matched_count == 0 and not await dealers_collection.count_documents(id_filter(payload["dealer_id"]), limit=1):
+        logger.warning(f"Dealer {payload['dealer_id']} not found for stats update {job['_id']}")
+
+
+@job_handler(COMPLIANCE_ALERT)
+async def deliver_compliance_alert(job: Dict[str, Any]):
+    payload = job["payload"]
+    await record_alert(
+        dealer_id=payload["dealer_id"],
+        notification_type="compliance_alert",
+        subject_id=payload["subject_id"],
+        title=payload["title"],
+        message=payload["message"],
+        severity=NotificationSeverity(payload["severity"]),
+        now=payload.get("occurred_at"),
+    )
+
+
+@job_handler(OUT_OF_TRUST_RESCAN)
+async def run_out_of_trust_rescan(job: Dict[str, Any]):
+    await run_detection()
@@ -0,0 +1,66 @@
+"""
+Streaming JSON list responses
+Encodes documents as the Motor cursor yields them, so large lists start
+sending immediately and never hold the whole body in memory.
+"""
+import json
+import logging
+from typing import Any, AsyncIterator, Dict, Optional, Type
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+
+from ..database import from_document
+
+logger = logging.getLogger(__name__)
+
+STREAM_CHUNK_BYTES = 64 * 1024
+STREAM_BATCH_SIZE = 500
+
+
+def _encode(doc: Dict[str, Any], model: Optional[Type[BaseModel]]) -> str:
+    from_document(doc)
+    value = model(**doc) if model else doc
+    return json.dumps(jsonable_encoder(value), separators=(",", ":"))
+
+
+async def iter_json_list(cursor, model: Optional[Type[BaseModel]] = None, message: str = "") -> AsyncIterator[bytes]:
+    """Yield `{"success": true, "data": [...], "message": ...}` in chunks of roughly STREAM_CHUNK_BYTES"""
+    parts = ['{"success":true,"data":[']
+    size = len(parts[0])
+    first = True
+    try:
+        async for doc in cursor:
+            encoded = _encode(doc, model)
+            parts.append(encoded if first else "," + encoded)
+            size += len(encoded) + 1
+            first = False
+            if size >= STREAM_CHUNK_BYTES:
+                yield "".join(parts).encode("utf-8")
+                parts, size = [], 0
+    except Exception as e:
+        # Headers are already sent, so the truncated body is the only signal left
+        logger.error(f"Error streaming list response: {e}")
+        raise
+    parts.append(f'],"message":{json.dumps(message)}}}')
+    yield "".join(parts).encode("utf-8")
+
+
+async def streaming_list_response(
+    cursor,
+    model: Optional[Type[BaseModel]] = None,
+    headers: Optional[Dict[str, str]] = None,
+    message: str = "",
+) -> StreamingResponse:
+    """Stream a cursor as the repo's list envelope; the first chunk is read before returning
+    so query errors still surface as normal HTTP errors"""
+    chunks = iter_json_list(cursor.batch_size(STREAM_BATCH_SIZE), model, message)
+    head = await chunks.__anext__()
+
+    async def body():
+        yield head
+        async for chunk in chunks:
+            yield chunk
+
+    return StreamingResponse(body(), media_type="application/json", headers=headers)
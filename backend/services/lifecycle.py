@@ -0,0 +1,37 @@
+"""
+Process lifecycle state for the health probes
+Liveness only says the event loop is answering. Readiness also needs startup to
+have finished and the process not to be draining, so that a load balancer stops
+sending new requests to a worker before it closes its socket on SIGTERM.
+"""
+import logging
+
+logger = logging.getLogger(__name__)
+
+STARTING = "starting"
+READY = "ready"
+DRAINING = "draining"
+
+_state = STARTING
+
+
+def state() -> str:
+    return _state
+
+
+def is_ready() -> bool:
+    return _state == READY
+
+
+def mark_ready():
+    global _state
+    if _state == STARTING:
+        _state = READY
+
+
+def begin_drain():
+    """Report not-ready from now on; in-flight requests keep running"""
+    global _state
+    if _state != DRAINING:
+        logger.info("Draining: readiness now reports unavailable")
+    _state = DRAINING
@@ -0,0 +1,367 @@
+"""
+Append-only loan ledger
+Every disbursement, payment, return, fee, accrual and adjustment is an immutable
+entry carrying a signed change to the loan's principal balance. Periodic
+snapshots store each touched loan's balance at a point in time, so the
+balance as of any date is the latest snapshot before it plus a range scan of
+the entries since. `remaining_balance` on the loan is a cached copy of the
+ledger balance. Loans that predate the ledger get an opening entry carrying
+their cached balance the first time they are posted to.
+
+    python -m backend.services.loan_ledger --open-balances
+    python -m backend.services.loan_ledger --snapshot
+    python -m backend.services.loan_ledger --reconcile
+"""
+import argparse
+import asyncio
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterable, List, Optional, Tuple
+
+from pymongo import DeleteMany
+from pymongo.errors import BulkWriteError
+
+from ..models import LoanStatus, Transaction, TransactionType
+from ..database import (
+    loans_collection, transactions_collection, loan_ledger_collection, loan_balance_snapshots_collection,
+    indexer_checkpoints_collection, to_document, from_document, find_options, command_options,
+    id_filter, BUSINESS_ID
+)
+
+logger = logging.getLogger(__name__)
+
+OPENING = "opening"
+DISBURSEMENT = "disbursement"
+PAYMENT = "payment"
+PAYMENT_RETURN = "payment_return"
+FEE = "fee"
+ACCRUAL = "accrual"
+ADJUSTMENT = "adjustment"
+
+# Transaction types that move a loan's balance, and in which direction
+TRANSACTION_ENTRIES = {
+    TransactionType.loan_disbursement: (DISBURSEMENT, 1),
+    TransactionType.payment: (PAYMENT, -1),
+    TransactionType.payment_return: (PAYMENT_RETURN, 1),
+    TransactionType.fee: (FEE, 1),
+}
+
+# Snapshots are taken this far in the past, so entries still being written land after them
+SNAPSHOT_LAG = timedelta(seconds=int(os.environ.get("LEDGER_SNAPSHOT_LAG_SECONDS", "300")))
+SNAPSHOT_CHECKPOINT = "loan_ledger:snapshots"
+DUPLICATE_KEY_ERROR = 11000
+BALANCE_TOLERANCE = 0.005
+MISMATCH_SAMPLE = 100
+OPENING_BATCH_SIZE = 500
+EPOCH = datetime(1970, 1, 1)
+
+
+def ledger_entry(
+    loan_id: str,
+    dealer_id: str,
+    kind: str,
+    amount: float,
+    effective_at: Optional[datetime] = None,
+    entry_id: Optional[str] = None,
+    transaction_id: Optional[str] = None,
+    memo: Optional[str] = None,
+) -> Dict[str, Any]:
+    """A ledger entry; `amount` is the signed change to the balance"""
+    now = datetime.utcnow()
+    return {
+        "_id": entry_id or transaction_id or str(uuid.uuid4()),
+        "loan_id": loan_id,
+        "dealer_id": dealer_id,
+        "kind": kind,
+        "amount": amount,
+        "effective_at": effective_at or now,
+        "recorded_at": now,
+        "transaction_id": transaction_id,
+        "memo": memo,
+    }
+
+
+async def record_entries(entries: List[Dict[str, Any]]) -> int:
+    """Append entries, ignoring ones already recorded under the same id"""
+    if not entries:
+        return 0
+    try:
+        result = await loan_ledger_collection.insert_many(entries, ordered=False)
+        recorded = len(result.inserted_ids)
+    except BulkWriteError as e:
+        if any(error.get("code") != DUPLICATE_KEY_ERROR for error in e.details.get("writeErrors", [])):
+            raise
+        recorded = e.details.get("nInserted", 0)
+
+    # A backdated entry makes every later snapshot of its loan stale
+    backdated = {}
+    for entry in entries:
+        if entry["effective_at"] < entry["recorded_at"] - SNAPSHOT_LAG:
+            backdated[entry["loan_id"]] = min(entry["effective_at"], backdated.get(entry["loan_id"], entry["effective_at"]))
+    if backdated:
+        await loan_balance_snapshots_collection.bulk_write([
+            DeleteMany({"loan_id": loan_id, "as_of": {"$gte": effective_at}})
+            for loan_id, effective_at in backdated.items()
+        ], ordered=False)
+    return recorded
+
+
+def transaction_entries(transactions: Iterable[Transaction]) -> List[Dict[str, Any]]:
+    """Entries for loan transactions that move a balance, keyed by transaction id so re-posting is harmless"""
+    entries = []
+    for transaction in transactions:
+        if not transaction.loan_id or transaction.type not in TRANSACTION_ENTRIES:
+            continue
+        kind, sign = TRANSACTION_ENTRIES[transaction.type]
+        entries.append(ledger_entry(
+            transaction.loan_id, transaction.dealer_id, kind, sign * transaction.amount,
+            effective_at=transaction.timestamp, transaction_id=transaction.id
+        ))
+    return entries
+
+
+async def post_transactions(transactions: Iterable[Transaction]) -> int:
+    return await record_entries(transaction_entries(transactions))
+
+
+async def unpost_transactions(transaction_ids: List[str]):
+    """Drop the entries of transactions whose write failed and is being rolled back"""
+    entries = await loan_ledger_collection.find(
+        {"transaction_id": {"$in": transaction_ids}}, {"loan_id": 1}
+    ).to_list(length=None)
+    if not entries:
+        return
+    await loan_ledger_collection.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+    await loan_balance_snapshots_collection.delete_many({"loan_id": {"$in": list({entry["loan_id"] for entry in entries})}})
+
+
+async def ensure_openings(loans: List[Dict[str, Any]]) -> int:
+    """Carry pre-ledger loans' cached balances into the ledger as their opening entries"""
+    candidates = {loan["id"]: loan for loan in loans if loan.get("status") != LoanStatus.pending}
+    if not candidates:
+        return 0
+    ledgered = set(await loan_ledger_collection.distinct("loan_id", {"loan_id": {"$in": list(candidates)}}))
+    # Fixed ids: concurrent first postings to the same loan open it once
+    return await record_entries([
+        ledger_entry(
+            loan_id, loan["dealer_id"], OPENING, loan.get("remaining_balance") or 0,
+            effective_at=loan.get("start_date") or loan.get("created_at"),
+            entry_id=f"{OPENING}:{loan_id}", memo="Balance carried over from before the ledger"
+        )
+        for loan_id, loan in candidates.items()
+        if loan_id not in ledgered
+    ])
+
+
+async def ensure_opening(loan: Dict[str, Any]) -> bool:
+    return await ensure_openings([loan]) > 0
+
+
+async def balance_as_of(loan_id: str, at: Optional[datetime] = None) -> float:
+    """Latest snapshot at or before `at`, plus the entries since it"""
+    at = at or datetime.utcnow()
+    snapshot = await loan_balance_snapshots_collection.find_one(
+        {"loan_id": loan_id, "as_of": {"$lte": at}}, sort=[("as_of", -1)], **find_options()
+    )
+    balance, since = (snapshot["balance"], snapshot["as_of"]) if snapshot else (0.0, EPOCH)
+    tail = await loan_ledger_collection.aggregate([
+        {"$match": {"loan_id": loan_id, "effective_at": {"$gt": since, "$lte": at}}},
+        {"$group": {"_id": None, "amount": {"$sum": "$amount"}}}
+    ], **command_options()).to_list(length=1)
+    if tail:
+        balance += tail[0]["amount"]
+    return round(balance, 2)
+
+
+async def current_balance(loan: Dict[str, Any]) -> float:
+    await ensure_opening(loan)
+    return await balance_as_of(loan["id"])
+
+
+async def refresh_cached_balance(loan_id: str) -> float:
+    """Copy the ledger balance onto the loan document"""
+    balance = await balance_as_of(loan_id)
+    await loans_collection.update_one(
+        id_filter(loan_id),
+        {"$set": {"remaining_balance": balance, "updated_at": datetime.utcnow()}}
+    )
+    return balance
+
+
+async def record_payment(
+    loan: Dict[str, Any],
+    amount: float,
+    method: str = "ACH",
+    dealer_id: Optional[str] = None,
+) -> Tuple[Transaction, float, LoanStatus]:
+    """Post a payment, capped at the balance, and update the loan from the resulting ledger balance"""
+    # A pending loan has no disbursement yet; its zero balance would mark it paid
+    if loan.get("status", LoanStatus.active) != LoanStatus.active:
+        raise ValueError("Loan is not active")
+    amount = min(amount, await current_balance(loan))
+    transaction = Transaction(
+        dealer_id=dealer_id or loan["dealer_id"],
+        type=TransactionType.payment,
+        amount=amount,
+        currency="USD",
+        loan_id=loan["id"],
+        method=method,
+        status="confirmed"
+    )
+    await transactions_collection.insert_one(to_document(transaction.dict()))
+    await post_transactions([transaction])
+
+    balance = await balance_as_of(loan["id"])
+    now = datetime.utcnow()
+    update_data = {"remaining_balance": balance, "updated_at": now}
+    if balance <= 0:
+        status = LoanStatus.paid
+        update_data.update(status=status, paid_off_date=now)
+    else:
+        status = LoanStatus(loan.get("status", LoanStatus.active))
+        update_data["next_payment_due"] = now + timedelta(days=30)
+        update_data["next_payment_amount"] = min(balance / max(1, loan.get("term", 1) - 1), balance)
+    await loans_collection.update_one(id_filter(loan["id"]), {"$set": update_data})
+    return transaction, balance, status
+
+
+async def adjust_balance(loan: Dict[str, Any], balance: float, memo: str) -> float:
+    """Record the adjustment that brings the ledger balance to `balance`"""
+    # Until disbursement the ledger is empty; an adjustment would be added on top of it
+    if loan.get("status") == LoanStatus.pending:
+        raise ValueError("The balance of a pending loan is set by its disbursement")
+    difference = round(balance - await current_balance(loan), 2)
+    if abs(difference) > BALANCE_TOLERANCE:
+        await record_entries([ledger_entry(loan["id"], loan["dealer_id"], ADJUSTMENT, difference, memo=memo)])
+    return await balance_as_of(loan["id"])
+
+
+async def list_entries(loan_id: str, limit: int = 100) -> List[Dict[str, Any]]:
+    cursor = loan_ledger_collection.find({"loan_id": loan_id}, **find_options()).sort("effective_at", -1).limit(limit)
+    entries = []
+    async for entry in cursor:
+        entry["id"] = entry.pop("_id")
+        entries.append(entry)
+    return entries
+
+
+async def snapshot_balances(now: Optional[datetime] = None) -> int:
+    """Scheduled entry point: snapshot every loan with entries recorded since the last run"""
+    now = now or datetime.utcnow()
+    as_of = now - SNAPSHOT_LAG
+    checkpoint = await indexer_checkpoints_collection.find_one({"_id": SNAPSHOT_CHECKPOINT})
+    since = checkpoint["high_water_mark"] if checkpoint else EPOCH
+    loan_ids = await loan_ledger_collection.distinct("loan_id", {"recorded_at": {"$gt": since}})
+    for loan_id in loan_ids:
+        balance = await balance_as_of(loan_id, as_of)
+        await loan_balance_snapshots_collection.update_one(
+            {"_id": f"{loan_id}:{as_of.strftime('%Y%m%dT%H%M%S')}"},
+            {"$set": {"loan_id": loan_id, "as_of": as_of, "balance": balance, "created_at": now}},
+            upsert=True
+        )
+    # Entries recorded after as_of may not be in these snapshots yet, so the next run looks again
+    await indexer_checkpoints_collection.update_one(
+        {"_id": SNAPSHOT_CHECKPOINT},
+        {"$set": {"high_water_mark": as_of, "updated_at": now}},
+        upsert=True
+    )
+    if loan_ids:
+        logger.info(f"Snapshotted ledger balances for {len(loan_ids)} loans as of {as_of}")
+    return len(loan_ids)
+
+
+async def open_balances() -> int:
+    """Give every non-pending loan without ledger entries its opening entry"""
+    opened = 0
+    batch = []
+    async for loan in loans_collection.find({"status": {"$ne": LoanStatus.pending.value}}):
+        batch.append(from_document(loan))
+        if len(batch) >= OPENING_BATCH_SIZE:
+            opened += await ensure_openings(batch)
+            batch = []
+    opened += await ensure_openings(batch)
+    logger.info(f"Opened ledger balances for {opened} loans")
+    return opened
+
+
+async def _ledger_balances() -> AsyncIterator[Tuple[str, float]]:
+    """Fold the whole ledger in loan order into one balance per loan"""
+    loan_id, balance = None, 0.0
+    cursor = loan_ledger_collection.find({}, {"loan_id": 1, "amount": 1}).sort([("loan_id", 1), ("effective_at", 1)])
+    async for entry in cursor:
+        if entry["loan_id"] != loan_id:
+            if loan_id is not None:
+                yield loan_id, round(balance, 2)
+            loan_id, balance = entry["loan_id"], 0.0
+        balance += entry["amount"]
+    if loan_id is not None:
+        yield loan_id, round(balance, 2)
+
+
+async def reconcile() -> Dict[str, Any]:
+    """Merge the folded ledger with the loans, both in id order, and report disagreements"""
+    report = {
+        "loans": 0, "ledger_total": 0.0, "cached_total": 0.0,
+        "mismatched": 0, "unledgered": 0, "orphaned": 0, "mismatches": [],
+    }
+    # Sorted on the business id, so loans not yet moved off an ObjectId _id merge in order too
+    loans = loans_collection.aggregate([
+        {"$match": {"status": {"$ne": LoanStatus.pending.value}}},
+        {"$project": {"_id": 0, "id": BUSINESS_ID, "remaining_balance": 1}},
+        {"$sort": {"id": 1}},
+    ], allowDiskUse=True)
+    loan = await anext(loans, None)
+
+    def count_loan(cached: float):
+        report["loans"] += 1
+        report["cached_total"] += cached or 0
+
+    async for loan_id, balance in _ledger_balances():
+        report["ledger_total"] += balance
+        while loan is not None and loan["id"] < loan_id:
+            count_loan(loan.get("remaining_balance"))
+            report["unledgered"] += 1
+            loan = await anext(loans, None)
+        if loan is None or loan["id"] != loan_id:
+            report["orphaned"] += 1
+            continue
+        cached = loan.get("remaining_balance") or 0
+        count_loan(cached)
+        if abs(cached - balance) > BALANCE_TOLERANCE:
+            report["mismatched"] += 1
+            if len(report["mismatches"]) < MISMATCH_SAMPLE:
+                report["mismatches"].append({"loan_id": loan_id, "ledger": balance, "cached": cached})
+        loan = await anext(loans, None)
+    while loan is not None:
+        count_loan(loan.get("remaining_balance"))
+        report["unledgered"] += 1
+        loan = await anext(loans, None)
+
+    report["ledger_total"] = round(report["ledger_total"], 2)
+    report["cached_total"] = round(report["cached_total"], 2)
+    return report
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Maintain and check the loan ledger")
+    parser.add_argument("--open-balances", action="store_true", help="Open pre-ledger loans at their cached balance")
+    parser.add_argument("--snapshot", action="store_true", help="Snapshot balances of recently posted loans")
+    parser.add_argument("--reconcile", action="store_true", help="Compare ledger balances with cached loan balances")
+    args = parser.parse_args()
+
+    if args.open_balances:
+        await open_balances()
+    if args.snapshot:
+        await snapshot_balances()
+    if args.reconcile or not (args.open_balances or args.snapshot):
+        report = await reconcile()
+        for mismatch in report.pop("mismatches"):
+            logger.warning(f"Loan {mismatch['loan_id']}: ledger {mismatch['ledger']} cached {mismatch['cached']}")
+        logger.info(f"Reconciliation: {report}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
@@ -10,7 +10,8 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from datetime import datetime, timedelta
 from database import (
     dealers_collection, loans_collection, vehicles_collection, 
-    audits_collection, transactions_collection, notifications_collection
+    audits_collection, transactions_collection, notifications_collection,
+    to_document
 )
 from models import *
 
@@ -40,7 +41,7 @@ async def seed_mock_data():
         total_repaid=320000,
         active_loans=3
     )
-    await dealers_collection.insert_one(dealer.dict())
+    await dealers_collection.insert_one(to_document(dealer.dict()))
     
     # Create mock loans
     loans = [
@@ -90,7 +91,7 @@ async def seed_mock_data():
         )
     ]
     for loan in loans:
-        await loans_collection.insert_one(loan.dict())
+        await loans_collection.insert_one(to_document(loan.dict()))
     
     # Create mock vehicles
     vehicles = [
@@ -150,7 +151,7 @@ async def seed_mock_data():
         )
     ]
     for vehicle in vehicles:
-        await vehicles_collection.insert_one(vehicle.dict())
+        await vehicles_collection.insert_one(to_document(vehicle.dict()))
     
     # Create mock audits
     audits = [
@@ -180,7 +181,7 @@ async def seed_mock_data():
         )
     ]
     for audit in audits:
-        await audits_collection.insert_one(audit.dict())
+        await audits_collection.insert_one(to_document(audit.dict()))
     
     # Create mock transactions
     transactions = [
@@ -218,7 +219,7 @@ async def seed_mock_data():
         )
     ]
     for transaction in transactions:
-        await transactions_collection.insert_one(transaction.dict())
+        await transactions_collection.insert_one(to_document(transaction.dict()))
     
     # Create mock notifications
     notifications = [
@@ -244,7 +245,7 @@ async def seed_mock_data():
         )
     ]
     for notification in notifications:
-        await notifications_collection.insert_one(notification.dict())
+        await notifications_collection.insert_one(to_document(notification.dict()))
     
     print("Mock data seeded successfully!")
 
@@ -0,0 +1,126 @@
+"""
+Coalescing of repeated alert notifications
+Repeated alerts for the same dealer, type and subject (e.g. one vehicle) within
+a time window update a single notification, bumping its occurrence count and
+last_seen, instead of inserting a new one per event. Repeats are summarised per
+dealer in periodic digest notifications.
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, Optional
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from ..models import Notification, NotificationSeverity
+from ..database import notifications_collection, to_document, from_document
+
+logger = logging.getLogger(__name__)
+
+COALESCE_WINDOW = timedelta(minutes=int(os.environ.get("NOTIFICATION_COALESCE_MINUTES", "60")))
+DIGEST_TYPE = "compliance_digest"
+
+
+def _window_start(moment: datetime) -> datetime:
+    window = int(COALESCE_WINDOW.total_seconds())
+    epoch = datetime(1970, 1, 1)
+    seconds = int((moment - epoch).total_seconds())
+    return epoch + timedelta(seconds=seconds - seconds % window)
+
+
+def coalesce_key(dealer_id: str, notification_type: str, subject_id: str, moment: datetime) -> str:
+    return f"{notification_type}:{dealer_id}:{subject_id}:{_window_start(moment).strftime('%Y%m%d%H%M')}"
+
+
+async def record_alert(
+    dealer_id: str,
+    notification_type: str,
+    subject_id: str,
+    title: str,
+    message: str,
+    severity: NotificationSeverity = NotificationSeverity.warning,
+    now: Optional[datetime] = None,
+) -> Dict[str, Any]:
+    """Insert the alert, or fold it into the open one for the same subject and window"""
+    now = now or datetime.utcnow()
+    key = coalesce_key(dealer_id, notification_type, subject_id, now)
+    notification = Notification(
+        dealer_id=dealer_id,
+        type=notification_type,
+        title=title,
+        message=message,
+        severity=severity,
+        subject_id=subject_id,
+        first_seen=now,
+        timestamp=now,
+    )
+    changing = {"timestamp", "last_seen", "message", "read", "occurrences"}
+    update = {
+        "$setOnInsert": {
+            **{k: v for k, v in to_document(notification.dict()).items() if k not in changing},
+            "coalesce_key": key,
+        },
+        # A new occurrence resurfaces the alert even if it was already read
+        "$set": {"timestamp": now, "last_seen": now, "message": message, "read": False, "digest_pending": True},
+        "$unset": {"read_at": ""},
+        "$inc": {"occurrences": 1},
+    }
+    try:
+        return from_document(await notifications_collection.find_one_and_update(
+            {"coalesce_key": key}, update, upsert=True, return_document=ReturnDocument.AFTER
+        ))
+    except DuplicateKeyError:
+        # Lost an insert race for the same key; the winner's document now matches
+        return from_document(await notifications_collection.find_one_and_update(
+            {"coalesce_key": key}, update, return_document=ReturnDocument.AFTER
+        ))
+
+
+async def deliver_digests(now: Optional[datetime] = None) -> int:
+    """Summarise repeat occurrences since the last digest into one notification per dealer"""
+    now = now or datetime.utcnow()
+    pending = await notifications_collection.find(
+        {"digest_pending": True, "last_seen": {"$lte": now}},
+        {"_id": 1, "dealer_id": 1, "subject_id": 1, "occurrences": 1, "digested_occurrences": 1}
+    ).to_list(length=None)
+    if not pending:
+        return 0
+
+    repeats = defaultdict(lambda: {"subjects": set(), "occurrences": 0})
+    for alert in pending:
+        # The first occurrence was delivered as the alert itself
+        new = alert.get("occurrences", 1) - max(alert.get("digested_occurrences", 0), 1)
+        if new > 0:
+            repeats[alert["dealer_id"]]["subjects"].add(alert.get("subject_id"))
+            repeats[alert["dealer_id"]]["occurrences"] += new
+
+    digests = [
+        Notification(
+            dealer_id=dealer_id,
+            type=DIGEST_TYPE,
+            title="Compliance Alert Digest",
+            message=(
+                f"{summary['occurrences']} repeat compliance alerts across "
+                f"{len(summary['subjects'])} vehicles since the last digest"
+            ),
+            severity=NotificationSeverity.warning,
+        ).dict()
+        for dealer_id, summary in repeats.items()
+    ]
+    if digests:
+        await notifications_collection.insert_many([to_document(digest) for digest in digests])
+
+    # Alerts that changed since they were read stay pending for the next digest
+    await notifications_collection.bulk_write([
+        UpdateOne(
+            {"_id": alert["_id"], "occurrences": alert.get("occurrences", 1)},
+            {"$set": {"digest_pending": False, "digested_occurrences": alert.get("occurrences", 1)}}
+        )
+        for alert in pending
+    ], ordered=False)
+
+    if digests:
+        logger.info(f"Delivered {len(digests)} compliance alert digests")
+    return len(digests)
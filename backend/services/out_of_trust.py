@@ -0,0 +1,258 @@
+"""
+Out-of-trust detection for floor plan collateral
+Finds financed units sold without being paid off (sold out of trust) and
+on-lot units that have gone too long without an audit. Each run only examines
+units that crossed a threshold since the previous high-water mark, re-checks
+open findings to resolve them, and writes findings and notifications in bulk.
+A payment return can put an older sale back out of trust, so sold units whose
+loans had a return posted since the last run are re-checked too.
+"""
+import logging
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Set
+
+from pymongo import UpdateOne
+
+from ..models import LoanStatus, Notification, NotificationSeverity, TransactionType, VehicleStatus
+from ..database import (
+    vehicles_collection, loans_collection, transactions_collection,
+    notifications_collection, risk_findings_collection, indexer_checkpoints_collection,
+    loan_ledger_collection, to_document, from_document, find_options, ids_filter, lookup_by_id
+)
+from .loan_ledger import PAYMENT_RETURN, SNAPSHOT_LAG
+
+logger = logging.getLogger(__name__)
+
+SOLD_OUT_OF_TRUST = "sold_out_of_trust"
+AUDIT_STALE = "audit_stale"
+RULES = (SOLD_OUT_OF_TRUST, AUDIT_STALE)
+
+SOT_GRACE = timedelta(days=int(os.environ.get("SOLD_PAYOFF_GRACE_DAYS", "3")))
+AUDIT_STALE_AFTER = timedelta(days=int(os.environ.get("AUDIT_STALE_DAYS", "7")))
+OUTSTANDING_STATUSES = [LoanStatus.active.value, LoanStatus.overdue.value]
+NOTIFICATION_VIN_SAMPLE = 5
+EPOCH = datetime(1970, 1, 1)
+
+
+def _checkpoint_id(rule: str) -> str:
+    return f"out_of_trust:{rule}"
+
+
+async def _high_water_mark(rule: str) -> datetime:
+    checkpoint = await indexer_checkpoints_collection.find_one({"_id": _checkpoint_id(rule)})
+    return checkpoint["high_water_mark"] if checkpoint else EPOCH
+
+
+async def _save_high_water_mark(rule: str, mark: datetime, returns_mark: Optional[datetime] = None):
+    update = {"high_water_mark": mark, "updated_at": datetime.utcnow()}
+    if returns_mark is not None:
+        update["returns_mark"] = returns_mark
+    await indexer_checkpoints_collection.update_one({"_id": _checkpoint_id(rule)}, {"$set": update}, upsert=True)
+
+
+async def _returns_mark(rule: str) -> datetime:
+    checkpoint = await indexer_checkpoints_collection.find_one({"_id": _checkpoint_id(rule)}, {"returns_mark": 1})
+    return (checkpoint or {}).get("returns_mark") or EPOCH
+
+
+async def _returned_loan_ids(since: datetime, until: datetime) -> List[str]:
+    """Loans with a payment return posted to the ledger in the range"""
+    return await loan_ledger_collection.distinct(
+        "loan_id", {"kind": PAYMENT_RETURN, "recorded_at": {"$gt": since, "$lte": until}}
+    )
+
+
+def _sold_unpaid_pipeline(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Sold financed units whose loan is outstanding and has no payoff since the sale"""
+    return [
+        {"$match": {"status": VehicleStatus.sold.value, "loan_id": {"$ne": None}, **match}},
+        {"$project": {"id": 1, "vin": 1, "dealer_id": 1, "loan_id": 1, "price": 1, "sold_date": 1}},
+        *lookup_by_id(loans_collection, "loan_id", "loan"),
+        {"$unwind": "$loan"},
+        {"$match": {"loan.status": {"$in": OUTSTANDING_STATUSES}}},
+        {"$lookup": {
+            "from": transactions_collection.name, "localField": "loan_id", "foreignField": "loan_id", "as": "payments"
+        }},
+        {"$project": {
+            "id": 1, "vin": 1, "dealer_id": 1, "loan_id": 1, "price": 1, "sold_date": 1,
+            "paid_since_sale": {"$sum": {"$map": {
+                "input": {"$filter": {
+                    "input": "$payments",
+                    "as": "payment",
+                    "cond": {"$and": [
+                        {"$in": ["$$payment.type", [TransactionType.payment.value, TransactionType.payment_return.value]]},
+                        {"$gte": ["$$payment.timestamp", "$sold_date"]}
+                    ]}
+                }},
+                "as": "payment",
+                # Returned payments take their amount back off
+                "in": {"$cond": [
+                    {"$eq": ["$$payment.type", TransactionType.payment.value]},
+                    "$$payment.amount",
+                    {"$multiply": ["$$payment.amount", -1]}
+                ]}
+            }}}
+        }},
+        {"$match": {"$expr": {"$lt": ["$paid_since_sale", "$price"]}}},
+    ]
+
+
+def _stale_filter(match: Dict[str, Any]) -> Dict[str, Any]:
+    """On-lot financed units whose last audit (or arrival, if never audited) falls in the range"""
+    return {
+        "status": VehicleStatus.on_lot.value,
+        "loan_id": {"$ne": None},
+        "$or": [
+            {"last_audit": match},
+            {"last_audit": None, "created_at": match},
+        ],
+    }
+
+
+async def _sold_unpaid(match: Dict[str, Any]) -> List[Dict[str, Any]]:
+    rows = await vehicles_collection.aggregate(_sold_unpaid_pipeline(match)).to_list(length=None)
+    return [
+        {
+            "vehicle_id": row["id"], "vin": row.get("vin"), "dealer_id": row.get("dealer_id"),
+            "loan_id": row.get("loan_id"),
+            "details": {
+                "sold_date": row.get("sold_date"),
+                "unpaid_amount": round(row.get("price", 0) - row.get("paid_since_sale", 0), 2),
+            },
+        }
+        for row in map(from_document, rows)
+    ]
+
+
+async def _audit_stale(match: Dict[str, Any], extra: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    filter_dict = {"$and": [_stale_filter(match), extra]} if extra else _stale_filter(match)
+    rows = await vehicles_collection.find(
+        filter_dict,
+        {"id": 1, "vin": 1, "dealer_id": 1, "loan_id": 1, "last_audit": 1, "created_at": 1}
+    ).to_list(length=None)
+    return [
+        {
+            "vehicle_id": row["id"], "vin": row.get("vin"), "dealer_id": row.get("dealer_id"),
+            "loan_id": row.get("loan_id"),
+            "details": {"last_audit": row.get("last_audit") or row.get("created_at")},
+        }
+        for row in map(from_document, rows)
+    ]
+
+
+async def _open_vehicle_ids(rule: str) -> List[str]:
+    cursor = risk_findings_collection.find({"rule": rule, "status": "open"}, {"vehicle_id": 1})
+    return [finding["vehicle_id"] async for finding in cursor]
+
+
+async def _detect(rule: str, now: datetime):
+    """New violations since the high-water mark, and open findings that still violate"""
+    mark = await _high_water_mark(rule)
+    open_ids = await _open_vehicle_ids(rule)
+    returns_mark = None
+    if rule == SOLD_OUT_OF_TRUST:
+        cutoff = now - SOT_GRACE
+        new = await _sold_unpaid({"sold_date": {"$gt": mark, "$lte": cutoff}})
+        still = await _sold_unpaid(ids_filter(open_ids)) if open_ids else []
+        # Sales behind the mark were judged paid; a return since the last run can undo that
+        returns_mark = now - SNAPSHOT_LAG
+        returned = await _returned_loan_ids(await _returns_mark(rule), returns_mark)
+        if returned:
+            new += await _sold_unpaid({"loan_id": {"$in": returned}, "sold_date": {"$lte": mark}})
+    else:
+        cutoff = now - AUDIT_STALE_AFTER
+        new = await _audit_stale({"$gt": mark, "$lte": cutoff})
+        still = await _audit_stale({"$lte": cutoff}, ids_filter(open_ids)) if open_ids else []
+    resolved = set(open_ids) - {finding["vehicle_id"] for finding in still}
+    return new, resolved, cutoff, returns_mark
+
+
+async def _write_findings(rule: str, findings: List[Dict[str, Any]], resolved: Set[str], now: datetime) -> List[Dict[str, Any]]:
+    """Upsert findings and close resolved ones in one bulk write; return the newly opened findings"""
+    operations = [
+        UpdateOne(
+            {"_id": f"{rule}:{finding['vehicle_id']}"},
+            {
+                "$set": {**finding, "rule": rule, "status": "open", "last_checked": now},
+                "$setOnInsert": {"detected_at": now},
+                "$unset": {"resolved_at": ""},
+            },
+            upsert=True
+        )
+        for finding in findings
+    ] + [
+        UpdateOne(
+            {"_id": f"{rule}:{vehicle_id}", "status": "open"},
+            {"$set": {"status": "resolved", "resolved_at": now, "last_checked": now}}
+        )
+        for vehicle_id in resolved
+    ]
+    if not operations:
+        return []
+    previous = set()
+    async for finding in risk_findings_collection.find(
+        {"_id": {"$in": [f"{rule}:{finding['vehicle_id']}" for finding in findings]}, "status": "open"},
+        {"_id": 1}
+    ):
+        previous.add(finding["_id"])
+    await risk_findings_collection.bulk_write(operations, ordered=False)
+    return [finding for finding in findings if f"{rule}:{finding['vehicle_id']}" not in previous]
+
+
+def _notifications(rule: str, opened: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    by_dealer = defaultdict(list)
+    for finding in opened:
+        by_dealer[finding["dealer_id"]].append(finding["vin"])
+    if rule == SOLD_OUT_OF_TRUST:
+        title, severity, what = "Sold Out of Trust", NotificationSeverity.error, "sold without payoff"
+    else:
+        title, severity, what = "Audit Overdue", NotificationSeverity.warning, "overdue for audit"
+    notifications = []
+    for dealer_id, vins in by_dealer.items():
+        sample = ", ".join(vins[:NOTIFICATION_VIN_SAMPLE])
+        more = f" and {len(vins) - NOTIFICATION_VIN_SAMPLE} more" if len(vins) > NOTIFICATION_VIN_SAMPLE else ""
+        notifications.append(Notification(
+            dealer_id=dealer_id,
+            type=rule,
+            title=title,
+            message=f"{len(vins)} financed vehicles {what}: {sample}{more}",
+            severity=severity,
+        ).dict())
+    return notifications
+
+
+async def run_detection(now: Optional[datetime] = None) -> Dict[str, Any]:
+    """Scheduled entry point: evaluate every rule incrementally"""
+    now = now or datetime.utcnow()
+    summary = {}
+    notifications = []
+    for rule in RULES:
+        new, resolved, cutoff, returns_mark = await _detect(rule, now)
+        opened = await _write_findings(rule, new, resolved, now)
+        notifications.extend(_notifications(rule, opened))
+        await _save_high_water_mark(rule, cutoff, returns_mark)
+        summary[rule] = {"opened": len(opened), "resolved": len(resolved)}
+    if notifications:
+        await notifications_collection.insert_many([to_document(notification) for notification in notifications])
+    if any(counts["opened"] or counts["resolved"] for counts in summary.values()):
+        logger.info(f"Out-of-trust detection: {summary}")
+    return summary
+
+
+async def list_findings(
+    dealer_id: Optional[str] = None,
+    rule: Optional[str] = None,
+    status: Optional[str] = "open",
+    limit: int = 100,
+) -> List[Dict[str, Any]]:
+    filter_dict = {}
+    if dealer_id:
+        filter_dict["dealer_id"] = dealer_id
+    if rule:
+        filter_dict["rule"] = rule
+    if status:
+        filter_dict["status"] = status
+    cursor = risk_findings_collection.find(filter_dict, {"_id": 0}, **find_options()).sort("detected_at", -1).limit(limit)
+    return await cursor.to_list(length=limit)
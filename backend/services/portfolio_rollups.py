@@ -0,0 +1,240 @@
+"""
+Portfolio exposure rollups for ANVL analytics
+Aggregates loan balances, on-lot collateral, floor plan aging and cash flows
+per dealer into hourly and daily rollup documents using $merge pipelines
+"""
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from ..models import LoanStatus, TransactionType, VehicleStatus
+from ..database import (
+    loans_collection, vehicles_collection, transactions_collection,
+    portfolio_rollups_collection, find_options, command_options
+)
+
+logger = logging.getLogger(__name__)
+
+GRANULARITIES = {"hourly": timedelta(hours=1), "daily": timedelta(days=1)}
+AGING_BUCKETS = [(0, 30), (30, 60), (60, 90), (90, None)]
+OUTSTANDING_STATUSES = [LoanStatus.active.value, LoanStatus.overdue.value]
+DAY_MS = 24 * 60 * 60 * 1000
+
+
+def period_start(moment: datetime, granularity: str) -> datetime:
+    """Truncate a timestamp to the start of its rollup period"""
+    if granularity == "hourly":
+        return moment.replace(minute=0, second=0, microsecond=0)
+    if granularity == "daily":
+        return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+    raise ValueError(f"Unsupported granularity: {granularity}")
+
+
+def _sum_if(condition: Dict[str, Any], value: Any = 1) -> Dict[str, Any]:
+    return {"$sum": {"$cond": [condition, value, 0]}}
+
+
+def _aging_key(low: int, high: Optional[int]) -> str:
+    return f"{low}_{high}" if high is not None else f"{low}_plus"
+
+
+def _loan_exposure_stages() -> List[Dict[str, Any]]:
+    group = {
+        "_id": "$dealer_id",
+        "loan_count": {"$sum": 1},
+        "principal": {"$sum": "$amount"},
+        "outstanding_balance": _sum_if({"$in": ["$status", OUTSTANDING_STATUSES]}, "$remaining_balance"),
+    }
+    for status in LoanStatus:
+        group[f"loans_{status.value}"] = _sum_if({"$eq": ["$status", status.value]})
+        group[f"balance_{status.value}"] = _sum_if({"$eq": ["$status", status.value]}, "$remaining_balance")
+    return [{"$group": group}]
+
+
+def _collateral_stages(as_of: datetime) -> List[Dict[str, Any]]:
+    age_days = {"$divide": [{"$subtract": [as_of, "$created_at"]}, DAY_MS]}
+    on_floor_plan = {"$ne": [{"$ifNull": ["$loan_id", None]}, None]}
+    group = {
+        "_id": "$dealer_id",
+        "units_on_lot": {"$sum": 1},
+        "inventory_value": {"$sum": "$price"},
+        "floor_plan_units": _sum_if(on_floor_plan),
+        "collateral_value": _sum_if(on_floor_plan, "$price"),
+    }
+    for low, high in AGING_BUCKETS:
+        in_bucket = [on_floor_plan, {"$gte": ["$age_days", low]}]
+        if high is not None:
+            in_bucket.append({"$lt": ["$age_days", high]})
+        key = _aging_key(low, high)
+        group[f"aging_{key}_units"] = _sum_if({"$and": in_bucket})
+        group[f"aging_{key}_value"] = _sum_if({"$and": in_bucket}, "$price")
+    return [
+        {"$match": {"status": VehicleStatus.on_lot.value}},
+        {"$project": {"dealer_id": 1, "price": 1, "loan_id": 1, "age_days": age_days}},
+        {"$group": group},
+    ]
+
+
+def _flow_stages(start: datetime, end: datetime) -> List[Dict[str, Any]]:
+    group = {"_id": "$dealer_id", "transaction_count": {"$sum": 1}}
+    for transaction_type in TransactionType:
+        group[f"flow_{transaction_type.value}"] = _sum_if(
+            {"$eq": ["$type", transaction_type.value]}, "$amount"
+        )
+    return [
+        {"$match": {"timestamp": {"$gte": start, "$lt": end}}},
+        {"$group": group},
+    ]
+
+
+def _merge_stages(granularity: str, start: datetime, computed_at: datetime) -> List[Dict[str, Any]]:
+    return [
+        {"$addFields": {"dealer_id": "$_id"}},
+        {
+            "$addFields": {
+                "_id": {"granularity": granularity, "period_start": start, "dealer_id": "$dealer_id"},
+                "granularity": granularity,
+                "period_start": start,
+                "computed_at": computed_at,
+            }
+        },
+        {
+            "$merge": {
+                "into": portfolio_rollups_collection.name,
+                "on": "_id",
+                "whenMatched": "merge",
+                "whenNotMatched": "insert",
+            }
+        },
+    ]
+
+
+async def refresh_rollups(now: Optional[datetime] = None, granularities: Optional[List[str]] = None):
+    """Write the current period's rollups for each granularity"""
+    now = now or datetime.utcnow()
+    for granularity in granularities or list(GRANULARITIES):
+        start = period_start(now, granularity)
+        end = start + GRANULARITIES[granularity]
+        merge = _merge_stages(granularity, start, now)
+        await asyncio.gather(
+            loans_collection.aggregate(_loan_exposure_stages() + merge).to_list(length=None),
+            vehicles_collection.aggregate(_collateral_stages(now) + merge).to_list(length=None),
+            transactions_collection.aggregate(_flow_stages(start, end) + merge).to_list(length=None),
+        )
+        # $merge leaves rows for dealers that no pipeline produced this run; drop them
+        await portfolio_rollups_collection.delete_many(
+            {"granularity": granularity, "period_start": start, "computed_at": {"$lt": now}}
+        )
+    logger.info(f"Portfolio rollups refreshed at {now.isoformat()}")
+
+
+def _shape(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Turn a flat rollup row into the nested analytics payload"""
+    loans = {
+        status.value: {
+            "count": row.get(f"loans_{status.value}", 0),
+            "balance": row.get(f"balance_{status.value}", 0),
+        }
+        for status in LoanStatus
+    }
+    aging = {
+        _aging_key(low, high): {
+            "units": row.get(f"aging_{_aging_key(low, high)}_units", 0),
+            "value": row.get(f"aging_{_aging_key(low, high)}_value", 0),
+        }
+        for low, high in AGING_BUCKETS
+    }
+    outstanding = row.get("outstanding_balance", 0)
+    collateral = row.get("collateral_value", 0)
+    return {
+        "dealer_id": row.get("dealer_id"),
+        "period_start": row.get("period_start"),
+        "computed_at": row.get("computed_at"),
+        "outstanding_balance": outstanding,
+        "principal": row.get("principal", 0),
+        "loans_by_status": loans,
+        "units_on_lot": row.get("units_on_lot", 0),
+        "inventory_value": row.get("inventory_value", 0),
+        "floor_plan_units": row.get("floor_plan_units", 0),
+        "collateral_value": collateral,
+        "collateral_coverage": round(collateral / outstanding, 4) if outstanding else None,
+        "aging": aging,
+        "flows": {
+            transaction_type.value: row.get(f"flow_{transaction_type.value}", 0)
+            for transaction_type in TransactionType
+        },
+        "transaction_count": row.get("transaction_count", 0),
+    }
+
+
+def _totals(rows: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Book-level totals across dealers for one period"""
+    combined: Dict[str, Any] = {}
+    for row in rows:
+        for key, value in row.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                combined[key] = combined.get(key, 0) + value
+    shaped = _shape(combined)
+    for key in ("dealer_id", "period_start", "computed_at"):
+        shaped.pop(key)
+    shaped["dealers"] = len(rows)
+    return shaped
+
+
+async def read_rollups(
+    granularity: str,
+    start: datetime,
+    end: datetime,
+    dealer_id: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """Read stored rollups for a window, grouped into one entry per period"""
+    if granularity not in GRANULARITIES:
+        raise ValueError(f"Unsupported granularity: {granularity}")
+    filter_dict = {"granularity": granularity, "period_start": {"$gte": start, "$lt": end}}
+    if dealer_id:
+        filter_dict["dealer_id"] = dealer_id
+
+    periods: Dict[datetime, List[Dict[str, Any]]] = {}
+    cursor = portfolio_rollups_collection.find(filter_dict, {"_id": 0}, **find_options()).sort("period_start", 1)
+    async for row in cursor:
+        periods.setdefault(row["period_start"], []).append(row)
+
+    return [
+        {
+            "period_start": period,
+            "totals": _totals(rows),
+            "dealers": [_shape(row) for row in rows],
+        }
+        for period, rows in periods.items()
+    ]
+
+
+async def compute_window(
+    start: datetime,
+    end: datetime,
+    dealer_id: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Compute current exposure plus cash flows for an arbitrary window without storing it"""
+    now = datetime.utcnow()
+    scope = [{"$match": {"dealer_id": dealer_id}}] if dealer_id else []
+    loans, vehicles, flows = await asyncio.gather(
+        loans_collection.aggregate(scope + _loan_exposure_stages(), **command_options()).to_list(length=None),
+        vehicles_collection.aggregate(scope + _collateral_stages(now), **command_options()).to_list(length=None),
+        transactions_collection.aggregate(scope + _flow_stages(start, end), **command_options()).to_list(length=None),
+    )
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    for result in (loans, vehicles, flows):
+        for row in result:
+            dealer = row.pop("_id")
+            rows.setdefault(dealer, {"dealer_id": dealer, "computed_at": now}).update(row)
+
+    dealers = [_shape(row) for row in rows.values()]
+    return {
+        "start": start,
+        "end": end,
+        "computed_at": now,
+        "totals": _totals(list(rows.values())),
+        "dealers": dealers,
+    }
@@ -0,0 +1,338 @@
+"""
+ANVLPresale event indexer
+Pulls TokensPurchased, TokensClaimed, PresaleCapUpdated and ClaimEnabledUpdated
+logs from an Ethereum JSON-RPC endpoint in block ranges, only past a
+confirmation depth, and upserts them into Mongo with a resumable checkpoint.
+
+Run standalone against a local node (e.g. anvil) with:
+    PRESALE_RPC_URL=http://127.0.0.1:8545 PRESALE_CONTRACT_ADDRESS=0x... \
+        python -m backend.services.presale_indexer --once
+"""
+import argparse
+import asyncio
+import logging
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import Any, Dict, List, Optional
+
+from bson.decimal128 import Decimal128
+from pymongo import UpdateOne
+
+from ..database import presale_events_collection, indexer_checkpoints_collection
+from .eth_rpc import JsonRpcClient, JsonRpcError
+
+logger = logging.getLogger(__name__)
+
+# keccak256 of the event signatures in contracts/ANVLPresale.sol
+TOKENS_PURCHASED_TOPIC = "0x8fafebcaf9d154343dad25669bfa277f4fbacd7ac6b0c4fed522580e040a0f33"
+TOKENS_CLAIMED_TOPIC = "0x896e034966eaaf1adc54acc0f257056febbd300c9e47182cf761982cf1f5e430"
+PRESALE_CAP_UPDATED_TOPIC = "0x3b3561ea9e157f6e050c769fab646e68effe71df818c50746da9b71cead85aac"
+CLAIM_ENABLED_UPDATED_TOPIC = "0x0cb4112864bc0c6ec295623acc6a9ba59fea56470dea9a9c148147e0fcacb7e5"
+
+EVENT_NAMES = {
+    TOKENS_PURCHASED_TOPIC: "TokensPurchased",
+    TOKENS_CLAIMED_TOPIC: "TokensClaimed",
+    PRESALE_CAP_UPDATED_TOPIC: "PresaleCapUpdated",
+    CLAIM_ENABLED_UPDATED_TOPIC: "ClaimEnabledUpdated",
+}
+
+# Constants mirrored from ANVLPresale.sol
+USDC_DECIMALS = 6
+ANVL_DECIMALS = 18
+ANVL_PRICE_CENTS = 20
+MIN_PURCHASE = 1000 * 10**USDC_DECIMALS
+MAX_PURCHASE = 100000 * 10**USDC_DECIMALS
+DEFAULT_PRESALE_CAP = 10_000_000 * 10**USDC_DECIMALS
+
+DEFAULT_CONFIRMATIONS = 12
+DEFAULT_BLOCK_RANGE = 5000
+MIN_BLOCK_RANGE = 10
+
+
+def _word(data: str, index: int) -> int:
+    start = 2 + index * 64
+    return int(data[start:start + 64], 16)
+
+
+def _topic_address(topic: str) -> str:
+    return "0x" + topic[-40:].lower()
+
+
+def to_decimal128(value: int) -> Decimal128:
+    return Decimal128(Decimal(value))
+
+
+def from_decimal128(value: Any) -> int:
+    if isinstance(value, Decimal128):
+        return int(value.to_decimal())
+    return int(value or 0)
+
+
+def format_units(value: int, decimals: int) -> str:
+    """Render an integer token amount with its decimals, like ethers.formatUnits"""
+    return f"{Decimal(value).scaleb(-decimals):f}"
+
+
+def anvl_for_usdc(usdc_amount: int) -> int:
+    """ANVL owed for a USDC amount, using the contract's integer formula"""
+    return (usdc_amount * 10**12 * 100) // ANVL_PRICE_CENTS
+
+
+def decode_log(log: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Decode one presale log into an event document"""
+    topics = log.get("topics") or []
+    event = EVENT_NAMES.get(topics[0].lower()) if topics else None
+    if event is None:
+        return None
+
+    data = log.get("data", "0x")
+    document = {
+        "_id": f"{log['transactionHash']}:{int(log['logIndex'], 16)}",
+        "event": event,
+        "contract": log["address"].lower(),
+        "block_number": int(log["blockNumber"], 16),
+        "block_hash": log["blockHash"],
+        "tx_hash": log["transactionHash"],
+        "log_index": int(log["logIndex"], 16),
+        "indexed_at": datetime.utcnow(),
+    }
+    if event == "TokensPurchased":
+        document["buyer"] = _topic_address(topics[1])
+        document["usdc_amount"] = to_decimal128(_word(data, 0))
+        document["anvl_amount"] = to_decimal128(_word(data, 1))
+    elif event == "TokensClaimed":
+        document["buyer"] = _topic_address(topics[1])
+        document["anvl_amount"] = to_decimal128(_word(data, 0))
+    elif event == "PresaleCapUpdated":
+        document["new_cap"] = to_decimal128(_word(data, 0))
+    elif event == "ClaimEnabledUpdated":
+        document["enabled"] = bool(_word(data, 0))
+    return document
+
+
+class PresaleIndexer:
+    """Indexes presale logs up to `confirmations` blocks behind the chain head"""
+
+    def __init__(
+        self,
+        rpc: JsonRpcClient,
+        contract_address: str,
+        start_block: int = 0,
+        confirmations: int = DEFAULT_CONFIRMATIONS,
+        block_range: int = DEFAULT_BLOCK_RANGE,
+    ):
+        self.rpc = rpc
+        self.contract_address = contract_address.lower()
+        self.start_block = start_block
+        self.confirmations = confirmations
+        self.block_range = block_range
+        self.checkpoint_id = f"presale:{self.contract_address}"
+
+    async def _load_checkpoint(self) -> Dict[str, Any]:
+        checkpoint = await indexer_checkpoints_collection.find_one({"_id": self.checkpoint_id})
+        return checkpoint or {"_id": self.checkpoint_id, "last_block": self.start_block - 1, "last_block_hash": None}
+
+    async def _save_checkpoint(self, last_block: int, last_block_hash: Optional[str]):
+        await indexer_checkpoints_collection.update_one(
+            {"_id": self.checkpoint_id},
+            {"$set": {"last_block": last_block, "last_block_hash": last_block_hash, "updated_at": datetime.utcnow()}},
+            upsert=True
+        )
+
+    async def _handle_reorg(self, checkpoint: Dict[str, Any]) -> int:
+        """Rewind past any block whose hash no longer matches the canonical chain"""
+        last_block = checkpoint["last_block"]
+        expected_hash = checkpoint.get("last_block_hash")
+        rewind = max(self.confirmations, 1)
+        while expected_hash and last_block >= self.start_block:
+            if await self.rpc.block_hash(last_block) == expected_hash:
+                return last_block
+            rewound_to = max(self.start_block - 1, last_block - rewind)
+            logger.warning(f"Reorg detected at block {last_block}, rewinding presale index to {rewound_to}")
+            await presale_events_collection.delete_many({
+                "contract": self.contract_address,
+                "block_number": {"$gt": rewound_to}
+            })
+            last_block = rewound_to
+            expected_hash = await self.rpc.block_hash(last_block) if last_block >= self.start_block else None
+            await self._save_checkpoint(last_block, expected_hash)
+            rewind *= 2
+        return last_block
+
+    async def _fetch_logs(self, from_block: int, to_block: int) -> List[Dict[str, Any]]:
+        """Fetch logs for a range, splitting it when the node rejects it as too large"""
+        try:
+            return await self.rpc.get_logs(
+                self.contract_address, from_block, to_block, [list(EVENT_NAMES)]
+            )
+        except JsonRpcError as e:
+            if to_block - from_block + 1 <= MIN_BLOCK_RANGE:
+                raise
+            middle = (from_block + to_block) // 2
+            logger.info(f"Splitting log range {from_block}-{to_block}: {e}")
+            return (
+                await self._fetch_logs(from_block, middle)
+                + await self._fetch_logs(middle + 1, to_block)
+            )
+
+    async def run_once(self) -> Dict[str, Any]:
+        """Index every confirmed block since the checkpoint"""
+        checkpoint = await self._load_checkpoint()
+        last_block = await self._handle_reorg(checkpoint)
+        head = await self.rpc.block_number()
+        safe_block = head - self.confirmations
+
+        indexed = 0
+        next_block = last_block + 1
+        while next_block <= safe_block:
+            to_block = min(next_block + self.block_range - 1, safe_block)
+            logs = await self._fetch_logs(next_block, to_block)
+
+            operations = []
+            for log in logs:
+                if log.get("removed"):
+                    continue
+                document = decode_log(log)
+                if document:
+                    operations.append(UpdateOne({"_id": document["_id"]}, {"$set": document}, upsert=True))
+            if operations:
+                await presale_events_collection.bulk_write(operations, ordered=False)
+                indexed += len(operations)
+
+            await self._save_checkpoint(to_block, await self.rpc.block_hash(to_block))
+            next_block = to_block + 1
+
+        if indexed:
+            logger.info(f"Indexed {indexed} presale events up to block {safe_block}")
+        return {"head": head, "indexed_through": max(last_block, next_block - 1), "events": indexed}
+
+
+def indexer_from_env() -> Optional[PresaleIndexer]:
+    """Build the indexer from PRESALE_* environment variables, if configured"""
+    rpc_url = os.environ.get("PRESALE_RPC_URL")
+    contract_address = os.environ.get("PRESALE_CONTRACT_ADDRESS")
+    if not rpc_url or not contract_address:
+        return None
+    return PresaleIndexer(
+        JsonRpcClient(rpc_url),
+        contract_address,
+        start_block=int(os.environ.get("PRESALE_START_BLOCK", "0")),
+        confirmations=int(os.environ.get("PRESALE_CONFIRMATIONS", str(DEFAULT_CONFIRMATIONS))),
+        block_range=int(os.environ.get("PRESALE_BLOCK_RANGE", str(DEFAULT_BLOCK_RANGE))),
+    )
+
+
+async def presale_summary(contract_address: Optional[str] = None) -> Dict[str, Any]:
+    """Presale totals computed from indexed events in one aggregation"""
+    match = {"contract": contract_address.lower()} if contract_address else {}
+    pipeline = [
+        {"$match": match},
+        {
+            "$facet": {
+                "totals": [
+                    {"$group": {
+                        "_id": "$event",
+                        "count": {"$sum": 1},
+                        "usdc": {"$sum": "$usdc_amount"},
+                        "anvl": {"$sum": "$anvl_amount"},
+                    }}
+                ],
+                "buyers": [
+                    {"$match": {"event": "TokensPurchased"}},
+                    {"$group": {"_id": "$buyer"}},
+                    {"$count": "count"},
+                ],
+                "cap": [
+                    {"$match": {"event": "PresaleCapUpdated"}},
+                    {"$sort": {"block_number": -1, "log_index": -1}},
+                    {"$limit": 1},
+                ],
+                "claim": [
+                    {"$match": {"event": "ClaimEnabledUpdated"}},
+                    {"$sort": {"block_number": -1, "log_index": -1}},
+                    {"$limit": 1},
+                ],
+            }
+        },
+    ]
+    results = await presale_events_collection.aggregate(pipeline).to_list(length=1)
+    result = results[0] if results else {}
+    totals = {row["_id"]: row for row in result.get("totals", [])}
+    purchased = totals.get("TokensPurchased", {})
+    claimed = totals.get("TokensClaimed", {})
+    cap = result.get("cap") or []
+    claim = result.get("claim") or []
+    buyers = result.get("buyers") or []
+
+    checkpoint_filter = {"_id": f"presale:{contract_address.lower()}"} if contract_address else {"_id": {"$regex": "^presale:"}}
+    checkpoint = await indexer_checkpoints_collection.find_one(checkpoint_filter)
+
+    return {
+        "total_raised": format_units(from_decimal128(purchased.get("usdc")), USDC_DECIMALS),
+        "total_sold": format_units(from_decimal128(purchased.get("anvl")), ANVL_DECIMALS),
+        "total_claimed": format_units(from_decimal128(claimed.get("anvl")), ANVL_DECIMALS),
+        "presale_cap": format_units(
+            from_decimal128(cap[0]["new_cap"]) if cap else DEFAULT_PRESALE_CAP, USDC_DECIMALS
+        ),
+        "claim_enabled": bool(claim[0]["enabled"]) if claim else False,
+        "min_purchase": format_units(MIN_PURCHASE, USDC_DECIMALS),
+        "max_purchase": format_units(MAX_PURCHASE, USDC_DECIMALS),
+        "price_per_token": ANVL_PRICE_CENTS / 100,
+        "purchases": purchased.get("count", 0),
+        "claims": claimed.get("count", 0),
+        "buyers": buyers[0]["count"] if buyers else 0,
+        "indexed_block": checkpoint["last_block"] if checkpoint else None,
+    }
+
+
+async def wallet_purchases(wallet_address: str, limit: int = 100) -> Dict[str, Any]:
+    """Per-wallet purchase and claim state from indexed events"""
+    buyer = wallet_address.lower()
+    events = await presale_events_collection.find(
+        {"buyer": buyer}
+    ).sort([("block_number", 1), ("log_index", 1)]).to_list(length=None)
+
+    usdc_spent = sum(from_decimal128(e.get("usdc_amount")) for e in events if e["event"] == "TokensPurchased")
+    claims = [e for e in events if e["event"] == "TokensClaimed"]
+    purchases = [
+        {
+            "tx_hash": e["tx_hash"],
+            "block_number": e["block_number"],
+            "usdc_amount": format_units(from_decimal128(e["usdc_amount"]), USDC_DECIMALS),
+            "anvl_amount": format_units(from_decimal128(e["anvl_amount"]), ANVL_DECIMALS),
+        }
+        for e in events if e["event"] == "TokensPurchased"
+    ]
+
+    return {
+        "wallet_address": buyer,
+        "usdc_spent": format_units(usdc_spent, USDC_DECIMALS),
+        "anvl_claimable": format_units(anvl_for_usdc(usdc_spent), ANVL_DECIMALS),
+        "claimed": bool(claims),
+        "claimed_tx_hash": claims[-1]["tx_hash"] if claims else None,
+        "purchases": purchases[-limit:],
+    }
+
+
+async def _main():
+    parser = argparse.ArgumentParser(description="Index ANVLPresale events into MongoDB")
+    parser.add_argument("--once", action="store_true", help="Index confirmed blocks once and exit")
+    parser.add_argument("--interval", type=float, default=float(os.environ.get("PRESALE_INDEX_INTERVAL_SECONDS", "15")))
+    args = parser.parse_args()
+
+    indexer = indexer_from_env()
+    if indexer is None:
+        raise SystemExit("PRESALE_RPC_URL and PRESALE_CONTRACT_ADDRESS must be set")
+
+    while True:
+        result = await indexer.run_once()
+        logger.info(f"Presale indexer at block {result['indexed_through']} (head {result['head']})")
+        if args.once:
+            break
+        await asyncio.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    asyncio.run(_main())
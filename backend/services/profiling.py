@@ -0,0 +1,278 @@
+"""
+On-demand profiling for the ANVL API
+A sampling profiler runs in a background thread and records stacks every few
+milliseconds without touching the event loop, so it can be pointed at a live
+worker. Process profiles sample every thread. Request profiles, enabled per
+request by an admin X-Profile header, follow the request's task instead: while
+it runs they take the loop thread's stack, and while it is suspended they take
+the chain of coroutines it is awaiting in, so time spent waiting on Mongo is
+attributed to the handler line that issued the query. Both produce collapsed
+stacks ("frame;frame;frame count") that flamegraph.pl and speedscope read.
+
+Memory growth is covered by tracemalloc snapshots: take a baseline, let traffic
+run, then diff against it.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+from starlette.datastructures import Headers
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from .admin_auth import ADMIN_TOKEN_HEADER, is_admin
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = "x-profile"
+SAMPLE_INTERVAL_MS = float(os.environ.get("PROFILE_INTERVAL_MS", "5"))
+MAX_PROFILE_SECONDS = 60
+TOP_FUNCTIONS = 25
+WAITING = "(waiting)"
+
+TRACEMALLOC_FRAMES = int(os.environ.get("TRACEMALLOC_FRAMES", "10"))
+MEMORY_GROUPINGS = ("lineno", "filename", "traceback")
+_memory_baseline: Optional[tracemalloc.Snapshot] = None
+
+
+def _label(frame) -> str:
+    return f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}"
+
+
+def _frames(frame) -> list:
+    """Frames from the outermost caller down to `frame`"""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+    return frames
+
+
+def _await_chain(task: asyncio.Task) -> list:
+    """Frames of the coroutines a task is suspended in, outermost first"""
+    frames = []
+    coro = task.get_coro()
+    while coro is not None:
+        frame = getattr(coro, "cr_frame", None) or getattr(coro, "gi_frame", None)
+        if frame is None:
+            break
+        frames.append(frame)
+        coro = getattr(coro, "cr_await", None) or getattr(coro, "gi_yieldfrom", None)
+    return frames
+
+
+class SamplingProfiler:
+    """Counts sampled stacks from a background thread until stopped"""
+
+    def __init__(self, interval_ms: float = SAMPLE_INTERVAL_MS, task: Optional[asyncio.Task] = None):
+        self.interval = max(0.001, interval_ms / 1000)
+        self.task = task
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self._thread_id = threading.get_ident()
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopping.wait(self.interval):
+            try:
+                if self.task is None:
+                    self._sample_threads(own_id)
+                elif not self.task.done():
+                    self._sample_task()
+            except Exception as e:
+                # Frames change under us while the loop runs; drop the sample
+                logger.debug(f"Dropped profiler sample: {e}")
+
+    def _sample_threads(self, own_id: int):
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident == own_id:
+                continue
+            stack = (names.get(ident, str(ident)),) + tuple(_label(f) for f in _frames(frame))
+            self.counts[stack] += 1
+        self.samples += 1
+
+    def _sample_task(self):
+        chain = _await_chain(self.task)
+        if not chain:
+            return
+        coro = self.task.get_coro()
+        if getattr(coro, "cr_running", False):
+            # Running on the loop thread: its real stack from the task's first frame down
+            frames = _frames(sys._current_frames().get(self._thread_id))
+            if chain[0] in frames:
+                stack = tuple(_label(f) for f in frames[frames.index(chain[0]):])
+            else:
+                stack = tuple(_label(f) for f in chain)
+        else:
+            stack = tuple(_label(f) for f in chain) + (WAITING,)
+        self.counts[stack] += 1
+        self.samples += 1
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{';'.join(stack)} {count}" for stack, count in self.counts.most_common()) + "\n"
+
+    def top_functions(self, limit: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+        """Functions by samples spent in them (self) and under them (total)"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.counts.items():
+            frames = [frame for frame in stack if frame != WAITING]
+            if frames:
+                own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        return [
+            {"function": function, "self": own[function], "total": count}
+            for function, count in total.most_common(limit)
+        ]
+
+
+async def profile_process(seconds: float, interval_ms: float = SAMPLE_INTERVAL_MS) -> SamplingProfiler:
+    """Sample every thread of this worker for `seconds` while it keeps serving"""
+    profiler = SamplingProfiler(interval_ms)
+    profiler.start()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        await asyncio.to_thread(profiler.stop)
+    return profiler
+
+
+class ProfilingMiddleware:
+    """Answers admin requests carrying X-Profile with a profile of the request instead of its body"""
+
+    def __init__(self, app: ASGIApp, interval_ms: float = SAMPLE_INTERVAL_MS):
+        self.app = app
+        self.interval_ms = interval_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = Headers(scope=scope)
+        if PROFILE_HEADER not in headers or not is_admin(headers.get(ADMIN_TOKEN_HEADER)):
+            await self.app(scope, receive, send)
+            return
+
+        response = {"status": None, "bytes": 0}
+
+        async def capture(message: Message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+
+        profiler = SamplingProfiler(self.interval_ms, task=asyncio.current_task())
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, capture)
+        finally:
+            profiler.stop()
+        duration_ms = (time.perf_counter() - started) * 1000
+        logger.info(f"Profiled {scope['method']} {scope['path']}: {duration_ms:.1f}ms, {profiler.samples} samples")
+
+        report = JSONResponse({
+            "success": True,
+            "data": {
+                "method": scope["method"],
+                "path": scope["path"],
+                "status": response["status"],
+                "response_bytes": response["bytes"],
+                "duration_ms": round(duration_ms, 2),
+                "interval_ms": self.interval_ms,
+                "samples": profiler.samples,
+                "top": profiler.top_functions(),
+                "collapsed": profiler.collapsed(),
+            }
+        })
+        await report(scope, receive, send)
+
+
+def _memory_filters(snapshot: tracemalloc.Snapshot) -> tracemalloc.Snapshot:
+    return snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+
+
+def memory_tracing() -> Dict[str, Any]:
+    current, peak = tracemalloc.get_traced_memory()
+    return {
+        "tracing": tracemalloc.is_tracing(),
+        "frames": tracemalloc.get_traceback_limit(),
+        "traced_bytes": current,
+        "peak_bytes": peak,
+        "baseline_taken": _memory_baseline is not None,
+    }
+
+
+def _location(traceback: tracemalloc.Traceback, group_by: str):
+    if group_by == "traceback":
+        return traceback.format()
+    if group_by == "filename":
+        return traceback[0].filename
+    return f"{traceback[0].filename}:{traceback[0].lineno}"
+
+
+async def take_memory_baseline() -> Dict[str, Any]:
+    """Start tracemalloc if needed and keep a snapshot to diff against"""
+    global _memory_baseline
+    if not tracemalloc.is_tracing():
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+        logger.info(f"Started tracemalloc with {TRACEMALLOC_FRAMES} frames")
+    snapshot = await asyncio.to_thread(tracemalloc.take_snapshot)
+    _memory_baseline = _memory_filters(snapshot)
+    return memory_tracing()
+
+
+async def memory_diff(group_by: str = "lineno", limit: int = TOP_FUNCTIONS) -> List[Dict[str, Any]]:
+    """Allocation sites that grew the most since the baseline"""
+    if group_by not in MEMORY_GROUPINGS:
+        raise ValueError(f"group_by must be one of {', '.join(MEMORY_GROUPINGS)}")
+    if _memory_baseline is None or not tracemalloc.is_tracing():
+        raise ValueError("No memory baseline; take a snapshot first")
+    baseline = _memory_baseline
+
+    def compare():
+        current = _memory_filters(tracemalloc.take_snapshot())
+        return current.compare_to(baseline, group_by)[:limit]
+
+    stats = await asyncio.to_thread(compare)
+    return [
+        {
+            "location": _location(stat.traceback, group_by),
+            "size_diff": stat.size_diff,
+            "size": stat.size,
+            "count_diff": stat.count_diff,
+            "count": stat.count,
+        }
+        for stat in stats
+    ]
+
+
+def stop_memory_tracing() -> Dict[str, Any]:
+    global _memory_baseline
+    _memory_baseline = None
+    tracemalloc.stop()
+    return memory_tracing()
@@ -0,0 +1,128 @@
+"""
+Query deadlines and cancellation for API requests
+Every HTTP request gets a query budget that the database helpers pass to Mongo
+as maxTimeMS, and a comment tag on each operation. Routes can tighten or relax
+the budget with the `query_budget` dependency. If the client disconnects before
+a GET or HEAD response finishes, the request task is cancelled and its tagged
+server-side operations are killed so they stop holding pool connections. Writes
+always run to completion, since stopping one midway could leave it half applied.
+"""
+import asyncio
+import logging
+import os
+import uuid
+
+from fastapi import Depends, HTTPException
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from ..database import QueryBudget, query_budget_var
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUERY_BUDGET_MS = int(os.environ.get("QUERY_BUDGET_MS", "5000"))
+DASHBOARD_QUERY_BUDGET_MS = int(os.environ.get("DASHBOARD_QUERY_BUDGET_MS", "3000"))
+REPORT_QUERY_BUDGET_MS = int(os.environ.get("REPORT_QUERY_BUDGET_MS", "15000"))
+IMPORT_QUERY_BUDGET_MS = int(os.environ.get("IMPORT_QUERY_BUDGET_MS", "120000"))
+RETRY_AFTER_SECONDS = 5
+CANCELLABLE_METHODS = {"GET", "HEAD"}
+
+
+def query_budget(budget_ms: int):
+    """Route dependency replacing the request's query budget"""
+    async def apply_budget():
+        budget = query_budget_var.get()
+        if budget is None:
+            query_budget_var.set(QueryBudget(budget_ms))
+        else:
+            # Shared with the middleware, which reads the tag on disconnect
+            budget.deadline = QueryBudget(budget_ms).deadline
+    return Depends(apply_budget)
+
+
+def budget_exceeded() -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Query took too long; try again shortly or narrow the request",
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+    )
+
+
+async def kill_tagged_operations(client, tag: str) -> int:
+    """Kill this connection's in-progress operations that carry the request tag"""
+    operations = await client.admin.aggregate([
+        {"$currentOp": {"allUsers": False}},
+        {"$match": {"$or": [
+            {"command.comment": tag},
+            {"cursor.originatingCommand.comment": tag}
+        ]}},
+        {"$project": {"opid": 1}}
+    ]).to_list(length=None)
+    for operation in operations:
+        await client.admin.command("killOp", op=operation["opid"])
+    return len(operations)
+
+
+class QueryCancellationMiddleware:
+    def __init__(self, app: ASGIApp, client, default_budget_ms: int = DEFAULT_QUERY_BUDGET_MS):
+        self.app = app
+        self.client = client
+        self.default_budget_ms = default_budget_ms
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        tag = f"req:{uuid.uuid4().hex}"
+        token = query_budget_var.set(QueryBudget(self.default_budget_ms, tag))
+        try:
+            if scope["method"] in CANCELLABLE_METHODS:
+                await self._run_cancellable(scope, receive, send, tag)
+            else:
+                await self.app(scope, receive, send)
+        finally:
+            query_budget_var.reset(token)
+
+    async def _run_cancellable(self, scope: Scope, receive: Receive, send: Send, tag: str):
+        # Bounded, so a request body is only read off the socket as fast as the app consumes it
+        messages: "asyncio.Queue[Message]" = asyncio.Queue(maxsize=1)
+        state = {"complete": False, "disconnected": False}
+
+        async def relay_send(message: Message):
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                state["complete"] = True
+            await send(message)
+
+        # The task copies the current context, so it sees this request's budget
+        app_task = asyncio.ensure_future(self.app(scope, messages.get, relay_send))
+
+        async def watch_client():
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    # The app is about to be cancelled unless it has finished; it may never read this
+                    if not messages.full():
+                        messages.put_nowait(message)
+                    break
+                await messages.put(message)
+            if not state["complete"] and not app_task.done():
+                state["disconnected"] = True
+                app_task.cancel()
+                try:
+                    killed = await kill_tagged_operations(self.client, tag)
+                    logger.info(f"Client disconnected; cancelled {scope.get('path')} and killed {killed} operations")
+                except Exception as e:
+                    logger.warning(f"Could not kill operations for {tag}: {e}")
+
+        watcher = asyncio.ensure_future(watch_client())
+        try:
+            await app_task
+        except asyncio.CancelledError:
+            if not state["disconnected"]:
+                app_task.cancel()
+                raise
+            # Let the watcher finish killing the request's operations
+            await watcher
+        finally:
+            if not watcher.done():
+                watcher.cancel()
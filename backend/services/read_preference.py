@@ -0,0 +1,66 @@
+"""
+Read-replica routing for API routers
+Each router declares where its GET reads may go with the `route_reads`
+dependency; analytics and list endpoints read from secondaries so report
+traffic stays off the primary. Writes, find_one_and_* calls and every request
+that is not a GET or HEAD stay on the primary, as do routes marked with
+`primary_reads` because they must see the caller's own recent writes.
+
+READ_PREFERENCE_<ROUTER> overrides a router's mode (primary, primaryPreferred,
+secondaryPreferred, secondary or nearest), and READ_MAX_STALENESS_SECONDS bounds
+how far behind a secondary may be before it stops serving reads (at least 90,
+the smallest value the server accepts).
+"""
+import logging
+import os
+from typing import Optional
+
+from fastapi import Depends, Request
+from pymongo.read_preferences import (
+    Nearest, PrimaryPreferred, Secondary, SecondaryPreferred, _ServerMode
+)
+
+from ..database import read_preference_var
+
+logger = logging.getLogger(__name__)
+
+MIN_MAX_STALENESS_SECONDS = 90
+MAX_STALENESS_SECONDS = max(
+    MIN_MAX_STALENESS_SECONDS, int(os.environ.get("READ_MAX_STALENESS_SECONDS", "90"))
+)
+
+READ_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondaryPreferred": SecondaryPreferred,
+    "secondary": Secondary,
+    "nearest": Nearest,
+}
+ROUTED_METHODS = ("GET", "HEAD")
+
+
+def read_preference_for(router_name: str, default: str = "primary") -> Optional[_ServerMode]:
+    """The router's configured read preference, or None for the primary"""
+    mode = os.environ.get(f"READ_PREFERENCE_{router_name.upper()}", default)
+    if mode == "primary":
+        return None
+    if mode not in READ_MODES:
+        logger.warning(f"Unknown read preference {mode!r} for {router_name}; using primary")
+        return None
+    return READ_MODES[mode](max_staleness=MAX_STALENESS_SECONDS)
+
+
+def route_reads(router_name: str, default: str = "secondaryPreferred"):
+    """Router dependency sending the router's GET reads to its configured members"""
+    preference = read_preference_for(router_name, default)
+
+    async def apply_read_preference(request: Request):
+        if preference is not None and request.method in ROUTED_METHODS:
+            read_preference_var.set(preference)
+    return Depends(apply_read_preference)
+
+
+def primary_reads():
+    """Route dependency keeping a read-after-write GET on the primary"""
+    async def apply_primary():
+        read_preference_var.set(None)
+    return Depends(apply_primary)
@@ -0,0 +1,221 @@
+"""
+Retention and archival for ANVL history collections
+Read notifications expire through a TTL index. Transactions and audits older
+than the archive horizon are moved into zstd-compressed Parquet files on local
+disk, partitioned by dealer and month, and historical reads fall back to them.
+"""
+import asyncio
+import hashlib
+import logging
+import os
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from pymongo.errors import OperationFailure
+
+from ..database import (
+    db, audits_collection, transactions_collection, notifications_collection,
+    from_document, find_many_and_convert
+)
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.dirname(__file__)), "archive"))
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+NOTIFICATION_READ_TTL_DAYS = int(os.environ.get("NOTIFICATION_READ_TTL_DAYS", "30"))
+ARCHIVE_BATCH_SIZE = 10000
+INDEX_OPTIONS_CONFLICT = 85
+
+if pa is not None:
+    PARTITIONING = ds.partitioning(
+        pa.schema([("dealer_id", pa.string()), ("month", pa.string())]), flavor="hive"
+    )
+    ARCHIVE_SCHEMAS = {
+        "transactions": pa.schema([
+            ("id", pa.string()),
+            ("type", pa.string()),
+            ("amount", pa.float64()),
+            ("currency", pa.string()),
+            ("loan_id", pa.string()),
+            ("method", pa.string()),
+            ("tx_hash", pa.string()),
+            ("status", pa.string()),
+            ("reward_epoch", pa.int64()),
+            ("ach_trace", pa.string()),
+            ("return_reason", pa.string()),
+            ("timestamp", pa.timestamp("ms")),
+            ("created_at", pa.timestamp("ms")),
+        ]),
+        "audits": pa.schema([
+            ("id", pa.string()),
+            ("vehicle_id", pa.string()),
+            ("vin", pa.string()),
+            ("location", pa.struct([("lat", pa.float64()), ("lng", pa.float64())])),
+            ("notes", pa.string()),
+            ("status", pa.string()),
+            ("auditor_wallet", pa.string()),
+            ("nfc_tag_scanned", pa.bool_()),
+            ("timestamp", pa.timestamp("ms")),
+            ("created_at", pa.timestamp("ms")),
+            ("updated_at", pa.timestamp("ms")),
+        ]),
+    }
+
+# Rows that must stay live regardless of age, e.g. rewards not yet settled on-chain
+ARCHIVE_EXCLUSIONS = {
+    "transactions": {"status": {"$ne": "pending"}},
+    "audits": {},
+}
+
+
+def archive_horizon(now: Optional[datetime] = None) -> datetime:
+    return (now or datetime.utcnow()) - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def _archive_path(name: str) -> str:
+    return os.path.join(ARCHIVE_DIR, name)
+
+
+async def ensure_notification_ttl():
+    """TTL on read_at so read notifications expire; the expiry follows config changes"""
+    expire_after = NOTIFICATION_READ_TTL_DAYS * 24 * 60 * 60
+    try:
+        await notifications_collection.create_index("read_at", expireAfterSeconds=expire_after)
+    except OperationFailure as e:
+        if e.code != INDEX_OPTIONS_CONFLICT:
+            raise
+        await db.command({
+            "collMod": notifications_collection.name,
+            "index": {"keyPattern": {"read_at": 1}, "expireAfterSeconds": expire_after}
+        })
+
+
+async def stamp_read_notifications() -> int:
+    """Give read notifications from before read_at existed an expiry clock"""
+    result = await notifications_collection.update_many(
+        {"read": True, "read_at": {"$exists": False}},
+        {"$set": {"read_at": datetime.utcnow()}}
+    )
+    return result.modified_count
+
+
+def _write_batch(name: str, docs: List[Dict[str, Any]]):
+    schema = ARCHIVE_SCHEMAS[name]
+    rows = [{field: doc.get(field) for field in schema.names} for doc in docs]
+    table = pa.Table.from_pylist(rows, schema=schema)
+    table = table.append_column("dealer_id", pa.array([doc.get("dealer_id") or "unknown" for doc in docs]))
+    table = table.append_column("month", pa.array([doc["timestamp"].strftime("%Y-%m") for doc in docs]))
+    # Name files after their contents so a retried batch overwrites rather than duplicates
+    digest = hashlib.sha1("".join(sorted(doc["id"] for doc in docs)).encode("utf-8")).hexdigest()[:16]
+    pq.write_to_dataset(
+        table,
+        root_path=_archive_path(name),
+        partitioning=PARTITIONING,
+        basename_template=f"part-{digest}-{{i}}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        compression="zstd",
+    )
+
+
+async def archive_collection(collection, cutoff: Optional[datetime] = None, batch_size: int = ARCHIVE_BATCH_SIZE) -> int:
+    """Move documents older than the cutoff into Parquet, then delete them from Mongo"""
+    if pa is None:
+        logger.warning("pyarrow is not installed; skipping archival")
+        return 0
+    name = collection.name
+    cutoff = cutoff or archive_horizon()
+    filter_dict = {"timestamp": {"$lt": cutoff}, **ARCHIVE_EXCLUSIONS[name]}
+    archived = 0
+    while True:
+        docs = await collection.find(filter_dict).sort("timestamp", 1).limit(batch_size).to_list(length=batch_size)
+        if not docs:
+            break
+        primary_keys = [doc["_id"] for doc in docs]
+        await asyncio.to_thread(_write_batch, name, [from_document(doc) for doc in docs])
+        await collection.delete_many({"_id": {"$in": primary_keys}})
+        archived += len(docs)
+        if len(docs) < batch_size:
+            break
+    if archived:
+        logger.info(f"Archived {archived} {name} older than {cutoff.isoformat()}")
+    return archived
+
+
+async def run_retention():
+    """Scheduled entry point for notification expiry and history archival"""
+    await stamp_read_notifications()
+    await archive_collection(transactions_collection)
+    await archive_collection(audits_collection)
+
+
+def _read_archive(
+    name: str,
+    filters: Dict[str, Any],
+    since: Optional[datetime],
+    limit: Optional[int],
+) -> List[Dict[str, Any]]:
+    path = _archive_path(name)
+    if not os.path.isdir(path):
+        return []
+    schema = ARCHIVE_SCHEMAS[name]
+    full_schema = pa.schema(list(schema) + [("dealer_id", pa.string()), ("month", pa.string())])
+    dataset = ds.dataset(path, format="parquet", partitioning=PARTITIONING, schema=full_schema)
+
+    expression = None
+    if since is not None:
+        expression = (ds.field("month") >= since.strftime("%Y-%m")) & (ds.field("timestamp") >= pa.scalar(since, pa.timestamp("ms")))
+    for field, value in filters.items():
+        if field not in full_schema.names:
+            continue
+        condition = ds.field(field) == (value.value if hasattr(value, "value") else value)
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(filter=expression).sort_by([("timestamp", "descending")])
+    if limit:
+        table = table.slice(0, limit)
+    rows = table.drop_columns(["month"]).to_pylist()
+    for row in rows:
+        row["archived"] = True
+    return rows
+
+
+async def find_with_archive(
+    collection,
+    filter_dict: Dict[str, Any],
+    limit: Optional[int] = None,
+    since: Optional[datetime] = None,
+    include_archive: bool = True,
+) -> List[Dict[str, Any]]:
+    """Newest-first documents from Mongo, topped up from the archive for historical ranges
+
+    `filter_dict` holds equality filters only; the time bound is passed as `since`.
+    The archive is only read when the range reaches past the archive horizon and
+    `include_archive` is set.
+    """
+    live_filter = dict(filter_dict)
+    if since is not None:
+        live_filter["timestamp"] = {"$gte": since}
+    live = await find_many_and_convert(collection, live_filter, sort=[("timestamp", -1)], limit=limit)
+
+    if (
+        pa is None
+        or not include_archive
+        or (limit and len(live) >= limit)
+        or (since is not None and since >= archive_horizon())
+    ):
+        return live
+
+    archived = await asyncio.to_thread(
+        _read_archive, collection.name, filter_dict, since, limit
+    )
+    seen = {doc.get("id") for doc in live}
+    merged = live + [doc for doc in archived if doc.get("id") not in seen]
+    merged.sort(key=lambda doc: doc["timestamp"], reverse=True)
+    return merged[:limit] if limit else merged
@@ -0,0 +1,332 @@
+"""
+Batched ANVL reward settlement
+Rewards accumulate as pending anvl_reward transactions. Each epoch claims the
+outstanding rewards, builds a Merkle tree over one leaf per dealer wallet,
+stores every proof in an indexed collection and publishes a single root to
+ANVLRewardDistributor.sol, so any number of rewards settle in one transaction.
+
+A build that dies partway leaves its epoch "building". Once that is older than
+REWARD_EPOCH_BUILD_TIMEOUT_SECONDS the next run abandons it and returns its
+rewards to the pending pool. Scheduled runs also retry built epochs whose
+publish failed, checking the distributor first so a root is never sent twice.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Any, Dict, List, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from ..models import Transaction, TransactionType
+from ..database import (
+    transactions_collection, dealers_collection,
+    reward_epochs_collection, reward_proofs_collection, from_document, ids_filter
+)
+from .eth_rpc import (
+    JsonRpcClient, keccak256, function_selector, encode_address, encode_uint256
+)
+
+logger = logging.getLogger(__name__)
+
+ANVL_DECIMALS = 18
+PROOF_BATCH_SIZE = 5000
+PUBLISH_ROOT_SELECTOR = function_selector("publishRoot(uint256,bytes32,uint256)")
+MERKLE_ROOTS_SELECTOR = function_selector("merkleRoots(uint256)")
+EMPTY_ROOT = "0x" + "00" * 32
+BUILD_TIMEOUT_SECONDS = float(os.environ.get("REWARD_EPOCH_BUILD_TIMEOUT_SECONDS", "3600"))
+
+
+def reward_transaction(dealer_id: str, amount: float) -> Transaction:
+    """A pending reward that will settle in the next Merkle epoch"""
+    return Transaction(
+        dealer_id=dealer_id,
+        type=TransactionType.anvl_reward,
+        amount=amount,
+        currency="ANVL",
+        method="merkle_epoch",
+        status="pending"
+    )
+
+
+def to_token_units(amount: float) -> int:
+    return int(Decimal(str(amount)).scaleb(ANVL_DECIMALS))
+
+
+def leaf_hash(wallet_address: str, amount: int) -> bytes:
+    """Leaf matching keccak256(bytes.concat(keccak256(abi.encode(account, amount))))"""
+    return keccak256(keccak256(encode_address(wallet_address) + encode_uint256(amount)))
+
+
+def _hash_pair(a: bytes, b: bytes) -> bytes:
+    return keccak256(a + b) if a < b else keccak256(b + a)
+
+
+def build_tree(leaves: List[bytes]) -> List[List[bytes]]:
+    """Build sorted-pair Merkle tree layers, leaves first; odd nodes are promoted"""
+    layers = [leaves]
+    while len(layers[-1]) > 1:
+        level = layers[-1]
+        parents = [
+            _hash_pair(level[i], level[i + 1]) if i + 1 < len(level) else level[i]
+            for i in range(0, len(level), 2)
+        ]
+        layers.append(parents)
+    return layers
+
+
+def merkle_proof(layers: List[List[bytes]], index: int) -> List[str]:
+    proof = []
+    for level in layers[:-1]:
+        sibling = index ^ 1
+        if sibling < len(level):
+            proof.append("0x" + level[sibling].hex())
+        index //= 2
+    return proof
+
+
+def verify_proof(proof: List[str], root: str, leaf: bytes) -> bool:
+    computed = leaf
+    for sibling in proof:
+        computed = _hash_pair(computed, bytes.fromhex(sibling[2:]))
+    return "0x" + computed.hex() == root
+
+
+class RewardPublisher:
+    """Publishes epoch roots through an account the RPC node can sign for"""
+
+    def __init__(self, rpc: JsonRpcClient, distributor_address: str, sender: str):
+        self.rpc = rpc
+        self.distributor_address = distributor_address
+        self.sender = sender
+
+    async def published_root(self, epoch: int) -> Optional[str]:
+        result = await self.rpc.eth_call(self.distributor_address, MERKLE_ROOTS_SELECTOR + encode_uint256(epoch))
+        root = "0x" + result[:32].hex()
+        return None if root == EMPTY_ROOT else root
+
+    async def publish(self, epoch: int, root: str, total: int) -> Optional[str]:
+        """Publish a root and return its transaction, or None if the distributor already has it"""
+        published = await self.published_root(epoch)
+        if published == root:
+            return None
+        if published is not None:
+            raise ValueError(f"Reward epoch {epoch} was published on-chain with a different root")
+
+        data = (
+            PUBLISH_ROOT_SELECTOR
+            + encode_uint256(epoch)
+            + bytes.fromhex(root[2:])
+            + encode_uint256(total)
+        )
+        tx_hash = await self.rpc.send_transaction(self.sender, self.distributor_address, data)
+        await self.rpc.wait_for_receipt(tx_hash)
+        return tx_hash
+
+
+def publisher_from_env() -> Optional[RewardPublisher]:
+    rpc_url = os.environ.get("REWARDS_RPC_URL")
+    distributor = os.environ.get("REWARDS_DISTRIBUTOR_ADDRESS")
+    sender = os.environ.get("REWARDS_PUBLISHER_ADDRESS")
+    if not (rpc_url and distributor and sender):
+        return None
+    return RewardPublisher(JsonRpcClient(rpc_url), distributor, sender)
+
+
+async def _next_epoch() -> int:
+    latest = await reward_epochs_collection.find_one({}, sort=[("_id", -1)], projection={"_id": 1})
+    return (latest["_id"] + 1) if latest else 1
+
+
+async def _claim_outstanding(epoch: int) -> List[Tuple[str, float, int]]:
+    """Assign pending rewards to the epoch and total them per dealer"""
+    await transactions_collection.update_many(
+        {"type": TransactionType.anvl_reward, "status": "pending", "reward_epoch": None},
+        {"$set": {"reward_epoch": epoch}}
+    )
+    rows = await transactions_collection.aggregate([
+        {"$match": {"type": TransactionType.anvl_reward, "reward_epoch": epoch}},
+        {"$group": {"_id": "$dealer_id", "amount": {"$sum": "$amount"}, "count": {"$sum": 1}}}
+    ]).to_list(length=None)
+    return [(row["_id"], row["amount"], row["count"]) for row in rows]
+
+
+async def _release(epoch: int):
+    """Return an epoch's unsettled rewards to the pending pool and drop its proofs"""
+    await transactions_collection.update_many(
+        {"type": TransactionType.anvl_reward, "status": "pending", "reward_epoch": epoch},
+        {"$set": {"reward_epoch": None}}
+    )
+    await reward_proofs_collection.delete_many({"epoch": epoch})
+
+
+async def recover_stale_epochs() -> List[int]:
+    """Abandon epochs stuck building past the timeout and release their rewards"""
+    cutoff = datetime.utcnow() - timedelta(seconds=BUILD_TIMEOUT_SECONDS)
+    stale = await reward_epochs_collection.find(
+        {"status": "building", "created_at": {"$lt": cutoff}}, {"_id": 1}
+    ).to_list(length=None)
+
+    abandoned = []
+    for epoch_doc in stale:
+        epoch = epoch_doc["_id"]
+        # The epoch number stays taken so a builder that is only slow cannot reuse it
+        result = await reward_epochs_collection.update_one(
+            {"_id": epoch, "status": "building"},
+            {"$set": {"status": "abandoned", "abandoned_at": datetime.utcnow()}}
+        )
+        if result.modified_count:
+            await _release(epoch)
+            abandoned.append(epoch)
+            logger.warning(f"Abandoned reward epoch {epoch} stuck building since {epoch_doc.get('created_at')}")
+    return abandoned
+
+
+async def build_epoch(publisher: Optional[RewardPublisher] = None) -> Optional[Dict[str, Any]]:
+    """Claim outstanding rewards into a new epoch, store its proofs and optionally publish it"""
+    await recover_stale_epochs()
+
+    pending = await transactions_collection.find_one(
+        {"type": TransactionType.anvl_reward, "status": "pending", "reward_epoch": None},
+        {"_id": 1}
+    )
+    if not pending:
+        return None
+
+    epoch = await _next_epoch()
+    try:
+        await reward_epochs_collection.insert_one({
+            "_id": epoch, "status": "building", "created_at": datetime.utcnow()
+        })
+    except DuplicateKeyError:
+        logger.info(f"Reward epoch {epoch} is already being built elsewhere")
+        return None
+
+    totals = await _claim_outstanding(epoch)
+
+    wallets = {}
+    async for dealer in dealers_collection.find(
+        ids_filter(dealer_id for dealer_id, _, _ in totals),
+        {"id": 1, "wallet_address": 1}
+    ):
+        wallets[from_document(dealer)["id"]] = dealer["wallet_address"].lower()
+
+    entries = []
+    unassigned = []
+    for dealer_id, amount, count in sorted(totals, key=lambda row: wallets.get(row[0], "")):
+        if dealer_id in wallets and amount > 0:
+            entries.append((dealer_id, wallets[dealer_id], to_token_units(amount), count))
+        else:
+            unassigned.append(dealer_id)
+
+    if unassigned:
+        # Leave rewards without a wallet pending for a later epoch
+        await transactions_collection.update_many(
+            {"reward_epoch": epoch, "dealer_id": {"$in": unassigned}},
+            {"$set": {"reward_epoch": None}}
+        )
+
+    if not entries:
+        await reward_epochs_collection.delete_one({"_id": epoch})
+        return None
+
+    leaves = [leaf_hash(wallet, amount) for _, wallet, amount, _ in entries]
+    layers = await asyncio.to_thread(build_tree, leaves)
+    root = "0x" + layers[-1][0].hex()
+
+    for start in range(0, len(entries), PROOF_BATCH_SIZE):
+        batch = entries[start:start + PROOF_BATCH_SIZE]
+        await reward_proofs_collection.insert_many([
+            {
+                "_id": f"{epoch}:{wallet}",
+                "epoch": epoch,
+                "dealer_id": dealer_id,
+                "wallet_address": wallet,
+                "amount": str(amount),
+                "reward_count": count,
+                "proof": merkle_proof(layers, start + offset),
+            }
+            for offset, (dealer_id, wallet, amount, count) in enumerate(batch)
+        ], ordered=False)
+
+    total = sum(amount for _, _, amount, _ in entries)
+    epoch_doc = {
+        "root": root,
+        "total_amount": str(total),
+        "leaf_count": len(entries),
+        "reward_count": sum(count for _, _, _, count in entries),
+        "status": "built",
+        "built_at": datetime.utcnow(),
+    }
+    result = await reward_epochs_collection.update_one({"_id": epoch, "status": "building"}, {"$set": epoch_doc})
+    if not result.matched_count:
+        # Abandoned as stale while we were building; anything claimed since goes back
+        await _release(epoch)
+        logger.warning(f"Reward epoch {epoch} was abandoned before its build finished")
+        return None
+    logger.info(f"Built reward epoch {epoch} with {len(entries)} leaves, root {root}")
+
+    if publisher:
+        await publish_epoch(epoch, publisher=publisher)
+    return await reward_epochs_collection.find_one({"_id": epoch})
+
+
+async def publish_epoch(
+    epoch: int,
+    publisher: Optional[RewardPublisher] = None,
+    tx_hash: Optional[str] = None,
+) -> Dict[str, Any]:
+    """Publish a built epoch on-chain, or record a root the distributor already holds"""
+    epoch_doc = await reward_epochs_collection.find_one({"_id": epoch})
+    if not epoch_doc:
+        raise LookupError(f"Reward epoch {epoch} not found")
+    if epoch_doc["status"] == "published":
+        return epoch_doc
+    if epoch_doc["status"] != "built":
+        raise ValueError(f"Reward epoch {epoch} is not ready to publish")
+
+    if publisher is None:
+        raise ValueError("No reward publisher is configured")
+    if tx_hash is None:
+        tx_hash = await publisher.publish(epoch, epoch_doc["root"], int(epoch_doc["total_amount"]))
+        if tx_hash is None:
+            logger.info(f"Reward epoch {epoch} root was already on-chain; recording it as published")
+    elif await publisher.published_root(epoch) != epoch_doc["root"]:
+        raise ValueError(f"Reward epoch {epoch} root is not on-chain")
+
+    published_at = datetime.utcnow()
+    result = await reward_epochs_collection.update_one(
+        {"_id": epoch, "status": "built"},
+        {"$set": {"status": "published", "tx_hash": tx_hash, "published_at": published_at}}
+    )
+    if not result.modified_count:
+        # Another publisher recorded it first and confirms its rewards
+        return await reward_epochs_collection.find_one({"_id": epoch})
+    await transactions_collection.update_many(
+        {"type": TransactionType.anvl_reward, "reward_epoch": epoch},
+        {"$set": {"status": "confirmed", "tx_hash": tx_hash}}
+    )
+    logger.info(f"Published reward epoch {epoch} in {tx_hash}")
+    return await reward_epochs_collection.find_one({"_id": epoch})
+
+
+async def publish_built_epochs(publisher: RewardPublisher) -> List[int]:
+    """Retry publishing epochs that were built but never made it on-chain"""
+    built = await reward_epochs_collection.find({"status": "built"}, {"_id": 1}).sort("_id", 1).to_list(length=None)
+    published = []
+    for epoch_doc in built:
+        try:
+            await publish_epoch(epoch_doc["_id"], publisher=publisher)
+            published.append(epoch_doc["_id"])
+        except Exception as e:
+            logger.error(f"Error publishing reward epoch {epoch_doc['_id']}: {e}")
+    return published
+
+
+async def run_epoch():
+    """Scheduled entry point: build and, when configured, publish the next epoch"""
+    publisher = publisher_from_env()
+    if publisher:
+        await publish_built_epochs(publisher)
+    await build_epoch(publisher=publisher)
@@ -0,0 +1,67 @@
+"""
+Periodic background tasks for the ANVL API
+Runs coroutines on a fixed interval inside the API event loop
+"""
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask:
+    """Run a coroutine function every `interval` seconds until stopped"""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable], run_immediately: bool = True):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.run_immediately = run_immediately
+        self._task: asyncio.Task = None
+
+    async def _run(self):
+        if not self.run_immediately:
+            await asyncio.sleep(self.interval)
+        while True:
+            try:
+                await self.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Error running periodic task {self.name}: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run(), name=self.name)
+            logger.info(f"Started periodic task {self.name} every {self.interval}s")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_tasks: Dict[str, PeriodicTask] = {}
+
+
+def schedule(name: str, interval: float, func: Callable[[], Awaitable], run_immediately: bool = True) -> PeriodicTask:
+    """Register and start a periodic task; a task with the same name is replaced"""
+    previous = _tasks.pop(name, None)
+    if previous is not None and previous._task is not None:
+        previous._task.cancel()
+    task = PeriodicTask(name, interval, func, run_immediately)
+    _tasks[name] = task
+    task.start()
+    return task
+
+
+async def stop_all():
+    """Cancel every scheduled task, used on shutdown"""
+    for task in list(_tasks.values()):
+        await task.stop()
+    _tasks.clear()
@@ -0,0 +1,164 @@
+"""
+Incremental sync for offline-capable auditor devices
+Every vehicle write is stamped with a monotonic sequence number and deletes leave
+tombstones, so a device can ask for everything that changed after the last
+sequence it saw instead of re-downloading the whole inventory.
+
+Sequence numbers are reserved before the write that carries them commits, so
+writes can land out of order. Each reservation stays in flight on the counter
+until its write finishes (or SYNC_RESERVATION_TIMEOUT_SECONDS pass), and a page
+stops below the lowest one; a token never moves past a change still to come. The
+counter and its reservations are read together, so a page is also capped at the
+last number reserved when it was read.
+"""
+import logging
+import os
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Optional, Tuple
+
+from pymongo import ReturnDocument, UpdateOne
+
+from ..database import vehicles_collection, sync_counters_collection, sync_tombstones_collection, from_document, find_options
+
+logger = logging.getLogger(__name__)
+
+VEHICLES_SEQUENCE = "vehicles"
+DEFAULT_SYNC_LIMIT = 500
+MAX_SYNC_LIMIT = 2000
+RESERVATION_TIMEOUT = timedelta(seconds=int(os.environ.get("SYNC_RESERVATION_TIMEOUT_SECONDS", "30")))
+
+
+class InvalidSyncToken(ValueError):
+    pass
+
+
+async def allocate_sequence(count: int = 1, name: str = VEHICLES_SEQUENCE) -> int:
+    """Reserve `count` consecutive sequence numbers, mark them in flight and return the first one"""
+    now = datetime.utcnow()
+    counter = await sync_counters_collection.find_one_and_update(
+        {"_id": name},
+        [
+            {"$set": {"seq": {"$add": [{"$ifNull": ["$seq", 0]}, count]}}},
+            {"$set": {"in_flight": {"$concatArrays": [
+                # Reservations whose writer died are dropped once they time out
+                {"$filter": {"input": {"$ifNull": ["$in_flight", []]}, "cond": {"$gt": ["$$this.expires_at", now]}}},
+                [{"first": {"$subtract": ["$seq", count - 1]}, "expires_at": now + RESERVATION_TIMEOUT}],
+            ]}}},
+        ],
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    return counter["seq"] - count + 1
+
+
+async def release_sequence(first: int, name: str = VEHICLES_SEQUENCE):
+    await sync_counters_collection.update_one({"_id": name}, {"$pull": {"in_flight": {"first": first}}})
+
+
+@asynccontextmanager
+async def reserve_sequence(count: int = 1, name: str = VEHICLES_SEQUENCE) -> AsyncIterator[int]:
+    """Sequence numbers for the writes made inside the block, held in flight until it exits"""
+    first = await allocate_sequence(count, name)
+    try:
+        yield first
+    finally:
+        await release_sequence(first, name)
+
+
+@asynccontextmanager
+async def sync_stamp() -> AsyncIterator[Dict[str, Any]]:
+    """Fields to $set on a vehicle write so devices pick up the change; write inside the block"""
+    async with reserve_sequence() as seq:
+        yield {"sync_seq": seq}
+
+
+async def record_tombstone(vehicle: Dict[str, Any]):
+    """Remember a deleted vehicle so devices can drop their local copy"""
+    async with reserve_sequence() as seq:
+        await sync_tombstones_collection.insert_one({
+            "id": vehicle["id"],
+            "dealer_id": vehicle.get("dealer_id"),
+            "sync_seq": seq,
+            "deleted_at": datetime.utcnow()
+        })
+
+
+async def sequence_window(name: str = VEHICLES_SEQUENCE) -> Tuple[int, Optional[int]]:
+    """Last reserved sequence number and the lowest one whose write has not finished, read together"""
+    counter = await sync_counters_collection.find_one({"_id": name}, {"seq": 1, "in_flight": 1}, **find_options())
+    now = datetime.utcnow()
+    pending = [entry["first"] for entry in (counter or {}).get("in_flight", []) if entry["expires_at"] > now]
+    return (counter or {}).get("seq", 0), min(pending) if pending else None
+
+
+def parse_token(token: Optional[str]) -> int:
+    if not token:
+        return 0
+    try:
+        since = int(token)
+    except ValueError:
+        raise InvalidSyncToken(f"Invalid sync token: {token}")
+    if since < 0:
+        raise InvalidSyncToken(f"Invalid sync token: {token}")
+    return since
+
+
+async def changes_since(dealer_id: str, token: Optional[str] = None, limit: int = DEFAULT_SYNC_LIMIT) -> Dict[str, Any]:
+    """Vehicles written and deleted after the token, oldest change first"""
+    since = parse_token(token)
+    limit = max(1, min(limit, MAX_SYNC_LIMIT))
+    # Numbers reserved after this read may commit before the ones in flight now
+    reserved, floor = await sequence_window()
+    seq_range = {"$gt": since, "$lte": reserved}
+    if floor is not None:
+        # Changes at or above an unfinished write wait for the next request
+        seq_range["$lt"] = floor
+    filter_dict = {"dealer_id": dealer_id, "sync_seq": seq_range}
+
+    # Read one extra from each side to know whether another page follows
+    vehicles = await vehicles_collection.find(
+        filter_dict, {"vin_normalized": 0, "vin_last8": 0, "vin_reversed": 0}, **find_options()
+    ).sort("sync_seq", 1).limit(limit + 1).to_list(length=limit + 1)
+    tombstones = await sync_tombstones_collection.find(
+        filter_dict, {"_id": 0, "id": 1, "sync_seq": 1}, **find_options()
+    ).sort("sync_seq", 1).limit(limit + 1).to_list(length=limit + 1)
+
+    changes = sorted(
+        [("upsert", vehicle) for vehicle in vehicles] + [("delete", tombstone) for tombstone in tombstones],
+        key=lambda change: change[1]["sync_seq"]
+    )
+    page = changes[:limit]
+
+    return {
+        "vehicles": [from_document(doc) for kind, doc in page if kind == "upsert"],
+        "deleted": [doc["id"] for kind, doc in page if kind == "delete"],
+        "next_token": str(page[-1][1]["sync_seq"] if page else since),
+        "has_more": len(changes) > limit
+    }
+
+
+async def backfill_sync_sequence(batch_size: int = 1000):
+    """Stamp vehicles written before sequencing existed so a full sync returns them"""
+    updated = 0
+    cursor = vehicles_collection.find({"sync_seq": {"$exists": False}}, {"_id": 1})
+    batch = []
+    async for vehicle in cursor:
+        batch.append(vehicle["_id"])
+        if len(batch) >= batch_size:
+            updated += await _stamp_batch(batch)
+            batch = []
+    if batch:
+        updated += await _stamp_batch(batch)
+    if updated:
+        logger.info(f"Backfilled sync sequence on {updated} vehicles")
+    return updated
+
+
+async def _stamp_batch(primary_keys) -> int:
+    async with reserve_sequence(len(primary_keys)) as first:
+        await vehicles_collection.bulk_write([
+            UpdateOne({"_id": primary_key, "sync_seq": {"$exists": False}}, {"$set": {"sync_seq": first + offset}})
+            for offset, primary_key in enumerate(primary_keys)
+        ], ordered=False)
+    return len(primary_keys)
@@ -0,0 +1,372 @@
+"""
+Distributed tracing for the ANVL API
+OpenTelemetry-shaped spans for each request, each Mongo command and each swarm
+agent call, so a slow request can be broken down along its critical path.
+Request spans continue an incoming W3C traceparent and return one. Mongo spans
+come from a pymongo command listener; Motor runs commands on executor threads
+with a copy of the caller's context, so they nest under the span that awaited
+them. Commands outside any span (pollers, index builds) are not traced.
+
+Finished spans are batched on a background thread and written as OTLP/JSON:
+appended one export request per line to TRACE_FILE (readable by the collector's
+otlpjsonfile receiver), or POSTed to OTEL_EXPORTER_OTLP_ENDPOINT/v1/traces.
+Tracing is off unless one of them is set. TRACE_SAMPLE_RATIO samples root spans.
+"""
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import re
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+
+from pymongo import monitoring
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds and status codes
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+SERVICE_NAME = os.environ.get("OTEL_SERVICE_NAME", "anvl-api")
+TRACE_FILE = os.environ.get("TRACE_FILE", "")
+OTLP_ENDPOINT = os.environ.get("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+SAMPLE_RATIO = float(os.environ.get("TRACE_SAMPLE_RATIO", "1.0"))
+EXPORT_BATCH_SIZE = 512
+EXPORT_INTERVAL_SECONDS = 2.0
+MAX_QUEUED_SPANS = 20000
+OTLP_TIMEOUT_SECONDS = 5
+
+TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = (
+        "tracer", "trace_id", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns",
+        "attributes", "status", "status_message", "sampled",
+    )
+
+    def __init__(self, tracer, name, trace_id, parent_id, sampled, kind=INTERNAL, attributes=None, start_ns=None):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = dict(attributes or {})
+        self.status = None
+        self.status_message = None
+        self.sampled = sampled
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def set_error(self, message: str):
+        self.status = STATUS_ERROR
+        self.status_message = message
+
+    def record_exception(self, error: BaseException):
+        self.attributes["exception.type"] = type(error).__name__
+        self.attributes["exception.message"] = str(error)
+        self.set_error(f"{type(error).__name__}: {error}")
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self, end_ns: Optional[int] = None):
+        if self.end_ns is not None:
+            return
+        self.end_ns = end_ns or time.time_ns()
+        if self.sampled:
+            self.tracer.exporter.submit(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_attribute(key, value) for key, value in self.attributes.items() if value is not None],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status is not None:
+            span["status"] = {"code": self.status, "message": self.status_message or ""}
+        return span
+
+
+class RemoteParent:
+    """Span context from an incoming traceparent header"""
+    def __init__(self, trace_id: str, span_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[RemoteParent]:
+    match = TRACEPARENT.match(header.strip().lower()) if header else None
+    if match is None or match.group(1) == "0" * 32 or match.group(2) == "0" * 16:
+        return None
+    return RemoteParent(match.group(1), match.group(2), int(match.group(3), 16) & 1 == 1)
+
+
+def _attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def file_sink(path: str) -> Callable[[bytes], None]:
+    def write(payload: bytes):
+        with open(path, "ab") as handle:
+            handle.write(payload + b"\n")
+    return write
+
+
+def otlp_http_sink(endpoint: str) -> Callable[[bytes], None]:
+    url = endpoint.rstrip("/") + "/v1/traces"
+
+    def post(payload: bytes):
+        request = urllib.request.Request(url, data=payload, headers={"Content-Type": "application/json"})
+        with urllib.request.urlopen(request, timeout=OTLP_TIMEOUT_SECONDS) as response:
+            response.read()
+    return post
+
+
+class BatchExporter:
+    """Queues finished spans and writes them in batches from a background thread"""
+
+    def __init__(self, sink: Optional[Callable[[bytes], None]]):
+        self.sink = sink
+        self.dropped = 0
+        self._queue: "queue.Queue[Span]" = queue.Queue(MAX_QUEUED_SPANS)
+        self._thread: Optional[threading.Thread] = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_thread(self):
+        # Pre-forked workers inherit the object but not the thread
+        if self._pid == os.getpid() and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._pid != os.getpid() or not self._thread.is_alive():
+                if self._pid != os.getpid():
+                    self._queue = queue.Queue(MAX_QUEUED_SPANS)
+                self._pid = os.getpid()
+                self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                self._thread.start()
+
+    def submit(self, span: Span):
+        if self.sink is None:
+            return
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _run(self):
+        while True:
+            batch = self._drain(EXPORT_INTERVAL_SECONDS)
+            if batch:
+                self._export(batch)
+
+    def _drain(self, timeout: float) -> List[Span]:
+        batch = []
+        try:
+            batch.append(self._queue.get(timeout=timeout))
+            while len(batch) < EXPORT_BATCH_SIZE:
+                batch.append(self._queue.get_nowait())
+        except queue.Empty:
+            pass
+        return batch
+
+    def _export(self, batch: List[Span]):
+        payload = {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    _attribute("service.name", SERVICE_NAME),
+                    _attribute("process.pid", os.getpid()),
+                ]},
+                "scopeSpans": [{
+                    "scope": {"name": "anvl.tracing"},
+                    "spans": [span.to_otlp() for span in batch],
+                }],
+            }]
+        }
+        try:
+            self.sink(json.dumps(payload, separators=(",", ":")).encode())
+        except Exception as e:
+            logger.warning(f"Could not export {len(batch)} spans: {e}")
+
+    def flush(self):
+        """Export whatever is queued, from the calling thread"""
+        if self.sink is None:
+            return
+        while True:
+            batch = self._drain(0)
+            if not batch:
+                break
+            self._export(batch)
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} spans because the export queue was full")
+            self.dropped = 0
+
+
+class Tracer:
+    def __init__(self, exporter: BatchExporter, sample_ratio: float = SAMPLE_RATIO):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.enabled = exporter.sink is not None
+
+    def start_span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None,
+                   parent=None, start_ns: Optional[int] = None) -> Span:
+        """Start a span under `parent`, or under the current span when none is given"""
+        parent = parent if parent is not None else current_span.get()
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            trace_id, parent_id = f"{random.getrandbits(128):032x}", None
+            sampled = random.random() < self.sample_ratio
+        return Span(self, name, trace_id, parent_id, sampled and self.enabled, kind, attributes, start_ns)
+
+    @contextmanager
+    def span(self, name: str, kind: int = INTERNAL, attributes: Optional[Dict[str, Any]] = None, parent=None):
+        """Run the block in a span that becomes the current span"""
+        span = self.start_span(name, kind, attributes, parent)
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            current_span.reset(token)
+            span.end()
+
+    def shutdown(self):
+        self.exporter.flush()
+
+
+def tracer_from_env() -> Tracer:
+    if TRACE_FILE:
+        return Tracer(BatchExporter(file_sink(TRACE_FILE)))
+    if OTLP_ENDPOINT:
+        return Tracer(BatchExporter(otlp_http_sink(OTLP_ENDPOINT)))
+    return Tracer(BatchExporter(None))
+
+
+tracer = tracer_from_env()
+atexit.register(tracer.shutdown)
+
+
+class MongoCommandTracer(monitoring.CommandListener):
+    """Client spans for Mongo commands issued while a sampled span is current"""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+        self._spans: Dict[Any, Span] = {}
+
+    def started(self, event: monitoring.CommandStartedEvent):
+        parent = current_span.get()
+        if parent is None or not parent.sampled:
+            return
+        host, port = event.connection_id
+        target = event.command.get(event.command_name)
+        self._spans[(event.connection_id, event.request_id)] = self.tracer.start_span(
+            f"mongodb.{event.command_name}",
+            kind=CLIENT,
+            parent=parent,
+            attributes={
+                "db.system": "mongodb",
+                "db.name": event.database_name,
+                "db.operation": event.command_name,
+                "db.mongodb.collection": target if isinstance(target, str) else None,
+                "net.peer.name": host,
+                "net.peer.port": port,
+            }
+        )
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.end(span.start_ns + event.duration_micros * 1000)
+
+    def failed(self, event: monitoring.CommandFailedEvent):
+        span = self._spans.pop((event.connection_id, event.request_id), None)
+        if span is not None:
+            span.set_error(str(event.failure.get("errmsg", "command failed")))
+            span.end(span.start_ns + event.duration_micros * 1000)
+
+
+def mongo_event_listeners() -> list:
+    return [MongoCommandTracer(tracer)] if tracer.enabled else []
+
+
+class TracingMiddleware:
+    """A server span per HTTP request, named after the matched route"""
+
+    def __init__(self, app: ASGIApp, tracer: Tracer = tracer):
+        self.app = app
+        self.tracer = tracer
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not self.tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = Headers(scope=scope)
+        span = self.tracer.start_span(
+            f"{scope['method']} {scope['path']}",
+            kind=SERVER,
+            parent=parse_traceparent(headers.get("traceparent")),
+            attributes={
+                "http.method": scope["method"],
+                "http.target": scope["path"],
+                "http.user_agent": headers.get("user-agent"),
+            }
+        )
+        token = current_span.set(span)
+
+        async def send_with_trace(message: Message):
+            if message["type"] == "http.response.start":
+                span.set_attribute("http.status_code", message["status"])
+                if message["status"] >= 500:
+                    span.set_error(f"HTTP {message['status']}")
+                MutableHeaders(scope=message).append("traceparent", span.traceparent())
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            # FastAPI records the matched route in the shared scope
+            route = scope.get("route")
+            if route is not None and getattr(route, "path", None):
+                span.name = f"{scope['method']} {route.path}"
+                span.set_attribute("http.route", route.path)
+            current_span.reset(token)
+            span.end()
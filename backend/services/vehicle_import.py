@@ -0,0 +1,341 @@
+"""
+Bulk vehicle import for ANVL dealer onboarding
+Streams JSON array or CSV payloads, validates VIN check digits in batches and
+inserts vehicles chunk by chunk with a single duplicate lookup per chunk
+"""
+import codecs
+import csv
+import io
+import json
+import logging
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Set
+
+import numpy as np
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+from ..models import Vehicle, VehicleCreate
+from ..database import vehicles_collection, dealers_collection, to_document, from_document, ids_filter
+from .vin_lookup import vin_fragments
+from .sync import reserve_sequence
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 500
+DUPLICATE_KEY_ERROR = 11000
+
+
+class ImportAborted(ValueError):
+    """The upload stopped parsing partway; `summary` covers the rows imported before that"""
+
+    def __init__(self, message: str, summary: Dict[str, Any]):
+        super().__init__(message)
+        self.summary = summary
+
+# ISO 3779 transliteration table; I, O and Q are not allowed in a VIN
+_VIN_VALUES = np.full(128, -1, dtype=np.int64)
+for _char, _value in zip("0123456789", range(10)):
+    _VIN_VALUES[ord(_char)] = _value
+for _chars, _start in (("ABCDEFGH", 1), ("JKLMN", 1), ("P", 7), ("R", 9), ("STUVWXYZ", 2)):
+    for _offset, _char in enumerate(_chars):
+        _VIN_VALUES[ord(_char)] = _start + _offset
+_VIN_WEIGHTS = np.array([8, 7, 6, 5, 4, 3, 2, 10, 0, 9, 8, 7, 6, 5, 4, 3, 2], dtype=np.int64)
+
+
+def normalize_vin(vin: Any) -> str:
+    """Uppercase and strip a VIN read from an upload"""
+    return str(vin or "").strip().upper()
+
+
+def validate_vin_check_digits(vins: List[str]) -> np.ndarray:
+    """Return a boolean mask of VINs whose 9th character is a valid check digit"""
+    valid = np.zeros(len(vins), dtype=bool)
+    well_formed = np.flatnonzero([len(vin) == 17 and vin.isascii() for vin in vins])
+    if well_formed.size == 0:
+        return valid
+
+    codes = np.frombuffer(
+        "".join(vins[i] for i in well_formed).encode("ascii"), dtype=np.uint8
+    ).reshape(-1, 17)
+    values = _VIN_VALUES[codes]
+    allowed = (values >= 0).all(axis=1)
+
+    remainder = (np.where(values >= 0, values, 0) * _VIN_WEIGHTS).sum(axis=1) % 11
+    expected = np.where(remainder == 10, ord("X"), remainder + ord("0"))
+    valid[well_formed] = allowed & (codes[:, 8] == expected)
+    return valid
+
+
+async def iter_json_array(chunks: AsyncIterator[bytes]) -> AsyncIterator[Any]:
+    """Yield the elements of a JSON array as its bytes arrive"""
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    started = False
+    finished = False
+
+    def parse(final: bool):
+        nonlocal buffer, started, finished
+        pos = 0
+        items = []
+        while not finished:
+            while pos < len(buffer) and buffer[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buffer):
+                break
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError("Expected a JSON array of vehicles")
+                started = True
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                finished = True
+                pos += 1
+                break
+            try:
+                item, pos = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                if final:
+                    raise ValueError("Malformed JSON array")
+                break
+            items.append(item)
+        buffer = buffer[pos:]
+        return items
+
+    async for chunk in chunks:
+        buffer += text_decoder.decode(chunk)
+        for item in parse(final=False):
+            yield item
+
+    buffer += text_decoder.decode(b"", final=True)
+    for item in parse(final=True):
+        yield item
+    if not finished:
+        raise ValueError("Unterminated JSON array")
+
+
+def _complete_records(text: str, start: int, quoted: bool):
+    """End of the last record in `text` not inside quotes, scanning from `start` in quote state `quoted`"""
+    cut = -1
+    pos = start
+    while True:
+        quote = text.find('"', pos)
+        if quoted:
+            if quote < 0:
+                return cut, True
+            quoted = False
+        else:
+            newline = text.rfind("\n", pos, quote if quote >= 0 else len(text))
+            if newline >= 0:
+                cut = newline + 1
+            if quote < 0:
+                return cut, False
+            quoted = True
+        pos = quote + 1
+
+
+async def iter_csv_rows(chunks: AsyncIterator[bytes]) -> AsyncIterator[Dict[str, Any]]:
+    """Yield CSV rows as dictionaries keyed by the header line
+
+    Only whole records go to the CSV reader, so quoted fields may hold newlines
+    and span chunk boundaries.
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    tail = ""
+    quoted = False
+    header: Optional[List[str]] = None
+
+    def rows_from(text: str):
+        nonlocal header
+        for values in csv.reader(io.StringIO(text, newline="")):
+            if not values or not any(v.strip() for v in values):
+                continue
+            if header is None:
+                header = [h.strip() for h in values]
+                continue
+            yield {
+                key: (value.strip() or None)
+                for key, value in zip(header, values)
+            }
+
+    async for chunk in chunks:
+        scanned = len(tail)
+        tail += text_decoder.decode(chunk)
+        cut, quoted = _complete_records(tail, scanned, quoted)
+        if cut >= 0:
+            records, tail = tail[:cut], tail[cut:]
+            # `quoted` describes the end of `tail`, so the next scan resumes from there
+            for row in rows_from(records):
+                yield row
+
+    tail += text_decoder.decode(b"", final=True)
+    if quoted:
+        raise ValueError("Unterminated quoted field in CSV")
+    for row in rows_from(tail):
+        yield row
+
+
+def _mint_vehicle(vehicle_data: VehicleCreate) -> Vehicle:
+    """Build a vehicle document with its NFC, NFT and IPFS placeholders"""
+    token = uuid.uuid4().hex
+    vehicle = Vehicle(**vehicle_data.dict())
+    vehicle.nfc_tag_id = f"nfc_{token[:8]}"
+    vehicle.nft_token_id = f"nft_{token[8:16]}"
+    vehicle.ipfs_hash = f"Qm{token}{uuid.uuid4().hex[:12]}"
+    return vehicle
+
+
+class VehicleImporter:
+    """Accumulates uploaded rows and flushes them to Mongo in chunks"""
+
+    def __init__(
+        self,
+        dealer_id: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        validate_check_digit: bool = True,
+    ):
+        self.dealer_id = dealer_id
+        self.chunk_size = chunk_size
+        self.validate_check_digit = validate_check_digit
+        self.received = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors: List[Dict[str, Any]] = []
+        self._pending: List[tuple] = []
+        self._seen_vins: Set[str] = set()
+        self._known_dealers: Set[str] = set()
+
+    def _reject(self, row: int, vin: Optional[str], reason: str, duplicate: bool = False):
+        if duplicate:
+            self.duplicates += 1
+        else:
+            self.invalid += 1
+        self.errors.append({"row": row, "vin": vin, "error": reason})
+
+    async def add(self, record: Any):
+        """Queue one uploaded record, flushing when a chunk is full"""
+        self.received += 1
+        row = self.received
+        if not isinstance(record, dict):
+            self._reject(row, None, "Record is not an object")
+            return
+
+        record = {k: v for k, v in record.items() if v not in ("", None)}
+        record.setdefault("dealer_id", self.dealer_id)
+        record["vin"] = normalize_vin(record.get("vin"))
+        try:
+            vehicle_data = VehicleCreate(**record)
+        except ValidationError as e:
+            fields = ", ".join(".".join(str(p) for p in err["loc"]) for err in e.errors())
+            self._reject(row, record["vin"] or None, f"Invalid fields: {fields}")
+            return
+
+        self._pending.append((row, vehicle_data))
+        if len(self._pending) >= self.chunk_size:
+            await self.flush()
+
+    async def _verify_dealers(self, dealer_ids: Set[str]):
+        missing = dealer_ids - self._known_dealers
+        if missing:
+            cursor = dealers_collection.find(ids_filter(missing), {"_id": 1, "id": 1})
+            async for dealer in cursor:
+                self._known_dealers.add(from_document(dealer)["id"])
+
+    async def flush(self):
+        """Validate and insert the pending chunk"""
+        pending, self._pending = self._pending, []
+        if not pending:
+            return
+
+        vins = [vehicle_data.vin for _, vehicle_data in pending]
+        if self.validate_check_digit:
+            check_digits_ok = validate_vin_check_digits(vins)
+        else:
+            check_digits_ok = np.ones(len(vins), dtype=bool)
+
+        await self._verify_dealers({vehicle_data.dealer_id for _, vehicle_data in pending})
+
+        candidates = []
+        for (row, vehicle_data), check_ok in zip(pending, check_digits_ok):
+            if not check_ok:
+                self._reject(row, vehicle_data.vin, "Invalid VIN check digit")
+            elif vehicle_data.dealer_id not in self._known_dealers:
+                self._reject(row, vehicle_data.vin, "Dealer not found")
+            elif vehicle_data.vin in self._seen_vins:
+                self._reject(row, vehicle_data.vin, "Duplicate VIN in upload", duplicate=True)
+            else:
+                self._seen_vins.add(vehicle_data.vin)
+                candidates.append((row, vehicle_data))
+
+        if not candidates:
+            return
+
+        existing = set()
+        cursor = vehicles_collection.find(
+            {"vin": {"$in": [vehicle_data.vin for _, vehicle_data in candidates]}},
+            {"vin": 1}
+        )
+        async for vehicle in cursor:
+            existing.add(vehicle["vin"])
+
+        to_insert = []
+        for row, vehicle_data in candidates:
+            if vehicle_data.vin in existing:
+                self._reject(row, vehicle_data.vin, "Vehicle with this VIN already exists", duplicate=True)
+            else:
+                to_insert.append((row, _mint_vehicle(vehicle_data)))
+
+        if not to_insert:
+            return
+
+        try:
+            async with reserve_sequence(len(to_insert)) as first_seq:
+                result = await vehicles_collection.insert_many(
+                    [
+                        {**to_document(vehicle.dict()), **vin_fragments(vehicle.vin), "sync_seq": first_seq + offset}
+                        for offset, (_, vehicle) in enumerate(to_insert)
+                    ],
+                    ordered=False
+                )
+            self.inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            details = e.details
+            self.inserted += details.get("nInserted", 0)
+            for write_error in details.get("writeErrors", []):
+                row, vehicle = to_insert[write_error["index"]]
+                if write_error.get("code") == DUPLICATE_KEY_ERROR:
+                    self._reject(row, vehicle.vin, "Vehicle with this VIN already exists", duplicate=True)
+                else:
+                    logger.error(f"Error inserting vehicle {vehicle.vin}: {write_error.get('errmsg')}")
+                    self._reject(row, vehicle.vin, "Failed to insert vehicle")
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "duplicates": self.duplicates,
+            "invalid": self.invalid,
+            "errors": sorted(self.errors, key=lambda e: e["row"]),
+        }
+
+
+async def import_vehicles(
+    records: AsyncIterator[Any],
+    dealer_id: Optional[str] = None,
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    validate_check_digit: bool = True,
+) -> Dict[str, Any]:
+    """Import a stream of vehicle records and return per-row results"""
+    importer = VehicleImporter(dealer_id, chunk_size, validate_check_digit)
+    try:
+        async for record in records:
+            await importer.add(record)
+    except ValueError as e:
+        # Rows before the malformed point are kept; report how far the upload got
+        await importer.flush()
+        raise ImportAborted(f"{e} after {importer.received} rows", importer.summary()) from e
+    await importer.flush()
+    return importer.summary()
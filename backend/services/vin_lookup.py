@@ -0,0 +1,221 @@
+"""
+VIN lookup for NFC readers and handheld scanners
+Keeps normalised VIN fragments on each vehicle so exact, prefix, suffix and
+last-8 lookups are index range scans, and caches NFC tag ids in memory.
+Each worker has its own cache and only sees its own writes, so entries expire
+after NFC_TAG_CACHE_TTL_SECONDS and writers filter on the tag they resolved;
+a write that matches nothing means the entry was stale.
+"""
+import asyncio
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from pymongo import UpdateOne
+
+from ..database import vehicles_collection, from_document, find_options
+
+logger = logging.getLogger(__name__)
+
+LAST8_LENGTH = 8
+# Shorter prefixes and suffixes match too much of the index to be worth scanning
+MIN_FRAGMENT_LENGTH = 4
+NFC_TAG_CACHE_TTL = float(os.environ.get("NFC_TAG_CACHE_TTL_SECONDS", "300"))
+MAX_MATCHES_PER_QUERY = 10
+LOOKUP_MODES = ("auto", "exact", "prefix", "suffix", "last8")
+_BATCHED_FIELDS = {"exact": "vin_normalized", "last8": "vin_last8"}
+
+# I, O and Q never appear in a VIN, so scanners reading them meant 1 and 0
+_NOISE_TRANSLATION = str.maketrans({"I": "1", "O": "0", "Q": "0"})
+_NON_ALPHANUMERIC = re.compile(r"[^A-Z0-9]")
+
+
+def normalize_scanned_vin(vin: Optional[str]) -> str:
+    """Uppercase a scanned VIN, drop separators and fix illegal characters"""
+    cleaned = _NON_ALPHANUMERIC.sub("", (vin or "").upper())
+    return cleaned.translate(_NOISE_TRANSLATION)
+
+
+def vin_fragments(vin: str) -> Dict[str, str]:
+    """Indexed fields derived from a VIN, stored alongside the vehicle"""
+    normalized = normalize_scanned_vin(vin)
+    return {
+        "vin_normalized": normalized,
+        "vin_last8": normalized[-LAST8_LENGTH:],
+        "vin_reversed": normalized[::-1],
+    }
+
+
+def _lookup_filter(mode: str, value: str) -> Dict[str, Any]:
+    if mode == "exact":
+        return {"vin_normalized": value}
+    if mode == "last8":
+        return {"vin_last8": value}
+    if mode == "prefix":
+        return {"vin_normalized": {"$regex": f"^{re.escape(value)}"}}
+    if mode == "suffix":
+        return {"vin_reversed": {"$regex": f"^{re.escape(value[::-1])}"}}
+    raise ValueError(f"Unsupported lookup mode: {mode}")
+
+
+def resolve_mode(mode: str, value: str) -> str:
+    """Pick the lookup strategy for a query; auto guesses from its length"""
+    if mode not in LOOKUP_MODES:
+        raise ValueError(f"Unsupported lookup mode: {mode}")
+    if mode == "auto":
+        if len(value) == 17:
+            return "exact"
+        if len(value) == LAST8_LENGTH:
+            return "last8"
+        mode = "prefix"
+    if mode in ("prefix", "suffix") and len(value) < MIN_FRAGMENT_LENGTH:
+        raise ValueError(f"VIN fragment {value} is shorter than {MIN_FRAGMENT_LENGTH} characters")
+    return mode
+
+
+def _matches(mode: str, value: str, vehicle: Dict[str, Any]) -> bool:
+    normalized = vehicle.get("vin_normalized", "")
+    if mode == "exact":
+        return normalized == value
+    if mode == "last8":
+        return vehicle.get("vin_last8") == value
+    if mode == "prefix":
+        return normalized.startswith(value)
+    return normalized.endswith(value)
+
+
+async def lookup_vins(
+    queries: List[str],
+    mode: str = "auto",
+    dealer_id: Optional[str] = None,
+    limit: int = MAX_MATCHES_PER_QUERY,
+) -> List[Dict[str, Any]]:
+    """Resolve many scanned VINs with one query per exact or last-8 batch and per fragment"""
+    resolved = []
+    for query in queries:
+        value = normalize_scanned_vin(query)
+        resolved.append((query, value, resolve_mode(mode, value) if value else None))
+
+    # Exact and last-8 reads share one $in per mode; each fragment gets its own limited
+    # query, since a shared limit would let one broad fragment crowd out the others
+    lookups: Dict[tuple, Dict[str, Any]] = {}
+    for _, value, value_mode in resolved:
+        if value_mode in _BATCHED_FIELDS:
+            field = _BATCHED_FIELDS[value_mode]
+            lookups.setdefault((value_mode, None), {field: {"$in": []}})[field]["$in"].append(value)
+        elif value_mode:
+            lookups[(value_mode, value)] = _lookup_filter(value_mode, value)
+
+    async def run(key: tuple, filter_dict: Dict[str, Any]):
+        if dealer_id:
+            filter_dict["dealer_id"] = dealer_id
+        cursor = vehicles_collection.find(filter_dict, **find_options())
+        if key[1] is not None:
+            # One extra match is enough to flag the fragment as ambiguous
+            cursor = cursor.limit(limit + 1)
+        return key, [from_document(vehicle) for vehicle in await cursor.to_list(length=None)]
+
+    found = dict(await asyncio.gather(*(run(key, filter_dict) for key, filter_dict in lookups.items())))
+
+    results = []
+    for query, value, value_mode in resolved:
+        candidates = [
+            vehicle for vehicle in found.get((value_mode, None if value_mode in _BATCHED_FIELDS else value), [])
+            if _matches(value_mode, value, vehicle)
+        ] if value_mode else []
+        results.append({
+            "query": query,
+            "normalized": value,
+            "mode": value_mode,
+            "matches": candidates[:limit],
+            "ambiguous": len(candidates) > 1,
+        })
+    return results
+
+
+async def backfill_vin_fragments(batch_size: int = 1000):
+    """Populate VIN fragments on vehicles created before they were stored"""
+    updated = 0
+    operations = []
+    cursor = vehicles_collection.find({"vin_normalized": {"$exists": False}}, {"_id": 1, "vin": 1})
+    async for vehicle in cursor:
+        operations.append(UpdateOne({"_id": vehicle["_id"]}, {"$set": vin_fragments(vehicle.get("vin", ""))}))
+        if len(operations) >= batch_size:
+            await vehicles_collection.bulk_write(operations, ordered=False)
+            updated += len(operations)
+            operations = []
+    if operations:
+        await vehicles_collection.bulk_write(operations, ordered=False)
+        updated += len(operations)
+    if updated:
+        logger.info(f"Backfilled VIN fragments on {updated} vehicles")
+    return updated
+
+
+class NFCTagCache:
+    """Bounded LRU map of NFC tag id to vehicle id and VIN, each entry kept for `ttl` seconds"""
+
+    def __init__(self, capacity: int, ttl: float = NFC_TAG_CACHE_TTL):
+        self.capacity = capacity
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, str]]" = OrderedDict()
+        self._expires_at: Dict[str, float] = {}
+
+    def get(self, tag_id: str) -> Optional[Dict[str, str]]:
+        entry = self._entries.get(tag_id)
+        if entry is None:
+            return None
+        if self._expires_at[tag_id] <= time.monotonic():
+            self.discard(tag_id)
+            return None
+        self._entries.move_to_end(tag_id)
+        return entry
+
+    def put(self, tag_id: Optional[str], vehicle_id: str, vin: str):
+        if not tag_id:
+            return
+        self._entries[tag_id] = {"vehicle_id": vehicle_id, "vin": vin}
+        self._expires_at[tag_id] = time.monotonic() + self.ttl
+        self._entries.move_to_end(tag_id)
+        while len(self._entries) > self.capacity:
+            evicted, _ = self._entries.popitem(last=False)
+            self._expires_at.pop(evicted, None)
+
+    def discard(self, tag_id: Optional[str]):
+        if tag_id:
+            self._entries.pop(tag_id, None)
+            self._expires_at.pop(tag_id, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+    async def warm(self):
+        """Load the most recently updated tags up to capacity"""
+        cursor = vehicles_collection.find(
+            {"nfc_tag_id": {"$ne": None}},
+            {"id": 1, "vin": 1, "nfc_tag_id": 1}
+        ).sort("updated_at", 1)
+        async for vehicle in cursor:
+            from_document(vehicle)
+            self.put(vehicle["nfc_tag_id"], vehicle["id"], vehicle["vin"])
+        logger.info(f"NFC tag cache warmed with {len(self)} tags")
+
+    async def resolve(self, tag_id: str) -> Optional[Dict[str, str]]:
+        """Resolve a tag from memory, falling back to Mongo on a miss"""
+        entry = self.get(tag_id)
+        if entry is not None:
+            return entry
+        vehicle = from_document(await vehicles_collection.find_one(
+            {"nfc_tag_id": tag_id},
+            {"id": 1, "vin": 1}
+        ))
+        if not vehicle:
+            return None
+        self.put(tag_id, vehicle["id"], vehicle["vin"])
+        return self.get(tag_id)
+
+
+nfc_tag_cache = NFCTagCache(int(os.environ.get("NFC_TAG_CACHE_SIZE", "200000")))
@@ -0,0 +1,65 @@
+// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.19;
+
+import "@openzeppelin/contracts/token/ERC20/IERC20.sol";
+import "@openzeppelin/contracts/token/ERC20/utils/SafeERC20.sol";
+import "@openzeppelin/contracts/access/Ownable.sol";
+import "@openzeppelin/contracts/utils/cryptography/MerkleProof.sol";
+
+/// @notice Settles batched ANVL dealer rewards with one Merkle root per epoch.
+/// Leaves are keccak256(bytes.concat(keccak256(abi.encode(account, amount)))),
+/// matching the tree built by the backend reward batching pipeline.
+contract ANVLRewardDistributor is Ownable(msg.sender) {
+    using SafeERC20 for IERC20;
+    
+    IERC20 public immutable anvlToken;
+    
+    mapping(uint256 => bytes32) public merkleRoots;
+    mapping(uint256 => uint256) public epochTotals;
+    mapping(uint256 => mapping(address => bool)) public claimed;
+    
+    event EpochPublished(uint256 indexed epoch, bytes32 root, uint256 total);
+    event RewardClaimed(uint256 indexed epoch, address indexed account, uint256 amount);
+    
+    constructor(address _anvlToken) {
+        anvlToken = IERC20(_anvlToken);
+    }
+    
+    function publishRoot(uint256 epoch, bytes32 root, uint256 total) external onlyOwner {
+        require(merkleRoots[epoch] == bytes32(0), "Epoch already published");
+        require(root != bytes32(0), "Empty root");
+        merkleRoots[epoch] = root;
+        epochTotals[epoch] = total;
+        emit EpochPublished(epoch, root, total);
+    }
+    
+    function claim(uint256 epoch, address account, uint256 amount, bytes32[] calldata proof) public {
+        require(!claimed[epoch][account], "Already claimed");
+        bytes32 root = merkleRoots[epoch];
+        require(root != bytes32(0), "Unknown epoch");
+        
+        bytes32 leaf = keccak256(bytes.concat(keccak256(abi.encode(account, amount))));
+        require(MerkleProof.verifyCalldata(proof, root, leaf), "Invalid proof");
+        
+        claimed[epoch][account] = true;
+        anvlToken.safeTransfer(account, amount);
+        
+        emit RewardClaimed(epoch, account, amount);
+    }
+    
+    function claimMultiple(
+        uint256[] calldata epochs,
+        address account,
+        uint256[] calldata amounts,
+        bytes32[][] calldata proofs
+    ) external {
+        require(epochs.length == amounts.length && epochs.length == proofs.length, "Length mismatch");
+        for (uint256 i = 0; i < epochs.length; i++) {
+            claim(epochs[i], account, amounts[i], proofs[i]);
+        }
+    }
+    
+    function withdrawTokens(uint256 amount) external onlyOwner {
+        anvlToken.safeTransfer(owner(), amount);
+    }
+}
@@ -52,6 +52,13 @@ async function main() {
   await anvlToken.transfer(anvlPresale.address, presaleAllocation);
   console.log("✅ Transferred 200M ANVL tokens to presale contract");
 
+  // Deploy Reward Distributor
+  console.log("\n5. Deploying ANVL Reward Distributor...");
+  const ANVLRewardDistributor = await hre.ethers.getContractFactory("ANVLRewardDistributor");
+  const rewardDistributor = await ANVLRewardDistributor.deploy(anvlToken.address);
+  await rewardDistributor.deployed();
+  console.log("✅ ANVL Reward Distributor deployed to:", rewardDistributor.address);
+
   // Save deployment info
   const deploymentInfo = {
     network: network.name,
@@ -67,6 +74,9 @@ async function main() {
         address: anvlPresale.address,
         presaleAllocation: hre.ethers.utils.formatEther(presaleAllocation),
         usdcAddress: usdcAddress
+      },
+      ANVLRewardDistributor: {
+        address: rewardDistributor.address
       }
     }
   };
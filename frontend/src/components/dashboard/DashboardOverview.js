@@ -19,9 +19,7 @@ import { dealerAPI } from '../../services/api';
 
 const DashboardOverview = () => {
   const { dealer } = useAuth();
-  const [loans, setLoans] = useState([]);
-  const [vehicles, setVehicles] = useState([]);
-  const [notifications, setNotifications] = useState([]);
+  const [dashboard, setDashboard] = useState(null);
   const [isLoading, setIsLoading] = useState(true);
 
   useEffect(() => {
@@ -30,15 +28,8 @@ const DashboardOverview = () => {
       
       try {
         setIsLoading(true);
-        const [loansRes, vehiclesRes, notificationsRes] = await Promise.all([
-          dealerAPI.getDealerLoans(dealer.id),
-          dealerAPI.getDealerVehicles(dealer.id),
-          dealerAPI.getDealerNotifications(dealer.id)
-        ]);
-
-        setLoans(loansRes.data || []);
-        setVehicles(vehiclesRes.data || []);
-        setNotifications(notificationsRes.data || []);
+        const dashboardRes = await dealerAPI.getDealerDashboard(dealer.id);
+        setDashboard(dashboardRes.data || null);
       } catch (error) {
         console.error('Error fetching dashboard data:', error);
       } finally {
@@ -49,10 +40,11 @@ const DashboardOverview = () => {
     fetchDashboardData();
   }, [dealer?.id]);
 
-  const activeLoans = loans.filter(loan => loan.status === 'active');
-  const totalOutstanding = activeLoans.reduce((sum, loan) => sum + (loan.remaining_balance || 0), 0);
-  const vehiclesOnLot = vehicles.filter(vehicle => vehicle.status === 'on_lot').length;
-  const recentNotifications = notifications.slice(0, 3);
+  const summary = dashboard?.stats || {};
+  const activeLoans = dashboard?.active_loans || [];
+  const totalOutstanding = summary.total_outstanding || 0;
+  const vehiclesOnLot = summary.vehicles_on_lot || 0;
+  const recentNotifications = dashboard?.recent_notifications || [];
 
   const stats = [
     {
@@ -65,7 +57,7 @@ const DashboardOverview = () => {
     },
     {
       title: 'Active Loans',
-      value: activeLoans.length,
+      value: summary.active_loans || 0,
       icon: CreditCard,
       color: 'text-blue-400',
       bgColor: 'bg-blue-500/10',
@@ -81,7 +73,7 @@ const DashboardOverview = () => {
     },
     {
       title: 'ANVL Tokens',
-      value: dealer?.anvl_tokens || 0,
+      value: summary.anvl_tokens ?? dealer?.anvl_tokens ?? 0,
       icon: Coins,
       color: 'text-amber-400',
       bgColor: 'bg-amber-500/10',
@@ -151,7 +143,7 @@ const DashboardOverview = () => {
           </CardHeader>
           <CardContent className="space-y-4">
             <div className="space-y-3">
-              {activeLoans.slice(0, 3).map((loan) => (
+              {activeLoans.map((loan) => (
                 <div key={loan.id} className="p-3 sm:p-4 bg-gray-800 rounded-lg border border-gray-700">
                   <div className="flex flex-col sm:flex-row sm:items-center sm:justify-between gap-2">
                     <div className="min-w-0 flex-1">
@@ -240,20 +232,19 @@ const DashboardOverview = () => {
           <div className="grid grid-cols-1 sm:grid-cols-3 gap-4">
             <div className="text-center p-4 bg-emerald-500/10 border border-emerald-500/20 rounded-lg">
               <div className="text-2xl lg:text-3xl font-bold text-emerald-400">
-                {vehicles.filter(v => v.status === 'on_lot').length}
+                {vehiclesOnLot}
               </div>
               <div className="text-sm text-gray-400 mt-1">On Lot</div>
             </div>
             <div className="text-center p-4 bg-blue-500/10 border border-blue-500/20 rounded-lg">
               <div className="text-2xl lg:text-3xl font-bold text-blue-400">
-                {vehicles.filter(v => v.status === 'sold').length}
+                {summary.vehicles_sold || 0}
               </div>
               <div className="text-sm text-gray-400 mt-1">Sold</div>
             </div>
             <div className="text-center p-4 bg-yellow-500/10 border border-yellow-500/20 rounded-lg">
               <div className="text-2xl lg:text-3xl font-bold text-yellow-400">
-                {vehicles.filter(v => v.last_audit && 
-                  new Date(v.last_audit) < new Date(Date.now() - 24 * 60 * 60 * 1000)).length}
+                {summary.vehicles_need_audit || 0}
               </div>
               <div className="text-sm text-gray-400 mt-1">Need Audit</div>
             </div>
@@ -65,6 +65,32 @@ export const dealerAPI = {
     return response.data;
   },
 
+  getDealerDashboard: async (dealerId) => {
+    if (USE_MOCK_DATA) {
+      const activeLoans = mockLoans.filter(loan => loan.status === 'active');
+      return {
+        data: {
+          dealer: mockDealer,
+          stats: {
+            total_outstanding: activeLoans.reduce((sum, loan) => sum + (loan.remaining_balance || 0), 0),
+            active_loans: activeLoans.length,
+            vehicles_on_lot: mockVehicles.filter(v => v.status === 'on_lot').length,
+            vehicles_sold: mockVehicles.filter(v => v.status === 'sold').length,
+            vehicles_need_audit: mockVehicles.filter(v => v.last_audit &&
+              new Date(v.last_audit) < new Date(Date.now() - 24 * 60 * 60 * 1000)).length,
+            unread_notifications: mockNotifications.filter(n => !n.read).length,
+            anvl_tokens: mockDealer.anvl_tokens
+          },
+          active_loans: activeLoans.slice(0, 3),
+          recent_notifications: mockNotifications.slice(0, 3),
+          recent_transactions: mockTransactions.slice(0, 5)
+        }
+      };
+    }
+    const response = await api.get(`/dealers/${dealerId}/dashboard`);
+    return response.data;
+  },
+
   getDealerLoans: async (dealerId) => {
     if (USE_MOCK_DATA) {
       return { data: mockLoans };
@@ -118,6 +144,16 @@ export const loansAPI = {
     return response.data;
   },
 
+  getLoanDetail: async (loanId) => {
+    const response = await api.get(`/loans/${loanId}/detail`);
+    return response.data;
+  },
+
+  getLoansWithCollateral: async (params = {}) => {
+    const response = await api.get('/loans/collateral', { params });
+    return response.data;
+  },
+
   updateLoan: async (loanId, updateData) => {
     const response = await api.put(`/loans/${loanId}`, updateData);
     return response.data;
@@ -128,6 +164,11 @@ export const loansAPI = {
     return response.data;
   },
 
+  approveLoansBatch: async (loanIds) => {
+    const response = await api.post('/loans/approve-batch', { loan_ids: loanIds });
+    return response.data;
+  },
+
   makePayment: async (loanId, paymentAmount, method = 'ACH') => {
     const response = await api.post(`/loans/${loanId}/payment`, null, {
       params: { payment_amount: paymentAmount, method }
@@ -148,6 +189,21 @@ export const vehiclesAPI = {
     return response.data;
   },
 
+  bulkImportVehicles: async (file, dealerId) => {
+    const formData = new FormData();
+    formData.append('file', file);
+    const response = await api.post('/vehicles/bulk', formData, {
+      params: { dealer_id: dealerId },
+      headers: { 'Content-Type': 'multipart/form-data' }
+    });
+    return response.data;
+  },
+
+  searchVehicles: async (params = {}) => {
+    const response = await api.get('/vehicles/search', { params });
+    return response.data;
+  },
+
   getVehicle: async (vehicleId) => {
     const response = await api.get(`/vehicles/${vehicleId}`);
     return response.data;
@@ -158,6 +214,13 @@ export const vehiclesAPI = {
     return response.data;
   },
 
+  lookupVins: async (vins, mode = 'auto', dealerId = null) => {
+    const response = await api.post('/vehicles/vin/lookup', {
+      vins, mode, dealer_id: dealerId
+    });
+    return response.data;
+  },
+
   updateVehicle: async (vehicleId, updateData) => {
     const response = await api.put(`/vehicles/${vehicleId}`, updateData);
     return response.data;
@@ -277,6 +340,74 @@ export const transactionsAPI = {
   },
 };
 
+// Analytics API
+export const analyticsAPI = {
+  getPortfolioRollups: async (params = {}) => {
+    const response = await api.get('/analytics/portfolio', { params });
+    return response.data;
+  },
+
+  getLatestPortfolio: async (dealerId = null) => {
+    const response = await api.get('/analytics/portfolio/latest', {
+      params: { dealer_id: dealerId }
+    });
+    return response.data;
+  },
+
+  recomputePortfolio: async (start, end = null, dealerId = null) => {
+    const response = await api.post('/analytics/portfolio/recompute', null, {
+      params: { start, end, dealer_id: dealerId }
+    });
+    return response.data;
+  },
+
+  getOutOfTrustFindings: async (params = {}) => {
+    const response = await api.get('/analytics/out-of-trust', { params });
+    return response.data;
+  },
+};
+
+// Presale API (served from indexed contract events)
+export const presaleAPI = {
+  getSummary: async () => {
+    const response = await api.get('/presale/summary');
+    return response.data;
+  },
+
+  getWalletPurchases: async (walletAddress) => {
+    const response = await api.get(`/presale/wallet/${walletAddress}`);
+    return response.data;
+  },
+};
+
+// Rewards API
+export const rewardsAPI = {
+  getEpochs: async (limit = 20) => {
+    const response = await api.get('/rewards/epochs', { params: { limit } });
+    return response.data;
+  },
+
+  getDealerProofs: async (dealerId) => {
+    const response = await api.get(`/rewards/dealer/${dealerId}/proofs`);
+    return response.data;
+  },
+
+  getDealerPendingRewards: async (dealerId) => {
+    const response = await api.get(`/rewards/dealer/${dealerId}/pending`);
+    return response.data;
+  },
+};
+
+// Sync API
+export const syncAPI = {
+  syncVehicles: async (dealerId, since = null, limit = 500) => {
+    const response = await api.get('/sync', {
+      params: { dealer_id: dealerId, since: since || undefined, limit }
+    });
+    return response.data;
+  },
+};
+
 // Health check
 export const healthAPI = {
   check: async () => {
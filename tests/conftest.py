@@ -0,0 +1,12 @@
+import os
+
+import pytest
+
+# backend.database builds its Mongo client when imported; the client only connects on first use
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "anvl_test")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
@@ -0,0 +1,81 @@
+from pathlib import Path
+
+import pytest
+
+from backend.services import ach_reconciliation as ach
+
+FIXTURE = Path(__file__).parent / "fixtures" / "ach_mixed.ach"
+
+
+async def _chunks(data: bytes, size: int):
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+async def _parse(data: bytes, size: int = 64):
+    reconciler = ach.AchReconciler()
+    entries = [entry async for entry in reconciler.parser.entries(ach.iter_records(_chunks(data, size)))]
+    return reconciler, entries
+
+
+def _fixture(blocked: bool = False) -> bytes:
+    data = FIXTURE.read_bytes()
+    return data.replace(b"\r\n", b"") if blocked else data
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("blocked", [False, True])
+@pytest.mark.parametrize("size", [7, 94, 65536])
+async def test_parses_entries_and_addenda_across_chunks(blocked, size):
+    reconciler, entries = await _parse(_fixture(blocked), size)
+
+    assert reconciler.parser.batches == 1
+    assert [entry["trace"] for entry in entries] == ["091000010000001", "091000010000002", "091000010000003"]
+
+    settlement, returned, change = entries
+    assert settlement["transaction_code"] == "27"
+    assert settlement["amount_cents"] == 5000
+    assert ach.loan_reference(settlement) == "L1"
+    assert settlement["addenda"] == []
+
+    assert returned["addenda"][0]["type"] == ach.RETURN_ADDENDA
+    assert returned["addenda"][0]["reason"] == "R01"
+    assert returned["addenda"][0]["original_trace"] == "091000019999991"
+
+    assert change["addenda"][0]["type"] == ach.CHANGE_ADDENDA
+    assert change["addenda"][0]["reason"] == "C01"
+    assert change["addenda"][0]["corrected"] == "98765432109876543"
+
+
+@pytest.mark.anyio
+async def test_reports_batch_control_mismatch():
+    reconciler, _ = await _parse(_fixture())
+
+    assert reconciler.exception_counts == {ach.CONTROL_MISMATCH: 1}
+    problem = reconciler.exceptions[0]
+    assert problem["line"] == 8
+    assert problem["detail"] == "Batch 0000001 total debits is 7501, entries add up to 7500"
+
+
+@pytest.mark.anyio
+async def test_routes_settlements_returns_and_notices(monkeypatch):
+    settled, reversed_ = [], []
+
+    async def settle(self, entries):
+        settled.extend(entries)
+
+    async def reverse(self, entries):
+        reversed_.extend(entries)
+
+    monkeypatch.setattr(ach.AchReconciler, "_settle", settle)
+    monkeypatch.setattr(ach.AchReconciler, "_reverse", reverse)
+
+    summary = await ach.reconcile_ach_file(_chunks(_fixture(), 1024))
+
+    assert [entry["trace"] for entry in settled] == ["091000010000001"]
+    assert [entry["trace"] for entry in reversed_] == ["091000010000002"]
+    assert summary["entries"] == 3
+    assert summary["exceptions_by_reason"] == {ach.CONTROL_MISMATCH: 1, ach.NOTIFICATION_OF_CHANGE: 1}
+    notice = next(e for e in summary["exception_report"] if e["reason"] == ach.NOTIFICATION_OF_CHANGE)
+    assert notice["trace"] == "091000010000003"
+    assert notice["detail"] == "C01: 98765432109876543"
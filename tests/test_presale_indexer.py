@@ -0,0 +1,119 @@
+import asyncio
+import shutil
+import socket
+import subprocess
+import time
+from decimal import Decimal
+
+import pytest
+
+from backend.database import client, presale_events_collection, indexer_checkpoints_collection
+from backend.services.eth_rpc import JsonRpcClient, encode_address, encode_uint256
+from backend.services.presale_indexer import (
+    PresaleIndexer, TOKENS_PURCHASED_TOPIC, TOKENS_CLAIMED_TOPIC,
+    PRESALE_CAP_UPDATED_TOPIC, CLAIM_ENABLED_UPDATED_TOPIC,
+    anvl_for_usdc, presale_summary, wallet_purchases
+)
+
+CONFIRMATIONS = 2
+BUYER = "0x" + "ab" * 20
+
+# Stands in for ANVLPresale without a Solidity compiler: any call emits a log with
+# topic0 = calldata[0:32], topic1 = calldata[32:64] unless zero, data = calldata[64:]
+EMITTER_RUNTIME = "6040360380604060003760003560203580601a5750906000a1005b916000a200"
+EMITTER_INIT = "6020600c60003960206000f3" + EMITTER_RUNTIME
+
+
+@pytest.fixture
+def anvil_url():
+    anvil = shutil.which("anvil")
+    if anvil is None:
+        pytest.skip("anvil is not installed")
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    process = subprocess.Popen(
+        [anvil, "--port", str(port), "--silent"], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+    )
+    url = f"http://127.0.0.1:{port}"
+    try:
+        deadline = time.monotonic() + 10
+        while True:
+            try:
+                asyncio.run(JsonRpcClient(url, timeout=1).block_number())
+                break
+            except Exception:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+        yield url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
+
+
+@pytest.fixture
+async def mongo():
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), 2)
+    except Exception:
+        pytest.skip("MongoDB is not reachable at MONGO_URL")
+
+
+async def _deploy(rpc: JsonRpcClient, sender: str) -> str:
+    tx_hash = await rpc.call("eth_sendTransaction", [{"from": sender, "data": "0x" + EMITTER_INIT}])
+    receipt = await rpc.wait_for_receipt(tx_hash, poll_interval=0.1)
+    return receipt["contractAddress"].lower()
+
+
+async def _emit(rpc: JsonRpcClient, sender: str, contract: str, topic: str, indexed: bytes, *values: int):
+    data = bytes.fromhex(topic[2:]) + indexed + b"".join(encode_uint256(value) for value in values)
+    await rpc.wait_for_receipt(await rpc.send_transaction(sender, contract, data), poll_interval=0.1)
+
+
+async def _mine(rpc: JsonRpcClient, blocks: int):
+    for _ in range(blocks):
+        await rpc.call("evm_mine")
+
+
+@pytest.mark.anyio
+async def test_indexes_confirmed_events_and_rewinds_reorgs(anvil_url, mongo):
+    rpc = JsonRpcClient(anvil_url)
+    sender = (await rpc.call("eth_accounts"))[0]
+    contract = await _deploy(rpc, sender)
+    indexer = PresaleIndexer(rpc, contract, confirmations=CONFIRMATIONS, block_range=2)
+    await presale_events_collection.delete_many({"contract": contract})
+    await indexer_checkpoints_collection.delete_many({"_id": indexer.checkpoint_id})
+
+    usdc = 1000 * 10**6
+    await _emit(rpc, sender, contract, TOKENS_PURCHASED_TOPIC, encode_address(BUYER), usdc, anvl_for_usdc(usdc))
+    await _emit(rpc, sender, contract, PRESALE_CAP_UPDATED_TOPIC, bytes(32), 5_000_000 * 10**6)
+
+    # Not yet CONFIRMATIONS blocks deep
+    assert (await indexer.run_once())["events"] == 0
+
+    await _mine(rpc, CONFIRMATIONS)
+    assert (await indexer.run_once())["events"] == 2
+    summary = await presale_summary(contract)
+    assert Decimal(summary["total_raised"]) == 1000
+    assert Decimal(summary["total_sold"]) == 5000
+    assert Decimal(summary["presale_cap"]) == 5_000_000
+    assert (summary["purchases"], summary["buyers"]) == (1, 1)
+
+    # Index a claim, then reorg it away
+    snapshot = await rpc.call("evm_snapshot")
+    await _emit(rpc, sender, contract, TOKENS_CLAIMED_TOPIC, encode_address(BUYER), anvl_for_usdc(usdc))
+    await _mine(rpc, CONFIRMATIONS)
+    assert (await indexer.run_once())["events"] == 1
+    assert (await wallet_purchases(BUYER))["claimed"]
+
+    await rpc.call("evm_revert", [snapshot])
+    await _emit(rpc, sender, contract, CLAIM_ENABLED_UPDATED_TOPIC, bytes(32), 1)
+    await _mine(rpc, CONFIRMATIONS + 1)
+    result = await indexer.run_once()
+
+    assert result["indexed_through"] == result["head"] - CONFIRMATIONS
+    events = await presale_events_collection.find({"contract": contract}).to_list(length=None)
+    assert sorted(event["event"] for event in events) == ["ClaimEnabledUpdated", "PresaleCapUpdated", "TokensPurchased"]
+    assert not (await wallet_purchases(BUYER))["claimed"]
+    assert (await presale_summary(contract))["claim_enabled"] is True
@@ -0,0 +1,58 @@
+import asyncio
+import uuid
+
+import pytest
+
+from backend.database import client, vehicles_collection
+from backend.services import sync
+from backend.services.sync import changes_since, reserve_sequence, sequence_window
+
+
+@pytest.fixture
+async def mongo():
+    try:
+        await asyncio.wait_for(client.admin.command("ping"), 2)
+    except Exception:
+        pytest.skip("MongoDB is not reachable at MONGO_URL")
+
+
+async def _write(dealer_id: str, seq: int) -> str:
+    vehicle_id = str(uuid.uuid4())
+    await vehicles_collection.insert_one({"id": vehicle_id, "dealer_id": dealer_id, "vin": vehicle_id, "sync_seq": seq})
+    return vehicle_id
+
+
+@pytest.mark.anyio
+async def test_token_waits_for_reservations_committed_out_of_order(mongo, monkeypatch):
+    dealer_id = str(uuid.uuid4())
+    token = str((await sequence_window())[0])
+    pending = {}
+
+    async def window_then_interleave(*args, **kwargs):
+        # Two writes reserve right after the page reads the counter, and the later one commits first
+        window = await sequence_window(*args, **kwargs)
+        pending["first"] = reserve_sequence()
+        pending["seq"] = await pending["first"].__aenter__()
+        async with reserve_sequence() as later:
+            pending["later_id"] = await _write(dealer_id, later)
+        return window
+
+    monkeypatch.setattr(sync, "sequence_window", window_then_interleave)
+    page = await changes_since(dealer_id, token)
+    monkeypatch.undo()
+
+    # The committed later write is beyond the counter the page read, so it is not returned yet
+    assert "later_id" in pending
+    assert page["vehicles"] == [] and page["next_token"] == token
+
+    # The earlier reservation is still in flight, so the later write keeps waiting
+    page = await changes_since(dealer_id, token)
+    assert page["vehicles"] == [] and page["next_token"] == token
+
+    first_id = await _write(dealer_id, pending["seq"])
+    await pending["first"].__aexit__(None, None, None)
+    page = await changes_since(dealer_id, token)
+    assert [vehicle["id"] for vehicle in page["vehicles"]] == [first_id, pending["later_id"]]
+    assert page["next_token"] == str(pending["seq"] + 1)
+
+    await vehicles_collection.delete_many({"dealer_id": dealer_id})